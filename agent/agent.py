@@ -1,44 +1,292 @@
 from __future__ import annotations
 
-import json
-import re
+import asyncio
 import time
+from collections import Counter, defaultdict
+from typing import Callable
 
-from openai import OpenAI
+from openai import AsyncOpenAI
 
-from agent.config import SYSTEM_PROMPT
+from agent.config import (
+    ACTION_REASKS,
+    HISTORY_TOKEN_BUDGET,
+    STREAM_COMPLETIONS,
+    STRUCTURED_OUTPUT,
+    SYSTEM_PROMPT,
+)
+from agent.events import ConsoleSink, RunEvents
+from agent.history import History
+from agent.parsing import ACTION_SCHEMA, ActionParseError, ActionStream, parse_action
+
+
+def _retry_after(error: Exception) -> float | None:
+    """Seconds from a Retry-After header on an API error, if there is one."""
+    response = getattr(error, "response", None)
+    value = getattr(response, "headers", {}).get("retry-after") if response else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    """
+    Shared 429 back-off for every agent using the same endpoint.
+
+    When one call is rate limited, every caller pauses until the back-off
+    window has passed instead of each discovering the limit on its own.
+    """
+
+    def __init__(self):
+        self._resume_at = 0.0
+        self.backoffs = 0
+
+    async def wait(self):
+        delay = self._resume_at - time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._resume_at - time.monotonic()
+
+    def backoff(self, seconds: float):
+        self.backoffs += 1
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+
+# ── Structured output ─────────────────────────────────────────────────────────
+
+# Tried in this order; an endpoint that rejects one falls back to the next
+_STRUCTURED_MODES = ("json_schema", "json_object", "off")
+
+# Mode each (endpoint, model) last accepted, so a fallback is learned once
+# per process rather than per run
+_structured_modes: dict[tuple[str, str], str] = {}
+
+# Action-parsing counters per model (see action_parse_stats)
+_parse_counts: defaultdict[str, Counter] = defaultdict(Counter)
+
+
+def _response_format(mode: str) -> dict:
+    if mode == "json_schema":
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": "agent_action", "schema": ACTION_SCHEMA},
+        }
+    return {"type": "json_object"}
+
+
+def _rejects_response_format(error: Exception) -> bool:
+    """
+    Whether an API error says the endpoint doesn't support response_format:
+    a 400 that names it. Other errors (a bad query, a schema in the prompt)
+    must not silently turn structured output off.
+    """
+    if getattr(error, "status_code", None) != 400:
+        return False
+    text = str(error).lower()
+    return any(word in text for word in ("response_format", "json_schema", "json_object"))
+
+
+def action_parse_stats() -> dict:
+    """Per-model action parsing counters and failure rates, for GET /stats."""
+    stats = {}
+    for model, counts in _parse_counts.items():
+        replies = counts["replies"]
+        stats[model] = {
+            **{
+                k: counts[k]
+                for k in ("replies", "repaired", "parse_errors", "reasks", "reask_fixed", "failed")
+            },
+            "parse_failure_rate": round(counts["parse_errors"] / replies, 4) if replies else 0.0,
+            "unrecovered_rate": round(counts["failed"] / replies, 4) if replies else 0.0,
+            # Modes in use per endpoint, if any fell back from STRUCTURED_OUTPUT
+            "structured_modes": sorted(
+                {mode for (_, m), mode in _structured_modes.items() if m == model}
+                or {STRUCTURED_OUTPUT}
+            ),
+        }
+    return stats
 
 
 class DataAgent:
     """LLM-powered agent that decides queries based on a user goal."""
 
-    def __init__(self, endpoint: str, model: str, api_key: str = "no-key"):
-        self.client = OpenAI(base_url=endpoint, api_key=api_key)
+    def __init__(
+        self,
+        endpoint: str,
+        model: str,
+        api_key: str = "no-key",
+        limiter: RateLimiter | None = None,
+        history_budget: int = HISTORY_TOKEN_BUDGET,
+        events: RunEvents | None = None,
+    ):
+        self.client = AsyncOpenAI(base_url=endpoint, api_key=api_key)
+        self.endpoint = endpoint
         self.model = model
-        self.history: list[dict] = []
+        self.limiter = limiter or RateLimiter()
+        self.history = History(history_budget)
+        # Progress (prompt sizes, retries, fallbacks) goes here — printed by default
+        self.events = events or RunEvents(ConsoleSink())
+
+    async def chat(
+        self,
+        user_message: str,
+        pinned: bool = False,
+        on_delta: Callable[[str], None] | None = None,
+    ) -> str:
+        """
+        Send a message to the LLM and get a response, as structured output
+        where the endpoint supports it (STRUCTURED_OUTPUT). Retries on 429.
+
+        ``pinned`` messages (the GOAL and schema) are never compacted out of
+        the history; see agent/history.py. With ``on_delta`` the reply is
+        streamed and each piece passed to it as it arrives.
+        """
+        self.history.append(
+            {"role": "user", "content": user_message}, "pinned" if pinned else "message",
+        )
+        messages = self.history.messages(SYSTEM_PROMPT)
+        self.events.emit("prompt", **self.history.last)
+        reply = await self.complete(messages, structured=True, on_delta=on_delta)
+        self.history.append({"role": "assistant", "content": reply})
+        return reply
+
+    async def next_action(
+        self,
+        user_message: str,
+        pinned: bool = False,
+        on_field: Callable[[str, object, dict], None] | None = None,
+        on_text: Callable[[str, str, dict], None] | None = None,
+    ) -> dict:
+        """
+        :meth:`chat`, then parse the reply into an action.
+
+        With STREAM_COMPLETIONS, ``on_field`` and ``on_text`` follow the
+        reply while it streams (see ActionStream) — the action they saw is
+        only final once this returns.
+
+        Replies the tolerant parser can't read are re-asked up to
+        ACTION_REASKS times — with only the bad reply and the parse error,
+        not the whole history — and the fixed reply replaces the bad one in
+        the history. Raises ActionParseError if the reply stays unreadable.
+        """
+        on_delta = None
+        if STREAM_COMPLETIONS and (on_field or on_text):
+            on_delta = ActionStream(on_field, on_text).feed
+        raw = await self.chat(user_message, pinned, on_delta)
+        counts = _parse_counts[self.model]
+        counts["replies"] += 1
+        try:
+            action, repaired = parse_action(raw)
+            counts["repaired"] += repaired
+            return action
+        except ActionParseError as e:
+            counts["parse_errors"] += 1
+            error = e
 
-    def chat(self, user_message: str) -> str:
-        """Send a message to the LLM and get a response. Retries on 429."""
-        self.history.append({"role": "user", "content": user_message})
+        for _ in range(ACTION_REASKS):
+            counts["reasks"] += 1
+            self.events.emit(
+                "notice", kind="reask", message=f"Unreadable action ({error}) — asking again",
+            )
+            retry = await self.complete([
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "assistant", "content": raw},
+                {
+                    "role": "user",
+                    "content": (
+                        f"Your reply could not be parsed: {error}. Reply with only "
+                        f"the corrected JSON action object, nothing else."
+                    ),
+                },
+            ], structured=True)
+            try:
+                action, _ = parse_action(retry)
+            except ActionParseError as e:
+                raw, error = retry, e
+                continue
+            counts["reask_fixed"] += 1
+            self.history.replace_last(retry)
+            return action
+
+        counts["failed"] += 1
+        raise ActionParseError(f"{error} — reply was: {raw[:300]}")
+
+    def add_result(self, content: str, fmt: str | None = None):
+        """Feed a tool result into history (compactable once it's no longer the latest)."""
+        self.history.append({"role": "user", "content": content}, "result", fmt)
 
-        for attempt in range(4):
+    @property
+    def structured_mode(self) -> str:
+        mode = _structured_modes.get((self.endpoint, self.model), STRUCTURED_OUTPUT)
+        return mode if mode in _STRUCTURED_MODES else "json_schema"
+
+    async def complete(
+        self,
+        messages: list[dict],
+        structured: bool = False,
+        on_delta: Callable[[str], None] | None = None,
+    ) -> str:
+        """
+        One chat completion for ``messages``, outside the history. Retries
+        on 429. ``structured`` asks for an action object via response_format,
+        falling back to the next mode if the endpoint rejects it. With
+        ``on_delta`` the completion is streamed to it piece by piece.
+        """
+        attempt = 0
+        parts: list[str] = []
+        while True:
+            mode = self.structured_mode if structured else "off"
+            extra = {} if mode == "off" else {"response_format": _response_format(mode)}
+            await self.limiter.wait()
             try:
-                resp = self.client.chat.completions.create(
+                if on_delta is None:
+                    resp = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=0.2,
+                        **extra,
+                    )
+                    return resp.choices[0].message.content.strip()
+
+                stream = await self.client.chat.completions.create(
                     model=self.model,
-                    messages=[{"role": "system", "content": SYSTEM_PROMPT}] + self.history,
+                    messages=messages,
                     temperature=0.2,
+                    stream=True,
+                    **extra,
                 )
-                reply = resp.choices[0].message.content.strip()
-                self.history.append({"role": "assistant", "content": reply})
-                return reply
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        on_delta(delta)
+                return "".join(parts).strip()
             except Exception as e:
-                if "429" in str(e) and attempt < 3:
-                    wait = (attempt + 1) * 5
-                    print(f"  ⏳  Rate limited — retrying in {wait}s …")
-                    time.sleep(wait)
+                if parts:
+                    # Part of the reply was already handed on — can't start over
+                    raise
+                if mode != "off" and _rejects_response_format(e):
+                    fallback = _STRUCTURED_MODES[_STRUCTURED_MODES.index(mode) + 1]
+                    self.events.emit(
+                        "notice", kind="fallback",
+                        message=f"{self.model} rejected {mode} output — using {fallback}",
+                    )
+                    _structured_modes[(self.endpoint, self.model)] = fallback
+                elif "429" in str(e) and attempt < 3:
+                    wait = _retry_after(e) or (attempt + 1) * 5
+                    self.events.emit(
+                        "notice", kind="rate_limited",
+                        message=f"Rate limited — retrying in {wait:g}s …",
+                    )
+                    self.limiter.backoff(wait)
+                    attempt += 1
                 else:
                     raise
 
+    async def close(self):
+        """Close the underlying HTTP client."""
+        await self.client.close()
+
     def add_error(self, error_msg: str):
         """Feed an error back into history so the LLM can recover."""
         self.history.append(
@@ -47,15 +295,8 @@ class DataAgent:
 
     @staticmethod
     def parse_action(text: str) -> dict | None:
-        """Extract the first JSON object from the LLM response."""
+        """The action in an LLM reply, or None (see agent/parsing.py)."""
         try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            pass
-        m = re.search(r"\{.*\}", text, re.DOTALL)
-        if m:
-            try:
-                return json.loads(m.group())
-            except json.JSONDecodeError:
-                pass
-        return None
+            return parse_action(text)[0]
+        except ActionParseError:
+            return None
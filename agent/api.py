@@ -5,16 +5,90 @@ Deploy to Google Cloud Run as a containerized service.
 """
 from __future__ import annotations
 
+import asyncio
+import contextlib
+import json
 import traceback
+from contextlib import asynccontextmanager
+from typing import Literal
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
-from agent.config import DEFAULT_ENDPOINT, DEFAULT_MODEL, DEFAULT_API_KEY
+from agent.agent import action_parse_stats
+from agent.audit_jobs import AuditJobs
+from agent.config import (
+    AUDIT_CONCURRENCY,
+    AUDIT_JOB_CHECKPOINT_SECONDS,
+    DEFAULT_API_KEY,
+    DEFAULT_ENDPOINT,
+    DEFAULT_MODEL,
+    RESULT_FORMAT,
+)
+from agent.events import ConsoleSink, EventQueue, RunEvents
+from agent.postgres_client import cache_stats, get_pool, invalidate_result_cache
 from agent.thufir import run_agent
-from agent.content import run_content_audit
 
-app = FastAPI(title="Thufir", description="Readonly data-retrieval agent API")
+
+# ── Lifespan ──────────────────────────────────────────────────────────────────
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Open one Postgres pool for the whole process and close it on shutdown.
+
+    Audit jobs left unfinished by a stopped instance are resumed from here
+    (see AuditJobs.watch), and running ones are stopped (still resumable)
+    before the pool closes.
+    """
+    app.state.pool = await get_pool()
+    app.state.audit_jobs = AuditJobs()
+    app.state.audit_jobs.watch(app.state.pool)
+    try:
+        yield
+    finally:
+        await app.state.audit_jobs.shutdown()
+        await app.state.pool.close()
+
+
+app = FastAPI(
+    title="Thufir",
+    description="Readonly data-retrieval agent API",
+    lifespan=lifespan,
+)
+
+
+# ── Client disconnects ────────────────────────────────────────────────────────
+
+# How often a running request checks whether its HTTP client is still there
+_DISCONNECT_POLL_SECONDS = 1.0
+
+
+class ClientDisconnected(Exception):
+    """The HTTP client went away before the work finished."""
+
+
+async def _cancel_on_disconnect(request: Request, coro):
+    """
+    Await ``coro``, cancelling it if the HTTP client disconnects first.
+
+    Cancelling the task cancels any in-flight asyncpg query on the server,
+    so an abandoned request stops holding a pool connection.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=_DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await task
 
 
 # ── Request / Response models ─────────────────────────────────────────────────
@@ -22,6 +96,10 @@ app = FastAPI(title="Thufir", description="Readonly data-retrieval agent API")
 class RunRequest(BaseModel):
     prompt: str = Field(..., description="Goal / task for the agent")
     max_steps: int = Field(default=10, ge=1, le=30, description="Max interaction steps")
+    result_format: Literal["json", "compact", "csv", "tsv", "markdown"] = Field(
+        default=RESULT_FORMAT,
+        description="Encoding for query results and schema sent to the LLM",
+    )
 
 
 class RunResponse(BaseModel):
@@ -40,8 +118,27 @@ class AuditRequest(BaseModel):
         description="Max problems to fetch (0 = all)",
     )
     batch_size: int = Field(
-        default=10, ge=1, le=50,
-        description="Problems per LLM batch",
+        default=100, ge=1, le=500,
+        description="Max field texts per LLM batch (batches are packed up to AUDIT_BATCH_TOKENS)",
+    )
+    concurrency: int = Field(
+        default=AUDIT_CONCURRENCY, ge=1, le=64,
+        description="LLM batches in flight at once",
+    )
+    refresh: bool = Field(
+        default=False,
+        description="Re-audit every problem instead of reusing stored findings",
+    )
+    lint_only: bool = Field(
+        default=False,
+        description="Only run the local markdown linter — no structural checks, no LLM",
+    )
+
+
+class InvalidateRequest(BaseModel):
+    tables: list[str] | None = Field(
+        default=None,
+        description="Drop cached results that read these tables (all results if omitted)",
     )
 
 
@@ -51,6 +148,20 @@ class AuditResponse(BaseModel):
     error: str | None = None
 
 
+class AuditJobResponse(BaseModel):
+    job_id: str
+    status: Literal["queued", "running", "done", "failed"]
+    params: dict | None = None
+    created_at: str | None = None
+    updated_at: str | None = None
+    attempts: int = 0
+    progress: dict | None = Field(
+        default=None,
+        description="Lessons read, LLM batches done / total, ETA and issues found so far",
+    )
+    error: str | None = None
+
+
 # ── Routes ────────────────────────────────────────────────────────────────────
 
 @app.get("/health")
@@ -58,16 +169,30 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/stats")
+async def stats():
+    """In-process cache counters and per-model action parsing metrics."""
+    return {**cache_stats(), "action_parsing": action_parse_stats()}
+
+
+@app.post("/cache/invalidate")
+async def cache_invalidate(req: InvalidateRequest = InvalidateRequest()):
+    """Hook for writers: drop cached query results for tables that changed."""
+    return {"dropped": invalidate_result_cache(req.tables)}
+
+
 @app.post("/run", response_model=RunResponse)
-async def run(req: RunRequest):
+async def run(req: RunRequest, request: Request):
     try:
-        result = await run_agent(
+        result = await _cancel_on_disconnect(request, run_agent(
             prompt=req.prompt,
             endpoint=DEFAULT_ENDPOINT,
             model=DEFAULT_MODEL,
             api_key=DEFAULT_API_KEY,
             max_steps=req.max_steps,
-        )
+            pool=request.app.state.pool,
+            result_format=req.result_format,
+        ))
 
         if result is None:
             return RunResponse(
@@ -77,26 +202,191 @@ async def run(req: RunRequest):
 
         return RunResponse(success=True, result=result)
 
+    except ClientDisconnected:
+        # Nobody is listening — 499 is nginx's "client closed request"
+        raise HTTPException(status_code=499, detail="Client disconnected")
+
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/audit", response_model=AuditResponse)
-async def audit(req: AuditRequest = AuditRequest()):
-    """Run a content audit across all courses, lessons, and problems."""
-    try:
-        report = await run_content_audit(
-            endpoint=DEFAULT_ENDPOINT,
-            model=DEFAULT_MODEL,
-            api_key=DEFAULT_API_KEY,
-            skip_llm=req.skip_llm,
-            problem_limit=req.problem_limit,
-            batch_size=req.batch_size,
-        )
+# With no event for this long, a comment line keeps proxies from closing the stream
+_SSE_KEEPALIVE_SECONDS = 15.0
 
-        return AuditResponse(success=True, report=report)
 
-    except Exception as e:
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+def _sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+@app.post("/run/stream")
+async def run_stream(req: RunRequest, request: Request):
+    """
+    Run the agent and stream its progress as Server-Sent Events — one per
+    event in agent/events.py, with the event type as ``event:`` and the
+    event as JSON in ``data:``. The last event is always ``done``, carrying
+    the answer or the error. The run is cancelled if the client disconnects.
+    """
+    queue = EventQueue()
+    # Keep printing to stdout too, so the run still shows up in the logs
+    events = RunEvents(ConsoleSink(), queue)
+
+    async def run():
+        try:
+            await run_agent(
+                prompt=req.prompt,
+                endpoint=DEFAULT_ENDPOINT,
+                model=DEFAULT_MODEL,
+                api_key=DEFAULT_API_KEY,
+                max_steps=req.max_steps,
+                pool=request.app.state.pool,
+                result_format=req.result_format,
+                events=events,
+            )
+        except Exception as e:
+            traceback.print_exc()
+            events.emit("error", message=str(e))
+            events.emit("done", success=False, error=str(e))
+        finally:
+            queue.close()
+
+    async def stream():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                try:
+                    event = await queue.get(timeout=_SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    break
+                yield _sse(event)
+        finally:
+            # The client went away mid-run: stop the run and its queries
+            if not task.done():
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError, Exception):
+                    await task
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/audit", response_model=AuditJobResponse, status_code=202)
+async def audit(request: Request, req: AuditRequest = AuditRequest()):
+    """
+    Start a content audit across all courses, lessons, and problems as a
+    background job. Poll ``GET /audit/{job_id}`` for progress and fetch the
+    report from ``GET /audit/{job_id}/result``.
+    """
+    jobs: AuditJobs = request.app.state.audit_jobs
+    job_id = jobs.start(req.model_dump(), request.app.state.pool)
+    return AuditJobResponse(**jobs.status(job_id))
+
+
+@app.get("/audit/{job_id}", response_model=AuditJobResponse)
+async def audit_status(job_id: str, request: Request):
+    """Progress of an audit job."""
+    status = request.app.state.audit_jobs.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown audit job {job_id}")
+    return AuditJobResponse(**status)
+
+
+@app.get("/audit/{job_id}/result", response_model=AuditResponse)
+async def audit_result(job_id: str, request: Request):
+    """The report of a finished audit job (409 while it is still running)."""
+    job = request.app.state.audit_jobs.result(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown audit job {job_id}")
+    if job["status"] == "failed":
+        return AuditResponse(success=False, error=job["error"])
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Audit job is {job['status']}")
+    return AuditResponse(success=True, report=request.app.state.audit_jobs.report(job_id))
+
+
+# Issues read from the store per round trip while streaming
+_ISSUE_PAGE_ROWS = 500
+
+
+@app.get("/audit/{job_id}/issues")
+async def audit_issues(
+    job_id: str,
+    request: Request,
+    section: Literal["structural", "content"] | None = None,
+    course: str | None = None,
+    level: Literal["course", "lesson", "problem"] | None = None,
+    issue_type: str | None = None,
+    offset: int = Query(default=0, ge=0),
+    limit: int | None = Query(default=None, ge=1),
+    follow: bool = Query(
+        default=False,
+        description="While the job runs, keep the stream open for new issues until it ends",
+    ),
+):
+    """
+    Stream an audit job's issues as NDJSON, without building the report.
+
+    The first line is a header — ``{"type": "header", ...}`` with the job
+    status, the summary (or live progress while the job runs) and the number
+    of matching issues stored so far. Then one ``{"type": "issue", ...}``
+    line per issue in the order found, and finally ``{"type": "end", ...}``
+    with the count sent and the ``next_offset`` to continue from when
+    ``limit`` cut the page short. Content issues count as level "problem".
+    """
+    jobs: AuditJobs = request.app.state.audit_jobs
+    status = jobs.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown audit job {job_id}")
+    filters = {"section": section, "course": course, "level": level, "issue_type": issue_type}
+    job = jobs.result(job_id)
+
+    def line(obj: dict) -> str:
+        return json.dumps(obj, default=str) + "\n"
+
+    async def stream():
+        yield line({
+            "type": "header",
+            "job_id": job_id,
+            "status": status["status"],
+            "generated_at": (job["report"] or {}).get("generated_at"),
+            "summary": (job["report"] or {}).get("summary") or status["progress"],
+            "filters": {k: v for k, v in filters.items() if v is not None},
+            "offset": offset,
+            "limit": limit,
+            "matched": jobs.store.count_issues(job_id, **filters),
+        })
+        sent, after, skip = 0, 0, offset
+        while limit is None or sent < limit:
+            running = jobs.status(job_id)["status"] in ("queued", "running")
+            page = jobs.store.issue_page(
+                job_id, after=after, offset=skip,
+                limit=min(_ISSUE_PAGE_ROWS, limit - sent) if limit else _ISSUE_PAGE_ROWS,
+                **filters,
+            )
+            if page:
+                # The offset only applies to the first page; then page by seq
+                skip = 0
+                after = page[-1][0]
+                sent += len(page)
+                yield "".join(
+                    line({"type": "issue", "seq": seq, "section": sec, **issue})
+                    for seq, sec, issue in page
+                )
+            elif follow and running:
+                await asyncio.sleep(AUDIT_JOB_CHECKPOINT_SECONDS)
+            else:
+                break
+        yield line({
+            "type": "end",
+            "status": jobs.status(job_id)["status"],
+            "issues": sent,
+            "next_offset": offset + sent if limit is not None and sent == limit else None,
+        })
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
@@ -0,0 +1,266 @@
+"""
+agent/audit_jobs.py — Content audits as background jobs.
+
+``POST /audit`` starts a job and returns its ID straight away instead of
+holding the request open for the whole audit (Cloud Run kills requests at
+its timeout). Jobs run as asyncio tasks in the API process; their
+parameters, a progress snapshot (every AUDIT_JOB_CHECKPOINT_SECONDS) and the
+report summary are kept in a JobStore next to the audit findings.
+
+Issues are not collected into one report: the audit hands them over as it
+finds them, and they are written to the store (one row each) at every
+checkpoint. ``GET /audit/{job_id}/issues`` pages through them as NDJSON with
+filters, while the job runs or after; :meth:`AuditJobs.report` rebuilds the
+classic single-document report for ``GET /audit/{job_id}/result``.
+
+Finished LLM batches are checkpointed through the findings store: each
+text's findings are saved as soon as its batch completes. A job that was
+still running when its instance stopped is started again and only sends the
+texts it hadn't finished — a refresh job only reuses findings stored since
+the job was created.
+
+Every instance may share the store (AUDIT_STORE_PATH on a shared volume),
+so jobs are leased: the instance running a job records itself as its owner
+and heartbeats at every checkpoint. Each instance looks for jobs whose
+heartbeat is older than AUDIT_JOB_LEASE_SECONDS — on startup and every lease
+period after — and claims them with a conditional UPDATE, so a job is only
+taken over once its owner is gone. An instance that finds its job claimed
+by another stops running it.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timezone
+
+from agent.audit_store import JobStore
+from agent.config import (
+    AUDIT_JOB_CHECKPOINT_SECONDS,
+    AUDIT_JOB_LEASE_SECONDS,
+    AUDIT_STORE_PATH,
+    DEFAULT_API_KEY,
+    DEFAULT_ENDPOINT,
+    DEFAULT_MODEL,
+)
+from agent.content import AuditProgress, run_content_audit
+
+logger = logging.getLogger(__name__)
+
+# A job whose instance died (stopped heartbeating) this many times is given
+# up on rather than resumed again — it may be what keeps taking instances
+# down. Clean shutdowns (redeploys) don't count
+_MAX_ATTEMPTS = 3
+
+
+def _iso(ts: float | None) -> str | None:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat() if ts else None
+
+
+class AuditJobs:
+    """Starts, tracks and resumes background content audits."""
+
+    def __init__(self, path: str = AUDIT_STORE_PATH):
+        # Without a store path jobs still run, but don't survive a restart
+        self.store = JobStore(path or ":memory:")
+        # Who runs a job, as recorded in the store — unique per process
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._watcher: asyncio.Task | None = None
+        # Jobs another instance took over while they ran here
+        self._lost: set[str] = set()
+        self._progress: dict[str, AuditProgress] = {}
+        # Issues found since the last checkpoint, per running job
+        self._found: dict[str, list[tuple[str, dict]]] = {}
+
+    def start(self, params: dict, pool) -> str:
+        """Record a new job with ``run_content_audit`` keyword ``params`` and run it."""
+        job_id = self.store.create(params)
+        self.store.claim(job_id, "queued", self.owner)
+        logger.info(f"[ 🚀 audit_jobs ] Started job {job_id} {params}")
+        self._spawn(self.store.get(job_id), pool)
+        return job_id
+
+    def resume(self, pool) -> int:
+        """
+        Take over the unfinished jobs whose owner stopped heartbeating more
+        than AUDIT_JOB_LEASE_SECONDS ago; returns how many were resumed.
+        """
+        stale_before = time.time() - AUDIT_JOB_LEASE_SECONDS
+        resumed = 0
+        for job in self.store.unfinished(stale_before):
+            if job["id"] in self._tasks:
+                continue
+            if not self.store.claim(job["id"], job["status"], self.owner, stale_before):
+                continue  # another instance claimed it first
+            released = not job["updated_at"]
+            if not released and job["attempts"] >= _MAX_ATTEMPTS:
+                logger.error(
+                    f"[ ❌ audit_jobs ] Giving up on job {job['id']} "
+                    f"after {job['attempts']} attempts"
+                )
+                self.store.update(
+                    job["id"], if_owner=self.owner, status="failed", attempts=job["attempts"],
+                    error=f"Interrupted {job['attempts']} times — not resumed again",
+                )
+                continue
+            logger.info(
+                f"[ 🔁 audit_jobs ] Resuming job {job['id']} "
+                f"({'released' if released else 'lease expired'} by {job['owner']})"
+            )
+            self._spawn(self.store.get(job["id"]), pool)
+            resumed += 1
+        return resumed
+
+    def watch(self, pool):
+        """Resume stale jobs now and then every AUDIT_JOB_LEASE_SECONDS, in the background."""
+        async def loop():
+            while True:
+                try:
+                    self.resume(pool)
+                except Exception as e:
+                    logger.error(f"[ ❌ audit_jobs ] Looking for stale jobs failed: {e}")
+                await asyncio.sleep(AUDIT_JOB_LEASE_SECONDS)
+
+        self._watcher = asyncio.create_task(loop())
+
+    def _spawn(self, job: dict, pool):
+        progress = self._progress[job["id"]] = AuditProgress()
+        self._tasks[job["id"]] = asyncio.create_task(self._run(job, pool, progress))
+
+    async def _run(self, job: dict, pool, progress: AuditProgress):
+        job_id = job["id"]
+        params = dict(job["params"])
+        # Refreshing means "ignore findings from before this job", which
+        # still holds when the job is resumed later
+        fresh_since = job["created_at"] if params.pop("refresh", False) else None
+        # A resumed job starts its report over (its LLM findings come back from the store)
+        self.store.clear_issues(job_id)
+        found = self._found[job_id] = []
+        checkpoint = asyncio.create_task(self._checkpoint(job_id, progress))
+        try:
+            report = await run_content_audit(
+                endpoint=DEFAULT_ENDPOINT,
+                model=DEFAULT_MODEL,
+                api_key=DEFAULT_API_KEY,
+                **params,
+                pool=pool,
+                progress=progress,
+                fresh_since=fresh_since,
+                on_issues=lambda section, issues: found.extend(
+                    (section, issue) for issue in issues
+                ),
+            )
+        except asyncio.CancelledError:
+            # Shutting down: leave the job running and its lease expired, so
+            # the next instance resumes it straight away (unless one already has)
+            checkpoint.cancel()
+            if job_id not in self._lost:
+                self.store.release(job_id, self.owner, progress=progress.snapshot())
+            raise
+        except Exception as e:
+            checkpoint.cancel()
+            self._flush(job_id)
+            logger.error(f"[ ❌ audit_jobs ] Job {job_id} failed: {e}")
+            self.store.update(
+                job_id, if_owner=self.owner,
+                status="failed", error=str(e), progress=progress.snapshot(),
+            )
+        else:
+            checkpoint.cancel()
+            self._flush(job_id)
+            self.store.update(
+                job_id, if_owner=self.owner,
+                status="done", report=report, progress=progress.snapshot(),
+            )
+            logger.info(
+                f"[ 🏁 audit_jobs ] Job {job_id} done — "
+                f"{report['summary']['total_issues']} issues"
+            )
+        finally:
+            self._tasks.pop(job_id, None)
+            self._progress.pop(job_id, None)
+            self._found.pop(job_id, None)
+            self._lost.discard(job_id)
+
+    async def _checkpoint(self, job_id: str, progress: AuditProgress):
+        """Save progress and issues every checkpoint — the job's heartbeat."""
+        while True:
+            await asyncio.sleep(AUDIT_JOB_CHECKPOINT_SECONDS)
+            if not self.store.update(job_id, if_owner=self.owner, progress=progress.snapshot()):
+                # Missed heartbeats long enough for another instance to take over
+                logger.warning(
+                    f"[ ⚠️ audit_jobs ] Job {job_id} was taken over by another "
+                    f"instance — stopping it here"
+                )
+                self._lost.add(job_id)
+                self._tasks[job_id].cancel()
+                return
+            self._flush(job_id)
+
+    def _flush(self, job_id: str):
+        found = self._found.get(job_id)
+        if found and job_id not in self._lost:
+            self.store.add_issues(job_id, found)
+            found.clear()
+
+    def status(self, job_id: str) -> dict | None:
+        """
+        A job's state and progress — live while it runs here, else the
+        snapshot of its owner's last checkpoint — or None if unknown.
+        """
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        progress = self._progress.get(job_id)
+        return {
+            "job_id": job_id,
+            "status": job["status"],
+            "params": job["params"],
+            "created_at": _iso(job["created_at"]),
+            "updated_at": _iso(job["updated_at"]),
+            "attempts": job["attempts"],
+            "progress": progress.snapshot() if progress else job["progress"],
+            "error": job["error"],
+        }
+
+    def result(self, job_id: str) -> dict | None:
+        """The stored job row, including its report summary once done."""
+        return self.store.get(job_id)
+
+    def report(self, job_id: str) -> dict:
+        """A finished job's full report, issues included, as run_content_audit shapes it."""
+        report = dict(self.store.get(job_id)["report"])
+        report["structural_issues"] = self.issues(job_id, section="structural")
+        # Lint issues first, then the LLM's — the order of the inline report
+        report["content_issues"] = [
+            issue
+            for source in ("lint", "llm")
+            for issue in self.issues(job_id, section="content", source=source)
+        ]
+        return report
+
+    def issues(self, job_id: str, **filters) -> list[dict]:
+        """Every stored issue of a job matching ``filters``, in the order found."""
+        issues: list[dict] = []
+        after = 0
+        while page := self.store.issue_page(job_id, after=after, **filters):
+            issues += [issue for _, _, issue in page]
+            after = page[-1][0]
+        return issues
+
+    async def shutdown(self):
+        """Stop the running jobs (they stay resumable) and close the store."""
+        if self._watcher is not None:
+            self._watcher.cancel()
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await task
+        self.store.close()
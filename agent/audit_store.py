@@ -0,0 +1,289 @@
+"""
+agent/audit_store.py — Local store of LLM content-audit findings.
+
+Findings are keyed by a content hash of each audited field text (plus the
+model and the audit prompt), so a later audit only sends new or changed
+text to the LLM. Postgres access is read-only, hence a local SQLite file.
+
+The same file holds the background audit jobs (JobStore): their parameters,
+last progress snapshot and report summary, so a restarted instance can pick
+up unfinished jobs, and their issues one row each, so reports can be paged
+and filtered without loading them whole. A job records the instance running
+it (``owner``) and when it last checkpointed (``updated_at``), so instances
+sharing the file only take over jobs whose owner has stopped.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(value, model: str, prompt_version: str) -> str:
+    """Stable hash of an audited text (or any JSON value) plus what it was audited with."""
+    blob = json.dumps(
+        {"value": value, "model": model, "prompt": prompt_version},
+        sort_keys=True,
+        default=str,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+class AuditStore:
+    """SQLite-backed map of content hash → list of LLM issues for that text."""
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS findings (
+                hash       TEXT PRIMARY KEY,
+                issues     TEXT NOT NULL,
+                audited_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.commit()
+
+    def get_many(self, hashes: list[str], since: float | None = None) -> dict[str, list[dict]]:
+        """
+        Stored issues for whichever of ``hashes`` are known — only those
+        audited at or after ``since`` (a UNIX timestamp) when given.
+        """
+        found: dict[str, list[dict]] = {}
+        unique = list(dict.fromkeys(hashes))
+        # Stay well below SQLite's bound-parameter limit
+        for i in range(0, len(unique), 500):
+            chunk = unique[i : i + 500]
+            rows = self._db.execute(
+                f"SELECT hash, issues FROM findings "
+                f"WHERE hash IN ({','.join('?' * len(chunk))}) AND audited_at >= ?",
+                [*chunk, since or 0],
+            )
+            found.update((h, json.loads(issues)) for h, issues in rows)
+        return found
+
+    def put_many(self, findings: dict[str, list[dict]]):
+        now = time.time()
+        self._db.executemany(
+            "INSERT OR REPLACE INTO findings (hash, issues, audited_at) VALUES (?, ?, ?)",
+            [(h, json.dumps(issues, default=str), now) for h, issues in findings.items()],
+        )
+        self._db.commit()
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM findings").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+class JobStore:
+    """SQLite-backed record of background audit jobs and their issues."""
+
+    # Statuses of jobs that should be picked up again after a restart
+    UNFINISHED = ("queued", "running")
+
+    # Issue columns that can be filtered on
+    ISSUE_FILTERS = ("section", "level", "course", "issue_type", "source")
+
+    def __init__(self, path: str):
+        self.path = path
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS audit_jobs (
+                id         TEXT PRIMARY KEY,
+                status     TEXT NOT NULL,
+                params     TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                attempts   INTEGER NOT NULL DEFAULT 0,
+                progress   TEXT,
+                report     TEXT,
+                error      TEXT,
+                owner      TEXT
+            )
+            """
+        )
+        # Stores created before jobs had owners
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(audit_jobs)")}
+        if "owner" not in columns:
+            self._db.execute("ALTER TABLE audit_jobs ADD COLUMN owner TEXT")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS audit_issues (
+                seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id     TEXT NOT NULL,
+                section    TEXT NOT NULL,
+                level      TEXT NOT NULL,
+                course     TEXT,
+                issue_type TEXT,
+                source     TEXT NOT NULL,
+                issue      TEXT NOT NULL
+            )
+            """
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS audit_issues_job ON audit_issues (job_id, seq)"
+        )
+        self._db.commit()
+
+    def create(self, params: dict) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._db.execute(
+            "INSERT INTO audit_jobs (id, status, params, created_at, updated_at) "
+            "VALUES (?, 'queued', ?, ?, ?)",
+            (job_id, json.dumps(params), now, now),
+        )
+        self._db.commit()
+        return job_id
+
+    def update(self, job_id: str, if_owner: str | None = None, **fields) -> bool:
+        """
+        Set columns of a job; dict values (progress, report) are stored as
+        JSON. With ``if_owner``, only while that instance still owns the job —
+        returns whether it was updated.
+        """
+        fields = {
+            k: json.dumps(v, default=str) if isinstance(v, dict) else v
+            for k, v in fields.items()
+        }
+        fields.setdefault("updated_at", time.time())
+        where, args = "id = ?", [job_id]
+        if if_owner is not None:
+            where += " AND owner = ?"
+            args.append(if_owner)
+        cur = self._db.execute(
+            f"UPDATE audit_jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE {where}",
+            [*fields.values(), *args],
+        )
+        self._db.commit()
+        return cur.rowcount == 1
+
+    def claim(
+        self, job_id: str, status: str, owner: str, stale_before: float | None = None,
+    ) -> bool:
+        """
+        Make ``owner`` run a job that is still in ``status`` (and, with
+        ``stale_before``, hasn't checkpointed since then). One UPDATE, so of
+        several instances claiming a job only one gets it; returns whether
+        this one did.
+
+        An attempt is counted unless the job was released (see
+        :meth:`release`) — only runs that ended without saying so count
+        toward giving up on a job.
+        """
+        cur = self._db.execute(
+            "UPDATE audit_jobs SET status = 'running', owner = ?, "
+            "attempts = attempts + (updated_at > 0), updated_at = ? "
+            "WHERE id = ? AND status = ? AND updated_at < ?",
+            (owner, time.time(), job_id, status,
+             stale_before if stale_before is not None else float("inf")),
+        )
+        self._db.commit()
+        return cur.rowcount == 1
+
+    def release(self, job_id: str, owner: str, **fields) -> bool:
+        """
+        Give up ``owner``'s lease on a job that is still unfinished (a clean
+        shutdown), so the next instance resumes it straight away without
+        counting an attempt. Other ``fields`` are set as in :meth:`update`.
+        """
+        return self.update(job_id, if_owner=owner, updated_at=0, **fields)
+
+    def get(self, job_id: str) -> dict | None:
+        row = self._db.execute("SELECT * FROM audit_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._decode(row) if row else None
+
+    def unfinished(self, stale_before: float | None = None) -> list[dict]:
+        """Queued or running jobs — only those not checkpointed since ``stale_before`` if given."""
+        rows = self._db.execute(
+            f"SELECT * FROM audit_jobs WHERE status IN ({','.join('?' * len(self.UNFINISHED))}) "
+            f"AND updated_at < ? ORDER BY created_at",
+            [*self.UNFINISHED, stale_before if stale_before is not None else float("inf")],
+        )
+        return [self._decode(row) for row in rows]
+
+    def add_issues(self, job_id: str, issues: list[tuple[str, dict]]):
+        """
+        Append ``(section, issue)`` pairs in the order found. Content issues
+        have no level of their own — they are about a problem.
+        """
+        self._db.executemany(
+            "INSERT INTO audit_issues "
+            "(job_id, section, level, course, issue_type, source, issue) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    job_id, section, issue.get("level", "problem"), issue.get("course"),
+                    issue.get("issue_type"), issue.get("source", section),
+                    json.dumps(issue, default=str),
+                )
+                for section, issue in issues
+            ],
+        )
+        self._db.commit()
+
+    def clear_issues(self, job_id: str):
+        self._db.execute("DELETE FROM audit_issues WHERE job_id = ?", (job_id,))
+        self._db.commit()
+
+    def _issue_filter(self, job_id: str, filters: dict) -> tuple[str, list]:
+        where, args = ["job_id = ?"], [job_id]
+        for column in self.ISSUE_FILTERS:
+            if filters.get(column) is not None:
+                where.append(f"{column} = ?")
+                args.append(filters[column])
+        return " AND ".join(where), args
+
+    def issue_page(
+        self,
+        job_id: str,
+        after: int = 0,
+        offset: int = 0,
+        limit: int = 500,
+        **filters,
+    ) -> list[tuple[int, str, dict]]:
+        """
+        ``(seq, section, issue)`` in the order found: up to ``limit`` issues
+        matching ``filters`` with seq > ``after``, skipping the first ``offset``.
+        """
+        where, args = self._issue_filter(job_id, filters)
+        rows = self._db.execute(
+            f"SELECT seq, section, issue FROM audit_issues "
+            f"WHERE {where} AND seq > ? ORDER BY seq LIMIT ? OFFSET ?",
+            [*args, after, limit, offset],
+        )
+        return [(seq, section, json.loads(issue)) for seq, section, issue in rows]
+
+    def count_issues(self, job_id: str, **filters) -> int:
+        where, args = self._issue_filter(job_id, filters)
+        return self._db.execute(
+            f"SELECT COUNT(*) FROM audit_issues WHERE {where}", args
+        ).fetchone()[0]
+
+    @staticmethod
+    def _decode(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        for key in ("params", "progress", "report"):
+            if job[key] is not None:
+                job[key] = json.loads(job[key])
+        return job
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,109 @@
+"""
+agent/cache.py — Small in-process LRU cache with TTL, plus hit/miss counters.
+"""
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any
+
+
+@dataclass
+class _Entry:
+    value: Any
+    stored_at: float
+    size: int = 0
+    tags: frozenset[str] = field(default_factory=frozenset)
+
+
+class LRUCache:
+    """
+    LRU cache bounded by entry count and/or total size, with an optional
+    per-entry TTL (seconds).
+
+    ``None`` leaves a bound off; a bound of 0 disables the cache. Entries
+    can carry tags (e.g. the tables a query reads) so related entries can
+    be dropped together with :meth:`invalidate`.
+    """
+
+    def __init__(
+        self,
+        max_entries: int | None = None,
+        ttl: float = 0,
+        max_bytes: int | None = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self.bytes_saved = 0
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries != 0 and self.max_bytes != 0
+
+    def get(self, key: str) -> Any | None:
+        """Return the cached value (marking it recently used), or None."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if not self.ttl or time.monotonic() - entry.stored_at < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.bytes_saved += entry.size
+                return entry.value
+            self._remove(key)
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: Any, size: int = 0, tags: frozenset[str] = frozenset()):
+        if not self.enabled or (self.max_bytes is not None and size > self.max_bytes):
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _Entry(value, time.monotonic(), size, tags)
+        self.bytes += size
+        while (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tags: set[str] | None = None) -> int:
+        """Drop entries carrying any of ``tags`` (all entries if None). Returns the count."""
+        if tags is None:
+            keys = list(self._entries)
+        else:
+            keys = [k for k, e in self._entries.items() if e.tags & tags]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        self.invalidate()
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        stats = {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+        if self.max_bytes is not None:
+            stats.update(
+                bytes=self.bytes,
+                max_bytes=self.max_bytes,
+                bytes_saved=self.bytes_saved,
+            )
+        return stats
@@ -6,14 +6,27 @@ and an LLM-based quality review, then returns the report in the response.
 """
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import json
 import logging
 import re
 import time
+from collections import Counter
 from datetime import datetime, timezone
-
-from agent.agent import DataAgent
-from agent.config import DEFAULT_ENDPOINT, DEFAULT_MODEL, DEFAULT_API_KEY
+from typing import Callable
+
+from agent.agent import DataAgent, RateLimiter
+from agent.audit_store import AuditStore, content_hash
+from agent.config import (
+    AUDIT_BATCH_TOKENS,
+    AUDIT_CONCURRENCY,
+    AUDIT_STORE_PATH,
+    DEFAULT_API_KEY,
+    DEFAULT_ENDPOINT,
+    DEFAULT_MODEL,
+)
+from agent.encoding import estimate_tokens
 from agent.postgres_client import get_pool
 
 logger = logging.getLogger(__name__)
@@ -23,8 +36,12 @@ logger = logging.getLogger(__name__)
 CONTENT_AUDIT_PROMPT = """\
 You are a markdown formatting auditor for a math education platform.
 
-You will receive a lesson and its problems as JSON. Check every text field \
-(description, question, explanation, hint_text, options) for markdown issues.
+You will receive text fields of problems as JSON. Each item has an "id", \
+the "course" and "lesson" it comes from, the "field" (description, question, \
+explanation, hint_text, options…) and its "text". Check every text for \
+markdown issues. A long text may arrive in several parts (same id, \
+"part": "1/3", …).
+Copy the item's "id" into "problem_id" for every issue.
 
 Look for:
 - Broken or malformed markdown (unclosed **, `, $$, etc.)
@@ -35,7 +52,7 @@ Look for:
 - Unescaped special characters that break rendering
 
 Respond ONLY with a JSON array. Each issue:
-{"problem_title": "...", "field": "...", "issue_type": "...", "description": "...", "suggestion": "..."}
+{"problem_id": 1, "issue_type": "...", "description": "...", "suggestion": "..."}
 
 issue_type must be one of: "broken_markdown", "undelimited_latex", \
 "inconsistent_formatting", "broken_list", "unescaped_chars"
@@ -44,106 +61,164 @@ If no issues are found, respond with: []
 Respond ONLY with the JSON array — no markdown, no extra text.
 """
 
+# Part of every text's content hash, so editing the prompt re-audits everything
+_PROMPT_VERSION = hashlib.sha256(CONTENT_AUDIT_PROMPT.encode()).hexdigest()[:12]
+
 
 # ── Fetch content ─────────────────────────────────────────────────────────────
 
-async def fetch_content(pool, problem_limit: int = 0) -> dict:
-    """Fetch all courses → lessons → problems as a nested structure using JOINs."""
-
-    logger.info("[ 📥 fetch_content ] Querying courses...")
-    courses = await pool.fetch("""
-        SELECT title, description, is_published, total_lessons,
-               estimated_duration_minutes, created_at
-        FROM courses ORDER BY created_at
-    """)
-    logger.info(f"[ 📥 fetch_content ] Fetched {len(courses)} courses")
-
-    logger.info("[ 📥 fetch_content ] Querying lessons...")
-    lessons = await pool.fetch("""
-        SELECT l.title, l.description, l.order_index,
-               l.total_problems, l.estimated_duration_minutes,
-               l.lesson_type, l.mastery_session_limit, l.created_at,
-               c.title AS course_title
-        FROM lessons l
-        JOIN courses c ON l.course_id = c.id
-        ORDER BY c.created_at, l.order_index
-    """)
-    logger.info(f"[ 📥 fetch_content ] Fetched {len(lessons)} lessons")
-
-    limit_clause = f"LIMIT {problem_limit}" if problem_limit > 0 else ""
-    limit_label = f" (limit: {problem_limit})" if problem_limit > 0 else " (all)"
-
-    logger.info(f"[ 📥 fetch_content ] Querying problems{limit_label}...")
-    problems = await pool.fetch(f"""
-        SELECT p.title, p.description, p.problem_type,
-               p.order_index, p.metadata, p.image_path, p.video_path,
-               p.phase, p.misconception, p.question, p.options,
-               p.correct_answer, p.explanation, p.points, p.difficulty,
-               p.problem_code, p.hint_text,
-               ch.filename AS chart_filename,
-               ch.chart_type, ch.data AS chart_data,
-               l.title AS lesson_title, c.title AS course_title
-        FROM problems p
-        JOIN lessons l ON p.lesson_id = l.id
-        JOIN courses c ON l.course_id = c.id
-        LEFT JOIN charts ch ON p.chart_id = ch.id
-        ORDER BY c.created_at, l.order_index, p.order_index
-        {limit_clause}
-    """)
-    logger.info(f"[ 📥 fetch_content ] Fetched {len(problems)} problems")
-
-    # Group lessons by course_title
-    logger.info("[ 🔗 fetch_content ] Grouping lessons by course...")
-    lessons_by_course: dict[str, list[dict]] = {}
-    for row in lessons:
-        ctitle = row["course_title"]
-        lesson = dict(row)
-        lesson.pop("course_title", None)
-        lessons_by_course.setdefault(ctitle, []).append(lesson)
+# Problem rows per page while streaming lessons
+_CONTENT_FETCH_ROWS = 500
 
-    for ctitle, llist in lessons_by_course.items():
-        logger.info(f"[ 🔗 fetch_content ]   {ctitle}: {len(llist)} lessons")
+_COURSES_QUERY = """
+    SELECT c.id AS course_id, c.title, c.description, c.is_published,
+           c.total_lessons, c.estimated_duration_minutes, c.created_at
+    FROM courses c ORDER BY c.created_at, c.id
+"""
 
-    # Group problems by (course_title, lesson_title)
-    logger.info("[ 🔗 fetch_content ] Grouping problems by lesson...")
-    problems_by_lesson: dict[tuple[str, str], list[dict]] = {}
-    for row in problems:
-        key = (row["course_title"], row["lesson_title"])
-        problem = dict(row)
-        problem.pop("course_title", None)
-        problem.pop("lesson_title", None)
-        problems_by_lesson.setdefault(key, []).append(problem)
-
-    charts_found = sum(
-        1 for row in problems if row.get("chart_filename") is not None
-    )
+_LESSONS_QUERY = """
+    SELECT l.id AS lesson_id, l.course_id,
+           l.title, l.description, l.order_index,
+           l.total_problems, l.estimated_duration_minutes,
+           l.lesson_type, l.mastery_session_limit, l.created_at
+    FROM lessons l
+    JOIN courses c ON l.course_id = c.id
+    ORDER BY c.created_at, c.id, l.order_index, l.id
+"""
+
+# One page of the problems of some lessons ($1), keyset-paginated on
+# (lesson_id, id) — {after} continues from the last row of the previous page
+_PROBLEMS_QUERY = """
+    SELECT p.lesson_id, p.id AS problem_key,
+           p.title, p.description, p.problem_type,
+           p.order_index, p.metadata, p.image_path, p.video_path,
+           p.phase, p.misconception, p.question, p.options,
+           p.correct_answer, p.explanation, p.points, p.difficulty,
+           p.problem_code, p.hint_text,
+           ch.filename AS chart_filename,
+           ch.chart_type, ch.data AS chart_data
+    FROM problems p
+    LEFT JOIN charts ch ON p.chart_id = ch.id
+    WHERE p.lesson_id = ANY($1) {after}
+    ORDER BY p.lesson_id, p.id
+    LIMIT $2
+"""
+_PROBLEMS_AFTER = "AND (p.lesson_id, p.id) > ($3, $4)"
+
+
+def _problem_order(problem: dict):
+    # ORDER BY order_index puts NULLs last; id breaks ties
+    return problem["order_index"] is None, problem["order_index"] or 0, problem["problem_key"]
+
+
+async def _read_problems(pool, lesson_ids: list) -> dict:
+    """
+    The problems of ``lesson_ids``, per lesson id in lesson order. Each page
+    is its own short read-only transaction, so no connection or snapshot is
+    held while the caller awaits between pages (or lessons).
+    """
+    problems: dict = {lesson_id: [] for lesson_id in lesson_ids}
+    after: tuple = ()
+    while True:
+        async with pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                rows = await conn.fetch(
+                    _PROBLEMS_QUERY.format(after=_PROBLEMS_AFTER if after else ""),
+                    lesson_ids, _CONTENT_FETCH_ROWS, *after,
+                )
+        for row in rows:
+            problems[row["lesson_id"]].append(dict(row))
+        if len(rows) < _CONTENT_FETCH_ROWS:
+            break
+        after = (rows[-1]["lesson_id"], rows[-1]["problem_key"])
+    for lesson_problems in problems.values():
+        lesson_problems.sort(key=_problem_order)
+    return problems
+
+
+async def iter_lessons(pool, problem_limit: int = 0, totals: dict | None = None):
+    """
+    Stream the catalogue one lesson at a time.
+
+    Yields ``(course, None)`` when a course starts — ``course["lesson_count"]``
+    holds its number of lessons — then ``(course, lesson)`` for each of its
+    lessons with ``lesson["problems"]`` filled in. Courses and lessons are
+    small and read upfront; problems are read a few lessons ahead, about
+    _CONTENT_FETCH_ROWS at a time, each page in its own short transaction —
+    nothing stays open on the pool while the consumer works on a lesson
+    (LLM batches can take minutes), so pages are not one snapshot.
+
+    ``totals`` (if given) is filled with the course / lesson / problem counts.
+    """
+    if totals is None:
+        totals = {}
+
+    async with pool.acquire() as conn:
+        async with conn.transaction(readonly=True):
+            courses = await conn.fetch(_COURSES_QUERY)
+            lessons = await conn.fetch(_LESSONS_QUERY)
+    totals.update(courses=len(courses), lessons=len(lessons), problems=0)
     logger.info(
-        f"[ 🔗 fetch_content ] Grouped into {len(problems_by_lesson)} "
-        f"lesson buckets, {charts_found} problems have charts"
+        f"[ 📥 iter_lessons ] {len(courses)} courses, {len(lessons)} lessons — "
+        f"streaming problems"
+        f"{f' (limit: {problem_limit})' if problem_limit > 0 else ''}"
     )
 
-    # Assemble nested structure
+    lessons_by_course: dict = {}
+    for row in lessons:
+        lessons_by_course.setdefault(row["course_id"], []).append(row)
+
+    # Lessons are yielded in _LESSONS_QUERY order; problems are read for the
+    # next lessons declaring about a page of problems between them
+    upcoming = iter(lessons)
+    ahead: dict = {}
+    remaining = problem_limit if problem_limit > 0 else None
+
+    for row in courses:
+        course = dict(row)
+        course_id = course.pop("course_id")
+        course_lessons = lessons_by_course.get(course_id, [])
+        course["lesson_count"] = len(course_lessons)
+        yield course, None
+
+        for lesson_row in course_lessons:
+            lesson = dict(lesson_row)
+            lesson_id = lesson.pop("lesson_id")
+            lesson.pop("course_id")
+            if lesson_id not in ahead and remaining != 0:
+                window, declared = [], 0
+                for next_row in upcoming:
+                    window.append(next_row["lesson_id"])
+                    declared += max(next_row["total_problems"] or 0, 1)
+                    if declared >= _CONTENT_FETCH_ROWS:
+                        break
+                ahead = await _read_problems(pool, window)
+            problems = ahead.pop(lesson_id, [])
+            if remaining is not None:
+                problems = problems[:remaining]
+                remaining -= len(problems)
+            for problem in problems:
+                problem.pop("lesson_id")
+                problem.pop("problem_key")
+            lesson["problems"] = problems
+            totals["problems"] += len(problems)
+            yield course, lesson
+
+    logger.info(f"[ ✅ iter_lessons ] Streamed {totals['problems']} problems")
+
+
+async def fetch_content(pool, problem_limit: int = 0) -> dict:
+    """Fetch all courses → lessons → problems as one nested structure."""
     content: list[dict] = []
-    for c in courses:
-        course = dict(c)
-        ctitle = course["title"]
-        course_lessons = lessons_by_course.get(ctitle, [])
-        for lesson in course_lessons:
-            ltitle = lesson["title"]
-            lesson["problems"] = problems_by_lesson.get((ctitle, ltitle), [])
-        course["lessons"] = course_lessons
-        content.append(course)
-
-    logger.info("[ ✅ fetch_content ] Content tree assembled")
-
-    return {
-        "courses": content,
-        "totals": {
-            "courses": len(courses),
-            "lessons": len(lessons),
-            "problems": len(problems),
-        },
-    }
+    totals: dict = {}
+    async for course, lesson in iter_lessons(pool, problem_limit, totals):
+        if lesson is None:
+            course.pop("lesson_count")
+            course["lessons"] = []
+            content.append(course)
+        else:
+            course["lessons"].append(lesson)
+    return {"courses": content, "totals": totals}
 
 
 # ── Structural checks ────────────────────────────────────────────────────────
@@ -154,268 +229,974 @@ def structural_checks(content: dict) -> list[dict]:
     total_courses = len(content["courses"])
 
     for ci, course in enumerate(content["courses"], 1):
-        ctitle = course["title"]
-        lesson_count = len(course.get("lessons", []))
-        problem_count = sum(
-            len(l.get("problems", [])) for l in course.get("lessons", [])
-        )
+        lessons = course.get("lessons", [])
+        problem_count = sum(len(l.get("problems", [])) for l in lessons)
         logger.info(
             f"[ 🔧 structural_checks ] [{ci}/{total_courses}] "
-            f"\"{ctitle}\" — {lesson_count} lessons, {problem_count} problems"
+            f"\"{course['title']}\" — {len(lessons)} lessons, {problem_count} problems"
         )
+        issues += course_checks(course, len(lessons))
+        for lesson in lessons:
+            issues += lesson_checks(course["title"], lesson)
+
+    logger.info(
+        f"[ ✅ structural_checks ] Done — {len(issues)} issues found"
+    )
+    return issues
+
+
+def course_checks(course: dict, lesson_count: int) -> list[dict]:
+    """Course-level structural checks."""
+    issues: list[dict] = []
+    ctitle = course["title"]
+
+    if not course.get("description"):
+        issues.append({
+            "level": "course", "course": ctitle,
+            "issue_type": "missing_field",
+            "description": "Course has no description",
+        })
+
+    declared_lessons = course.get("total_lessons") or 0
+    if lesson_count != declared_lessons:
+        issues.append({
+            "level": "course", "course": ctitle,
+            "issue_type": "count_mismatch",
+            "description": (
+                f"total_lessons={declared_lessons} but actual "
+                f"lesson count is {lesson_count}"
+            ),
+        })
+    return issues
+
 
-        # ── Course-level ──────────────────────────────────────────────────
-        if not course.get("description"):
+# Options as text that count as "no answer options" — jsonb arrives from
+# asyncpg as text, and the SQL checks compare the same strings
+_NO_OPTIONS = ("", "[]", "{}")
+
+
+def _no_options(options) -> bool:
+    if options is None:
+        return True
+    text = options if isinstance(options, str) else json.dumps(options)
+    return text in _NO_OPTIONS
+
+
+def lesson_checks(ctitle: str, lesson: dict) -> list[dict]:
+    """Structural checks for one lesson and its problems."""
+    issues: list[dict] = []
+    ltitle = lesson["title"]
+
+    # ── Lesson-level ──────────────────────────────────────────────────────
+    if not lesson.get("description"):
+        issues.append({
+            "level": "lesson", "course": ctitle,
+            "lesson": ltitle,
+            "issue_type": "missing_field",
+            "description": "Lesson has no description",
+        })
+
+    actual_problems = len(lesson.get("problems", []))
+    declared_problems = lesson.get("total_problems") or 0
+    if actual_problems != declared_problems:
+        issues.append({
+            "level": "lesson", "course": ctitle,
+            "lesson": ltitle,
+            "issue_type": "count_mismatch",
+            "description": (
+                f"total_problems={declared_problems} but actual "
+                f"problem count is {actual_problems}"
+            ),
+        })
+
+    if actual_problems == 0:
+        issues.append({
+            "level": "lesson", "course": ctitle,
+            "lesson": ltitle,
+            "issue_type": "empty_lesson",
+            "description": "Lesson has zero problems",
+        })
+
+    for problem in lesson.get("problems", []):
+        ptitle = problem["title"]
+        base = {
+            "level": "problem", "course": ctitle,
+            "lesson": ltitle, "problem": ptitle,
+        }
+
+        if not problem.get("explanation"):
             issues.append({
-                "level": "course", "course": ctitle,
-                "issue_type": "missing_field",
-                "description": "Course has no description",
+                **base, "issue_type": "missing_field",
+                "description": "Problem has no explanation",
+            })
+
+        if not problem.get("question"):
+            issues.append({
+                **base, "issue_type": "missing_field",
+                "description": "Problem has no question text",
+            })
+
+        if problem.get("correct_answer") is None:
+            issues.append({
+                **base, "issue_type": "missing_field",
+                "description": "Problem has no correct_answer",
+            })
+
+        if _no_options(problem.get("options")):
+            issues.append({
+                **base, "issue_type": "missing_field",
+                "description": "Problem has no answer options",
             })
 
-        actual_lessons = len(course.get("lessons", []))
-        declared_lessons = course.get("total_lessons") or 0
-        if actual_lessons != declared_lessons:
+        if not problem.get("difficulty"):
             issues.append({
-                "level": "course", "course": ctitle,
-                "issue_type": "count_mismatch",
+                **base, "issue_type": "missing_field",
+                "description": "Problem has no difficulty level set",
+            })
+
+        if (
+            not problem.get("hint_text")
+            and problem.get("difficulty") in ("medium", "hard")
+        ):
+            issues.append({
+                **base, "issue_type": "missing_hint",
                 "description": (
-                    f"total_lessons={declared_lessons} but actual "
-                    f"lesson count is {actual_lessons}"
+                    f"Problem is '{problem['difficulty']}' but has no hint"
                 ),
             })
 
-        for lesson in course.get("lessons", []):
-            ltitle = lesson["title"]
+        if not problem.get("misconception"):
+            issues.append({
+                **base, "issue_type": "missing_field",
+                "description": "Problem has no misconception tag",
+            })
 
-            # ── Lesson-level ──────────────────────────────────────────────
-            if not lesson.get("description"):
-                issues.append({
-                    "level": "lesson", "course": ctitle,
-                    "lesson": ltitle,
-                    "issue_type": "missing_field",
-                    "description": "Lesson has no description",
-                })
+        if not problem.get("points"):
+            issues.append({
+                **base, "issue_type": "missing_field",
+                "description": "Problem has no points value",
+            })
 
-            actual_problems = len(lesson.get("problems", []))
-            declared_problems = lesson.get("total_problems") or 0
-            if actual_problems != declared_problems:
-                issues.append({
-                    "level": "lesson", "course": ctitle,
-                    "lesson": ltitle,
-                    "issue_type": "count_mismatch",
-                    "description": (
-                        f"total_problems={declared_problems} but actual "
-                        f"problem count is {actual_problems}"
-                    ),
-                })
+    return issues
 
-            if actual_problems == 0:
-                issues.append({
-                    "level": "lesson", "course": ctitle,
-                    "lesson": ltitle,
-                    "issue_type": "empty_lesson",
-                    "description": "Lesson has zero problems",
-                })
 
-            for problem in lesson.get("problems", []):
-                ptitle = problem["title"]
-                base = {
-                    "level": "problem", "course": ctitle,
-                    "lesson": ltitle, "problem": ptitle,
-                }
+# ── Structural checks in SQL ──────────────────────────────────────────────────
 
-                if not problem.get("explanation"):
-                    issues.append({
-                        **base, "issue_type": "missing_field",
-                        "description": "Problem has no explanation",
-                    })
+_COURSE_CHECKS_QUERY = """
+    SELECT c.title,
+           COALESCE(c.description::text, '') = '' AS no_description,
+           COALESCE(c.total_lessons, 0) AS declared,
+           count(l.id) AS actual
+    FROM courses c
+    LEFT JOIN lessons l ON l.course_id = c.id
+    GROUP BY c.id
+    HAVING COALESCE(c.description::text, '') = ''
+        OR COALESCE(c.total_lessons, 0) <> count(l.id)
+    ORDER BY c.created_at
+"""
 
-                if not problem.get("question"):
-                    issues.append({
-                        **base, "issue_type": "missing_field",
-                        "description": "Problem has no question text",
-                    })
+_LESSON_CHECKS_QUERY = """
+    SELECT c.title AS course_title, l.title,
+           COALESCE(l.description::text, '') = '' AS no_description,
+           COALESCE(l.total_problems, 0) AS declared,
+           count(p.id) AS actual
+    FROM lessons l
+    JOIN courses c ON l.course_id = c.id
+    LEFT JOIN problems p ON p.lesson_id = l.id
+    GROUP BY c.id, l.id
+    HAVING COALESCE(l.description::text, '') = ''
+        OR COALESCE(l.total_problems, 0) <> count(p.id)
+        OR count(p.id) = 0
+    ORDER BY c.created_at, l.order_index
+"""
 
-                if problem.get("correct_answer") is None:
-                    issues.append({
-                        **base, "issue_type": "missing_field",
-                        "description": "Problem has no correct_answer",
-                    })
+# One boolean per problem-level check; only problems failing one come back
+_PROBLEM_FLAGS = """
+    COALESCE(p.explanation::text, '') = '' AS no_explanation,
+    COALESCE(p.question::text, '') = '' AS no_question,
+    p.correct_answer IS NULL AS no_correct_answer,
+    COALESCE(p.options::text, '') IN ('', '[]', '{}') AS no_options,  -- _NO_OPTIONS
+    COALESCE(p.difficulty::text, '') = '' AS no_difficulty,
+    COALESCE(p.hint_text::text, '') = ''
+        AND p.difficulty::text IN ('medium', 'hard') AS no_hint,
+    COALESCE(p.misconception::text, '') = '' AS no_misconception,
+    COALESCE(p.points, 0) = 0 AS no_points
+"""
 
-                if not problem.get("options"):
-                    issues.append({
-                        **base, "issue_type": "missing_field",
-                        "description": "Problem has no answer options",
-                    })
+_PROBLEM_CHECKS_QUERY = f"""
+    SELECT * FROM (
+        SELECT c.title AS course_title, l.title AS lesson_title, p.title,
+               p.difficulty::text AS difficulty,
+               {_PROBLEM_FLAGS},
+               c.created_at, l.order_index AS lesson_order, p.order_index
+        FROM problems p
+        JOIN lessons l ON p.lesson_id = l.id
+        JOIN courses c ON l.course_id = c.id
+    ) checked
+    WHERE no_explanation OR no_question OR no_correct_answer OR no_options
+       OR no_difficulty OR no_hint OR no_misconception OR no_points
+    ORDER BY created_at, lesson_order, order_index
+"""
 
-                if not problem.get("difficulty"):
-                    issues.append({
-                        **base, "issue_type": "missing_field",
-                        "description": "Problem has no difficulty level set",
-                    })
+_TOTALS_QUERY = """
+    SELECT (SELECT count(*) FROM courses) AS courses,
+           (SELECT count(*) FROM lessons) AS lessons,
+           (SELECT count(*) FROM problems) AS problems
+"""
 
-                if (
-                    not problem.get("hint_text")
-                    and problem.get("difficulty") in ("medium", "hard")
-                ):
-                    issues.append({
-                        **base, "issue_type": "missing_hint",
-                        "description": (
-                            f"Problem is '{problem['difficulty']}' but has no hint"
-                        ),
-                    })
+# (flag, issue_type, description) — same wording as structural_checks
+_PROBLEM_CHECKS = (
+    ("no_explanation", "missing_field", "Problem has no explanation"),
+    ("no_question", "missing_field", "Problem has no question text"),
+    ("no_correct_answer", "missing_field", "Problem has no correct_answer"),
+    ("no_options", "missing_field", "Problem has no answer options"),
+    ("no_difficulty", "missing_field", "Problem has no difficulty level set"),
+    ("no_hint", "missing_hint", "Problem is '{difficulty}' but has no hint"),
+    ("no_misconception", "missing_field", "Problem has no misconception tag"),
+    ("no_points", "missing_field", "Problem has no points value"),
+)
 
-                if not problem.get("misconception"):
-                    issues.append({
-                        **base, "issue_type": "missing_field",
-                        "description": "Problem has no misconception tag",
-                    })
 
-                if not problem.get("points"):
-                    issues.append({
-                        **base, "issue_type": "missing_field",
-                        "description": "Problem has no points value",
-                    })
+async def structural_checks_sql(pool) -> tuple[list[dict], dict]:
+    """
+    The checks of :func:`structural_checks`, run as GROUP BY / boolean
+    aggregates in Postgres so only offending rows cross the wire.
+
+    Returns (issues, totals). Issues are grouped by level — courses, then
+    lessons, then problems — each in content order.
+    """
+    t0 = time.time()
+    async with pool.acquire() as conn:
+        async with conn.transaction(readonly=True):
+            totals = dict(await conn.fetchrow(_TOTALS_QUERY))
+            courses = await conn.fetch(_COURSE_CHECKS_QUERY)
+            lessons = await conn.fetch(_LESSON_CHECKS_QUERY)
+            problems = await conn.fetch(_PROBLEM_CHECKS_QUERY)
+    logger.info(
+        f"[ 🔧 structural_checks_sql ] {len(courses)} courses, {len(lessons)} "
+        f"lessons, {len(problems)} problems with issues ({time.time() - t0:.1f}s)"
+    )
+
+    issues: list[dict] = []
+    for row in courses:
+        base = {"level": "course", "course": row["title"]}
+        if row["no_description"]:
+            issues.append({
+                **base, "issue_type": "missing_field",
+                "description": "Course has no description",
+            })
+        if row["declared"] != row["actual"]:
+            issues.append({
+                **base, "issue_type": "count_mismatch",
+                "description": (
+                    f"total_lessons={row['declared']} but actual "
+                    f"lesson count is {row['actual']}"
+                ),
+            })
+
+    for row in lessons:
+        base = {"level": "lesson", "course": row["course_title"], "lesson": row["title"]}
+        if row["no_description"]:
+            issues.append({
+                **base, "issue_type": "missing_field",
+                "description": "Lesson has no description",
+            })
+        if row["declared"] != row["actual"]:
+            issues.append({
+                **base, "issue_type": "count_mismatch",
+                "description": (
+                    f"total_problems={row['declared']} but actual "
+                    f"problem count is {row['actual']}"
+                ),
+            })
+        if row["actual"] == 0:
+            issues.append({
+                **base, "issue_type": "empty_lesson",
+                "description": "Lesson has zero problems",
+            })
+
+    for row in problems:
+        base = {
+            "level": "problem", "course": row["course_title"],
+            "lesson": row["lesson_title"], "problem": row["title"],
+        }
+        for flag, issue_type, description in _PROBLEM_CHECKS:
+            if row[flag]:
+                issues.append({
+                    **base, "issue_type": issue_type,
+                    "description": description.format(difficulty=row["difficulty"]),
+                })
 
     logger.info(
-        f"[ ✅ structural_checks ] Done — {len(issues)} issues found"
+        f"[ ✅ structural_checks_sql ] Done — {len(issues)} issues found"
     )
-    return issues
+    return issues, totals
 
 
-# ── LLM audit ─────────────────────────────────────────────────────────────────
+# ── Markdown lint ─────────────────────────────────────────────────────────────
 
 _MARKDOWN_FIELDS = (
     "title", "description", "question", "explanation", "hint_text", "options",
 )
 
+# Math delimiters: $$…$$, $…$, \(…\), \[…\] (an escaped \$ is a literal dollar)
+_MATH_TOKEN = re.compile(r"(?<!\\)(\$\$|\$|\\\(|\\\)|\\\[|\\\])")
+_MATH_CLOSE = {"$$": "$$", "$": "$", "\\(": "\\)", "\\[": "\\]"}
 
-async def llm_audit(
-    content: dict,
-    endpoint: str,
-    model: str,
-    api_key: str,
-    batch_size: int = 10,
-) -> list[dict]:
-    """Send problems to the LLM in batches for markdown formatting review."""
+_LATEX_COMMAND = re.compile(
+    r"\\(frac|dfrac|tfrac|sqrt|times|cdot|cdots|ldots|dots|div|pm|mp|le|leq|"
+    r"ge|geq|neq|ne|approx|equiv|infty|pi|theta|alpha|beta|gamma|delta|Delta|"
+    r"lambda|mu|sigma|sum|prod|int|lim|log|ln|sin|cos|tan|left|right|text|"
+    r"mathrm|mathbf|overline|underline|angle|triangle|circ|degree|perp|"
+    r"parallel|quad|to|rightarrow|Rightarrow|in|cup|cap|subset)(?![a-zA-Z])"
+)
+_LATEX_SCRIPT = re.compile(r"[\^_]\{")
+_CODE_FENCE = re.compile(r"```.*?```", re.DOTALL)
+_INLINE_CODE = re.compile(r"`[^`\n]*`")
+_BOLD = re.compile(r"(?<!\*)\*\*(?!\*)")
+_LIST_ITEM = re.compile(r"^[ \t]*(\d+)[.)](?!\d)([ \t]*)(\S?)", re.MULTILINE)
+
+# Characters that mean a field uses markup the linter can't fully judge
+# (emphasis, headings, tables, HTML, exponents…) — worth an LLM look
+_MARKUP = re.compile(r"[$\\`*_#|<^~]|^\s*(\d+[.)]|[-+])\s", re.MULTILINE)
+
+
+def _field_texts(field: str, value) -> list[tuple[str, str]]:
+    """(field label, text) pairs; options may be a list, dict or JSON string."""
+    if isinstance(value, str) and field == "options":
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            pass
+    if isinstance(value, list):
+        return [(f"{field}[{i}]", str(v)) for i, v in enumerate(value) if v is not None]
+    if isinstance(value, dict):
+        return [(f"{field}.{k}", str(v)) for k, v in value.items() if v is not None]
+    return [(field, str(value))]
+
+
+def _split_math(text: str) -> tuple[str, list[str], bool]:
+    """
+    Separate ``text`` into its non-math parts and lint the delimiters.
+    Returns (text outside math, problems found, suspicious?).
+    """
+    outside: list[str] = []
+    problems: list[str] = []
+    suspicious = False
+    state = None
+    start = last = 0
+
+    for m in _MATH_TOKEN.finditer(text):
+        token = m.group()
+        if state is None:
+            if token in _MATH_CLOSE:
+                outside.append(text[last : m.start()])
+                state, start = token, m.end()
+            else:
+                problems.append(f"stray closing {token} with no opening delimiter")
+        elif token == _MATH_CLOSE[state]:
+            body = text[start : m.start()]
+            # "$5 and $10" pairs up as math — likely currency, let the LLM judge
+            if state == "$" and body[:1].isdigit() and body[-1:].isspace():
+                suspicious = True
+            state, last = None, m.end()
+
+    if state is not None:
+        rest = text[start:]
+        if state == "$" and rest[:1].isdigit():
+            suspicious = True  # a lone dollar amount, probably
+        else:
+            problems.append(f"unclosed {state} math delimiter")
+        last = start
+    outside.append(text[last:])
+    return "".join(outside), problems, suspicious
+
+
+def lint_text(text: str) -> tuple[list[tuple[str, str, str]], bool]:
+    """
+    Lint one markdown string. Returns ([(issue_type, description,
+    suggestion)], suspicious) — suspicious meaning it has markup an LLM
+    should still look at even though nothing was found.
+    """
+    issues: list[tuple[str, str, str]] = []
+
+    if text.count("```") % 2:
+        issues.append((
+            "broken_markdown", "Unclosed ``` code fence", "Add the closing ```",
+        ))
+        text = text[: text.rfind("```")]
+    text = _CODE_FENCE.sub(" ", text)
+    text = _INLINE_CODE.sub(" ", text)
+    if "`" in text:
+        issues.append((
+            "broken_markdown", "Unclosed inline code backtick",
+            "Close the `code` span or remove the stray backtick",
+        ))
+
+    outside, math_problems, suspicious = _split_math(text)
+    for problem in math_problems:
+        issues.append((
+            "broken_markdown", f"Math delimiters don't balance: {problem}",
+            "Balance the $ / $$ delimiters (escape a literal dollar as \\$)",
+        ))
+
+    commands = sorted({m.group() for m in _LATEX_COMMAND.finditer(outside)})
+    if commands:
+        issues.append((
+            "undelimited_latex",
+            f"LaTeX outside math delimiters: {', '.join(commands[:5])}",
+            "Wrap the expression in $…$",
+        ))
+    elif _LATEX_SCRIPT.search(outside):
+        issues.append((
+            "undelimited_latex", "Superscript/subscript braces outside math delimiters",
+            "Wrap the expression in $…$",
+        ))
+
+    if len(_BOLD.findall(outside)) % 2:
+        issues.append((
+            "broken_markdown", "Unclosed ** bold marker", "Add the closing **",
+        ))
+
+    items = _LIST_ITEM.findall(outside)
+    if any(not space and nxt.isalpha() for _, space, nxt in items):
+        issues.append((
+            "broken_list", "Numbered list item without a space after the number",
+            "Write \"1. Step\" rather than \"1.Step\"",
+        ))
+    # A list may restart at 1 (or be all 1s); otherwise each item is previous + 1
+    numbers = [int(n) for n, space, _ in items if space]
+    if any(n not in (1, prev + 1) for prev, n in zip(numbers, numbers[1:])):
+        issues.append((
+            "broken_list",
+            f"Numbered list skips or repeats: {', '.join(map(str, numbers[:10]))}",
+            "Renumber the steps consecutively",
+        ))
+
+    return issues, suspicious or bool(_MARKUP.search(text))
+
+
+def lint_lesson(ctitle: str, lesson: dict) -> tuple[list[dict], list[dict]]:
+    """
+    Lint every markdown field of a lesson's problems.
+
+    Returns (issues, review) where ``review`` holds the problems that still
+    deserve an LLM review: no definite lint findings, but markup the linter
+    can't fully judge. Clean plain-text problems and problems with lint
+    findings are left out.
+    """
+    issues: list[dict] = []
+    review: list[dict] = []
+    for problem in lesson.get("problems", []):
+        found = []
+        suspicious = False
+        for field in _MARKDOWN_FIELDS:
+            value = problem.get(field)
+            if value is None:
+                continue
+            for label, text in _field_texts(field, value):
+                field_issues, field_suspicious = lint_text(text)
+                suspicious |= field_suspicious
+                found += [
+                    {
+                        "problem_title": problem["title"],
+                        "field": label,
+                        "issue_type": issue_type,
+                        "description": description,
+                        "suggestion": suggestion,
+                        "course": ctitle,
+                        "lesson": lesson["title"],
+                        "source": "lint",
+                    }
+                    for issue_type, description, suggestion in field_issues
+                ]
+        if found:
+            issues.extend(found)
+        elif suspicious:
+            review.append(problem)
+    return issues, review
+
+
+def lint_content(content: dict) -> tuple[list[dict], dict]:
+    """
+    Run :func:`lint_lesson` over the whole content tree.
+
+    Returns (issues, review) where ``review`` is the content tree pruned to
+    the problems that still deserve an LLM review.
+    """
     issues: list[dict] = []
-    audit_start = time.time()
+    review_courses = []
+    sent = 0
 
-    # Count total batches upfront for progress tracking
-    total_problems = 0
-    total_batches_all = 0
     for course in content["courses"]:
+        review_lessons = []
         for lesson in course.get("lessons", []):
-            n = len(lesson.get("problems", []))
-            if n > 0:
-                total_problems += n
-                total_batches_all += (n + batch_size - 1) // batch_size
+            lesson_issues, review_problems = lint_lesson(course["title"], lesson)
+            issues += lesson_issues
+            sent += len(review_problems)
+            review_lessons.append({**lesson, "problems": review_problems})
+        review_courses.append({**course, "lessons": review_lessons})
 
     logger.info(
-        f"[ 🤖 llm_audit ] Starting — {total_problems} problems "
-        f"in {total_batches_all} batches (batch_size={batch_size})"
+        f"[ ✅ lint_content ] Done — {len(issues)} issues, "
+        f"{sent} problems left for LLM review"
     )
+    return issues, {**content, "courses": review_courses}
 
-    batch_counter = 0
-
-    for course in content["courses"]:
-        ctitle = course["title"]
 
-        for lesson in course.get("lessons", []):
-            ltitle = lesson["title"]
-            problems = lesson.get("problems", [])
+# ── LLM audit ─────────────────────────────────────────────────────────────────
 
-            if not problems:
+# Keys stamped on each issue per problem; the stored findings leave them out
+_ISSUE_CONTEXT = ("course", "lesson", "source", "problem_id", "problem_title", "field")
+
+# JSON overhead of a payload item beyond its text (id, course, lesson, field, part)
+_ITEM_OVERHEAD_TOKENS = 40
+
+# Problems per request before batches were packed — the llm_calls_avoided baseline
+_FIXED_BATCH_SIZE = 10
+
+
+def _slim_problem(problem: dict) -> dict:
+    """Only the markdown-relevant fields, to keep the payload small."""
+    return {f: problem[f] for f in _MARKDOWN_FIELDS if problem.get(f) is not None}
+
+
+def _text_items(tags: dict, value, max_tokens: int) -> list[dict]:
+    """
+    Payload items for one field text: the text itself when it fits in
+    ``max_tokens``, else chunks of it marked ``"part": "n/N"``.
+    """
+    item = {**tags, "text": value}
+    tokens = estimate_tokens(json.dumps(item, default=str))
+    if tokens <= max_tokens:
+        return [item]
+    text = value if isinstance(value, str) else json.dumps(value, default=str)
+    budget = max(max_tokens - _ITEM_OVERHEAD_TOKENS, 1) * 4
+    chunks = []
+    start = 0
+    while start < len(text):
+        size = min(budget, len(text) - start)
+        # Sized as sent: escaping (LaTeX backslashes, quotes, non-ASCII)
+        # makes a chunk longer in the payload than in the text
+        while size > 1 and (encoded := len(json.dumps(text[start : start + size])) - 2) > budget:
+            size = min(size - 1, max(size * budget // encoded, 1))
+        chunks.append(text[start : start + size])
+        start += size
+    return [
+        {**tags, "part": f"{n}/{len(chunks)}", "text": chunk}
+        for n, chunk in enumerate(chunks, 1)
+    ]
+
+
+def _attribute_issues(
+    parsed: list[dict], items: list[tuple[str, dict]],
+) -> tuple[dict[str, list[dict]], list[dict]]:
+    """
+    Split a batch's issues per text hash, by the ``problem_id`` the LLM
+    echoes back. ``items`` are the (hash, payload item) pairs in payload
+    order, ids counting from 1. Returns (issues by hash for every text in
+    the batch, unattributed issues).
+    """
+    by_hash: dict[str, list[dict]] = {h: [] for h, _ in items}
+    by_id = {str(n): h for n, (h, _) in enumerate(items, 1)}
+    unattributed = []
+    for issue in parsed:
+        h = by_id.get(str(issue.get("problem_id")))
+        if h is None:
+            unattributed.append(issue)
+        else:
+            by_hash[h].append({k: v for k, v in issue.items() if k not in _ISSUE_CONTEXT})
+    return by_hash, unattributed
+
+
+class _Batch:
+    """Payload items being packed into one LLM request."""
+
+    def __init__(self, lesson_no: int):
+        self.items: list[tuple[str, dict]] = []  # (text hash, payload item)
+        self.tokens = 0
+        self.lesson_no = lesson_no  # the lesson that opened it
+        self.result: asyncio.Future | None = None  # → unattributed issues
+
+
+class _Text:
+    """Review state of one unique field text."""
+
+    def __init__(self, future: asyncio.Future, parts: int = 0):
+        self.future = future  # → the text's issues
+        self.parts = parts  # payload parts still out for review
+        self.issues: list[dict] = []
+        self.failed = False
+
+
+class LLMAuditor:
+    """
+    Incremental LLM markdown review: feed it lessons as they stream in,
+    then collect the issues with :meth:`finish`.
+
+    The unit of review is a field text, addressed by its hash: options,
+    hints and boilerplate explanations shared by many problems are sent
+    once, and their findings fan back out to every problem using them.
+
+    Texts are packed into requests by estimated size — from as many
+    lessons as fit, each tagged with its course, lesson and field — until
+    a request would exceed ``max_tokens`` or ``batch_size`` texts. A text
+    too big for one request is sent in chunks.
+
+    Up to ``concurrency`` batches are in flight at once over one shared
+    client; a 429 on any batch pauses all of them (see RateLimiter).
+    :meth:`add_lesson` waits for a free slot before sending a batch, so a
+    fast producer can't pile up payloads faster than the LLM drains them.
+    Issues come back in course → lesson → problem order regardless of
+    which batch finishes first. ``on_issues`` (if given) is also handed
+    each lesson's issues, in that order, as soon as they are known.
+
+    With a ``store``, texts whose hash (text, model, prompt version)
+    already has findings are not sent again, and fresh findings are saved
+    as each text's review completes. ``refresh`` re-audits everything;
+    ``fresh_since`` only reuses findings stored at or after that time (a
+    resumed refresh job keeps what it already re-audited).
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        model: str,
+        api_key: str,
+        batch_size: int = 100,
+        concurrency: int = AUDIT_CONCURRENCY,
+        store: AuditStore | None = None,
+        refresh: bool = False,
+        max_tokens: int = AUDIT_BATCH_TOKENS,
+        fresh_since: float | None = None,
+        on_issues: Callable[[list[dict]], None] | None = None,
+    ):
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.max_tokens = max_tokens
+        self.concurrency = max(1, concurrency)
+        self.store = store
+        self.started = time.time()
+        # Refreshing still reuses what this very audit stores, so a text
+        # seen again after its findings were saved isn't sent twice
+        self.fresh_since = self.started if refresh else fresh_since
+        # One async client for the whole audit, so batches share its connections
+        self.agent = DataAgent(endpoint, model, api_key, limiter=RateLimiter())
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._open = _Batch(0)
+        # Every unique text seen so far — hashes and findings only, not the text
+        self._texts: dict[str, _Text] = {}
+        # How many problem fields use each text, to count issues as reported
+        self._uses: Counter[str] = Counter()
+        self._lessons: list[asyncio.Task] = []
+        self._batches: list[asyncio.Task] = []
+        self.on_issues = on_issues
+        # Lessons reviewed but not yet handed to on_issues (an earlier one isn't done)
+        self._pending: dict[int, list[dict]] = {}
+        self._emitted = 0
+        self.problems = 0
+        self.texts = 0
+        self.tokens_deduped = 0
+        self.cache_hits = 0
+        self.calls_needed = 0
+        self.batches_sent = 0
+        self.batches_done = 0
+        self.issues_found = 0
+        self.split_texts = 0
+
+    async def add_lesson(self, ctitle: str, ltitle: str, problems: list[dict]):
+        """Queue a lesson's problems for review (waits while all slots are busy)."""
+        lesson_no = len(self._lessons)
+        # (problem title, [(field, text hash)]) in problem order
+        layout: list[tuple[str, list[tuple[str, str]]]] = []
+        new: dict[str, tuple[str, object]] = {}  # hash → (field, text) first seen here
+        for problem in problems:
+            fields = []
+            for field, value in _slim_problem(problem).items():
+                h = content_hash(value, self.model, _PROMPT_VERSION)
+                fields.append((field, h))
+                self.texts += 1
+                self._uses[h] += 1
+                if h in self._texts and self._texts[h].future.done():
+                    self.issues_found += len(self._texts[h].future.result())
+                if h in self._texts or h in new:
+                    self.tokens_deduped += estimate_tokens(json.dumps(value, default=str))
+                else:
+                    new[h] = (field, value)
+            layout.append((problem["title"], fields))
+        if not layout:
+            return
+        self.problems += len(layout)
+        self.calls_needed += (len(layout) + _FIXED_BATCH_SIZE - 1) // _FIXED_BATCH_SIZE
+
+        known: dict[str, list[dict]] = {}
+        if self.store is not None and new:
+            known = self.store.get_many(list(new), since=self.fresh_since)
+            self.cache_hits += len(known)
+
+        loop = asyncio.get_running_loop()
+        batches: list[_Batch] = []
+        for h, (field, value) in new.items():
+            text = self._texts[h] = _Text(loop.create_future())
+            if h in known:
+                text.future.set_result(known[h])
+                self.issues_found += len(known[h]) * self._uses[h]
                 continue
+            items = _text_items(
+                {"course": ctitle, "lesson": ltitle, "field": field}, value, self.max_tokens,
+            )
+            self.split_texts += len(items) > 1
+            text.parts = len(items)
+            for item in items:
+                tokens = estimate_tokens(json.dumps(item, default=str)) + _ITEM_OVERHEAD_TOKENS
+                if self._open.items and (
+                    self._open.tokens + tokens > self.max_tokens
+                    or len(self._open.items) >= self.batch_size
+                ):
+                    await self._flush(lesson_no)
+                self._open.items.append((h, item))
+                self._open.tokens += tokens
+                if not batches or batches[-1] is not self._open:
+                    batches.append(self._open)
+
+        self._lessons.append(asyncio.create_task(
+            self._collect(lesson_no, ctitle, ltitle, layout, batches)
+        ))
+
+    async def _flush(self, next_lesson_no: int):
+        """Send the batch being packed (waiting for a free slot)."""
+        batch, self._open = self._open, _Batch(next_lesson_no)
+        if not batch.items:
+            return
+        await self._slots.acquire()
+        self.batches_sent += 1
+        self._ensure_future(batch)
+        self._batches.append(asyncio.create_task(self._audit_batch(self.batches_sent, batch)))
+
+    def _ensure_future(self, batch: _Batch) -> asyncio.Future:
+        if batch.result is None:
+            batch.result = asyncio.get_running_loop().create_future()
+        return batch.result
+
+    async def _audit_batch(self, n: int, batch: _Batch):
+        """Review one batch (holding a slot) and settle its texts."""
+        payload = json.dumps(
+            [{"id": i, **item} for i, (_, item) in enumerate(batch.items, 1)],
+            default=str,
+        )
+        logger.info(
+            f"[ 🔍 llm_audit ] [batch {n}] {len(batch.items)} texts "
+            f"(~{estimate_tokens(payload)} tokens)"
+        )
+        batch_start = time.time()
+        found: dict[str, list[dict]] = {}
+        unattributed: list[dict] = []
+        # Attached to every text in the batch unless the review completes
+        error: dict | None = {
+            "issue_type": "audit_error",
+            "description": f"LLM audit cancelled (batch {n})",
+        }
 
-            # Only send markdown-relevant fields to keep the payload small
-            slim_problems = []
-            for p in problems:
-                slim = {}
-                for field in _MARKDOWN_FIELDS:
-                    val = p.get(field)
-                    if val is not None:
-                        slim[field] = val
-                slim_problems.append(slim)
-
-            # Process in batches
-            lesson_batches = (len(slim_problems) + batch_size - 1) // batch_size
-
-            for i in range(0, len(slim_problems), batch_size):
-                batch = slim_problems[i : i + batch_size]
-                batch_num = (i // batch_size) + 1
-                batch_counter += 1
-
-                payload = json.dumps(
-                    {
-                        "course": ctitle,
-                        "lesson": ltitle,
-                        "problems": batch,
-                    },
-                    default=str,
-                    indent=2,
-                )
+        try:
+            reply = await self.agent.complete([
+                {"role": "system", "content": CONTENT_AUDIT_PROMPT},
+                {
+                    "role": "user",
+                    "content": f"Review the markdown formatting:\n\n{payload}",
+                },
+            ])
+            batch_elapsed = time.time() - batch_start
+
+            parsed = _parse_llm_issues(reply)
+            found, unattributed = _attribute_issues(parsed, batch.items)
+            error = None
+            self.batches_done += 1
+            logger.info(
+                f"[ ✅ llm_audit ] [batch {n}] "
+                f"→ {len(parsed)} issues found ({batch_elapsed:.1f}s, "
+                f"{self.batches_done}/{self.batches_sent} sent batches done)"
+            )
 
-                logger.info(
-                    f"[ 🔍 llm_audit ] [{batch_counter}/{total_batches_all}] "
-                    f"{ctitle} / {ltitle} — "
-                    f"batch {batch_num}/{lesson_batches} "
-                    f"({len(batch)} problems, "
-                    f"payload {len(payload)} chars)"
+        except Exception as e:
+            batch_elapsed = time.time() - batch_start
+            self.batches_done += 1
+            logger.error(
+                f"[ ❌ llm_audit ] [batch {n}] Failed ({batch_elapsed:.1f}s): {e}"
+            )
+            error = {
+                "issue_type": "audit_error",
+                "description": f"LLM audit failed (batch {n}): {e}",
+            }
+
+        finally:
+            self._slots.release()
+            # Always settle, or the lessons waiting on this batch never finish
+            self._settle(batch, found, unattributed, error)
+
+    def _settle(
+        self,
+        batch: _Batch,
+        found: dict[str, list[dict]],
+        unattributed: list[dict],
+        error: dict | None,
+    ):
+        """Resolve a batch's texts (each once all its parts are back), then save them."""
+        fresh: dict[str, list[dict]] = {}
+        for h, _ in batch.items:
+            text = self._texts[h]
+            text.parts -= 1
+            # Don't store texts from a batch with unattributed issues or an
+            # error — they would come back clean next time
+            text.failed |= bool(unattributed) or error is not None
+            text.issues += found.pop(h, [])
+            # A text that wasn't reviewed reports the error wherever it is used
+            # (whichever lesson it's in, and every problem deduped onto it)
+            if error is not None and error not in text.issues:
+                text.issues.append(dict(error))
+            if text.parts == 0 and not text.future.done():
+                if not text.failed:
+                    fresh[h] = text.issues
+                text.future.set_result(text.issues)
+                self.issues_found += len(text.issues) * self._uses[h]
+        self.issues_found += len(unattributed)
+        self._ensure_future(batch)
+        if not batch.result.done():
+            batch.result.set_result(unattributed)
+
+        if self.store is not None and fresh:
+            try:
+                self.store.put_many(fresh)
+            except Exception as e:
+                # The findings are still reported; they'll just be re-audited next time
+                logger.error(
+                    f"[ ❌ llm_audit ] Could not save findings for {len(fresh)} texts: {e}"
                 )
 
-                agent = DataAgent(endpoint, model, api_key)
-                batch_start = time.time()
-
-                try:
-                    resp = agent.client.chat.completions.create(
-                        model=agent.model,
-                        messages=[
-                            {"role": "system", "content": CONTENT_AUDIT_PROMPT},
-                            {
-                                "role": "user",
-                                "content": f"Review the markdown formatting:\n\n{payload}",
-                            },
-                        ],
-                        temperature=0.2,
-                    )
-                    reply = resp.choices[0].message.content.strip()
-                    batch_elapsed = time.time() - batch_start
-
-                    parsed = _parse_llm_issues(reply)
-                    for issue in parsed:
-                        issue["course"] = ctitle
-                        issue["lesson"] = ltitle
-                        issue["source"] = "llm"
-                    issues.extend(parsed)
-
-                    logger.info(
-                        f"[ ✅ llm_audit ] [{batch_counter}/{total_batches_all}] "
-                        f"→ {len(parsed)} issues found ({batch_elapsed:.1f}s)"
-                    )
-
-                except Exception as e:
-                    batch_elapsed = time.time() - batch_start
-                    logger.error(
-                        f"[ ❌ llm_audit ] [{batch_counter}/{total_batches_all}] "
-                        f"Failed for {ctitle}/{ltitle} "
-                        f"batch {batch_num} ({batch_elapsed:.1f}s): {e}"
-                    )
+    async def _collect(
+        self,
+        lesson_no: int,
+        ctitle: str,
+        ltitle: str,
+        layout: list[tuple[str, list[tuple[str, str]]]],
+        batches: list[_Batch],
+    ) -> list[dict]:
+        """
+        A lesson's issues in problem order — each text's findings copied to
+        every problem field using it — then anything the LLM reported that
+        couldn't be tied to a text (kept by the lesson that opened the batch).
+        A text whose batch failed carries an audit_error issue instead.
+        """
+        extra: list[dict] = []
+        for batch in batches:
+            unattributed = await self._ensure_future(batch)
+            if batch.lesson_no == lesson_no:
+                extra += unattributed
+
+        issues: list[dict] = []
+        for title, fields in layout:
+            for field, h in fields:
+                for issue in await self._texts[h].future:
                     issues.append({
+                        "problem_title": title,
+                        "field": field,
+                        **issue,
                         "course": ctitle,
                         "lesson": ltitle,
-                        "issue_type": "audit_error",
-                        "description": (
-                            f"LLM audit failed (batch {batch_num}): {e}"
-                        ),
                         "source": "llm",
                     })
+        for issue in extra:
+            issues.append({
+                **{k: v for k, v in issue.items() if k not in ("course", "lesson", "source")},
+                "course": ctitle,
+                "lesson": ltitle,
+                "source": "llm",
+            })
 
-    total_elapsed = time.time() - audit_start
-    logger.info(
-        f"[ ✅ llm_audit ] Complete — {len(issues)} issues found "
-        f"across {batch_counter} batches in {total_elapsed:.1f}s"
+        if self.on_issues is not None:
+            self._pending[lesson_no] = issues
+            while self._emitted in self._pending:
+                self.on_issues(self._pending.pop(self._emitted))
+                self._emitted += 1
+        return issues
+
+    async def finish(self) -> list[dict]:
+        """Send what's left, wait for every batch and return all issues in content order."""
+        try:
+            await self._flush(len(self._lessons))
+            results = await asyncio.gather(*self._lessons)
+        finally:
+            await self.aclose()
+        issues = [issue for lesson_issues in results for issue in lesson_issues]
+
+        backoffs = self.agent.limiter.backoffs
+        logger.info(
+            f"[ ✅ llm_audit ] Complete — {len(issues)} issues found "
+            f"across {self.batches_sent} batches in {time.time() - self.started:.1f}s; "
+            f"{self.texts} texts, {len(self._texts)} unique "
+            f"(~{self.tokens_deduped} tokens deduped), "
+            f"{self.cache_hits} unchanged since the last audit, "
+            f"{self.calls_avoided} LLM calls avoided"
+            + (f" ({backoffs} rate-limit back-offs)" if backoffs else "")
+        )
+        return issues
+
+    async def aclose(self):
+        """Cancel any batch still running and close the client."""
+        for task in self._batches + self._lessons:
+            task.cancel()
+        await self.agent.close()
+
+    @property
+    def calls_avoided(self) -> int:
+        return max(self.calls_needed - self.batches_sent, 0)
+
+    def stats(self) -> dict:
+        unique = len(self._texts)
+        return {
+            "llm_texts": self.texts,
+            "llm_unique_texts": unique,
+            "llm_dedupe_ratio": round(self.texts / unique, 2) if unique else 1.0,
+            "llm_dedupe_tokens_saved": self.tokens_deduped,
+            "llm_cache_hits": self.cache_hits,
+            "llm_batches": self.batches_sent,
+            "llm_calls_avoided": self.calls_avoided,
+            "llm_split_texts": self.split_texts,
+        }
+
+
+async def llm_audit(
+    content: dict,
+    endpoint: str,
+    model: str,
+    api_key: str,
+    batch_size: int = 100,
+    concurrency: int = AUDIT_CONCURRENCY,
+    store: AuditStore | None = None,
+    refresh: bool = False,
+    stats: dict | None = None,
+) -> list[dict]:
+    """
+    Send the problems of a content tree to the LLM in batches for markdown
+    formatting review (see :class:`LLMAuditor`). ``stats`` receives the
+    cache counters.
+    """
+    auditor = LLMAuditor(
+        endpoint, model, api_key,
+        batch_size=batch_size, concurrency=concurrency,
+        store=store, refresh=refresh,
     )
+    try:
+        for course in content["courses"]:
+            for lesson in course.get("lessons", []):
+                await auditor.add_lesson(
+                    course["title"], lesson["title"], lesson.get("problems", []),
+                )
+    except BaseException:
+        await auditor.aclose()
+        raise
+    issues = await auditor.finish()
+    if stats is not None:
+        stats.update(auditor.stats())
     return issues
 
 
@@ -442,72 +1223,225 @@ def _parse_llm_issues(text: str) -> list[dict]:
 
 # ── Orchestrator ──────────────────────────────────────────────────────────────
 
+class AuditProgress:
+    """
+    Live view of a running audit, for the background job endpoints.
+
+    :func:`run_content_audit` updates it as it goes; :meth:`snapshot` turns
+    it into counts plus an ETA. The total number of LLM batches isn't known
+    until every lesson has been read, so until then it is extrapolated from
+    the batches sent for the lessons read so far.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.phase = "starting"
+        self.totals: dict = {}
+        self.lessons_read = 0
+        self.structural_issues = 0
+        self.lint_issues = 0
+        self.auditor: LLMAuditor | None = None
+
+    def snapshot(self) -> dict:
+        auditor = self.auditor
+        sent = auditor.batches_sent if auditor else 0
+        done = auditor.batches_done if auditor else 0
+        lessons = self.totals.get("lessons", 0)
+
+        if self.phase in ("llm", "done"):
+            batches_total = sent
+        elif self.lessons_read and lessons:
+            batches_total = max(round(sent * lessons / self.lessons_read), sent)
+        else:
+            batches_total = None
+
+        eta = None
+        if self.phase == "done":
+            eta = 0.0
+        elif auditor and done and batches_total is not None:
+            rate = done / (time.time() - auditor.started)
+            eta = round((batches_total - done) / rate, 1)
+
+        llm_issues = auditor.issues_found if auditor else 0
+        return {
+            "phase": self.phase,
+            "elapsed_seconds": round(time.time() - self.started, 1),
+            "lessons_read": self.lessons_read,
+            "lessons_total": lessons,
+            "batches_done": done,
+            "batches_sent": sent,
+            "batches_total": batches_total,
+            "batches_total_estimated": self.phase not in ("llm", "done"),
+            "eta_seconds": eta,
+            "issues_so_far": self.structural_issues + self.lint_issues + llm_issues,
+            "structural_issues": self.structural_issues,
+            "lint_issues": self.lint_issues,
+            "llm_issues": llm_issues,
+            "llm_cache_hits": auditor.cache_hits if auditor else 0,
+        }
+
+
 async def run_content_audit(
     endpoint: str = DEFAULT_ENDPOINT,
     model: str = DEFAULT_MODEL,
     api_key: str = DEFAULT_API_KEY,
     skip_llm: bool = False,
     problem_limit: int = 0,
-    batch_size: int = 10,
+    batch_size: int = 100,
+    concurrency: int = AUDIT_CONCURRENCY,
+    refresh: bool = False,
+    lint_only: bool = False,
+    pool=None,
+    progress: AuditProgress | None = None,
+    fresh_since: float | None = None,
+    on_issues: Callable[[str, list[dict]], None] | None = None,
 ) -> dict:
-    """Run the full content audit and return a report."""
+    """
+    Run the full content audit and return a report.
+
+    Uses the shared ``pool`` when given, otherwise opens (and closes) its own.
+    The markdown linter reports definite formatting issues itself; only
+    problems it can't fully judge go to the LLM. LLM findings are reused
+    from AUDIT_STORE_PATH for unchanged problems unless ``refresh`` is set.
+    ``lint_only`` runs just the linter — no structural checks, no LLM.
+    ``skip_llm`` runs just the structural checks, in SQL (see
+    :func:`structural_checks_sql`), without fetching the content at all.
+
+    ``progress`` (if given) is kept up to date while the audit runs;
+    ``fresh_since`` only reuses findings stored since then (see LLMAuditor).
+
+    With ``on_issues``, issues are handed to it as they are found —
+    ``("structural", issues)`` or ``("content", issues)``, a lesson's worth
+    at a time — instead of being collected, and the report only carries the
+    summary. Structural and lint issues come in content order as lessons
+    are read; LLM issues follow the same order, once each lesson is reviewed.
+    """
     run_start = time.time()
-    pool = await get_pool()
+    if progress is None:
+        progress = AuditProgress()
+    owns_pool = pool is None
+    if owns_pool:
+        pool = await get_pool()
 
     logger.info(
         f"[ 🚀 run_content_audit ] Starting audit "
         f"(problem_limit={problem_limit or 'all'}, "
-        f"batch_size={batch_size}, skip_llm={skip_llm})"
+        f"batch_size={batch_size}, concurrency={concurrency}, "
+        f"skip_llm={skip_llm}, refresh={refresh}, lint_only={lint_only})"
     )
 
-    try:
-        logger.info("[ 🚀 run_content_audit ] Fetching content...")
-        content = await fetch_content(pool, problem_limit=problem_limit)
-
-        logger.info(
-            f"[ 📊 run_content_audit ] Found "
-            f"{content['totals']['courses']} courses, "
-            f"{content['totals']['lessons']} lessons, "
-            f"{content['totals']['problems']} problems"
-        )
-
-        # ── Pass 1: structural checks ─────────────────────────────────────
-        logger.info("[ 🔧 run_content_audit ] Running structural checks...")
-        t0 = time.time()
-        structural_issues = structural_checks(content)
-        logger.info(
-            f"[ 🔧 run_content_audit ] Found "
-            f"{len(structural_issues)} structural issues "
-            f"({time.time() - t0:.1f}s)"
-        )
+    skip_llm = skip_llm or lint_only
+    store = AuditStore(AUDIT_STORE_PATH) if AUDIT_STORE_PATH and not skip_llm else None
+
+    structural_issues: list[dict] = []
+    lint_issues: list[dict] = []
+    llm_issues: list[dict] = []
+
+    def found(kind: str, issues: list[dict]):
+        if not issues:
+            return
+        if kind == "structural":
+            progress.structural_issues += len(issues)
+        elif kind == "lint":
+            progress.lint_issues += len(issues)
+        if on_issues is not None:
+            on_issues("structural" if kind == "structural" else "content", issues)
+        elif kind == "structural":
+            structural_issues.extend(issues)
+        else:
+            lint_issues.extend(issues)
 
-        # ── Pass 2: LLM content review ────────────────────────────────────
-        llm_issues: list[dict] = []
-        if not skip_llm:
-            logger.info("[ 🤖 run_content_audit ] Running LLM markdown review...")
-            llm_issues = await llm_audit(
-                content, endpoint, model, api_key, batch_size=batch_size,
+    try:
+        llm_stats: dict = {}
+        llm_count = 0
+        review_problems = 0
+
+        if skip_llm and not lint_only:
+            # Structural checks only need the offending rows — let Postgres
+            # count and null-check instead of pulling every problem
+            logger.info("[ 🔧 run_content_audit ] Running structural checks in SQL...")
+            progress.phase = "structural"
+            issues, totals = await structural_checks_sql(pool)
+            progress.totals = totals
+            found("structural", issues)
+        else:
+            # Stream lesson by lesson: each one goes through the structural
+            # checks and the linter, and its suspicious problems are queued
+            # for the LLM while the next lesson is read
+            auditor = None if skip_llm else LLMAuditor(
+                endpoint, model, api_key,
+                batch_size=batch_size, concurrency=concurrency,
+                store=store, refresh=refresh, fresh_since=fresh_since,
+                on_issues=(
+                    (lambda issues: found("llm", issues)) if on_issues is not None else None
+                ),
             )
+            totals: dict = {}
+            progress.phase = "reading"
+            progress.totals = totals
+            progress.auditor = auditor
+            try:
+                async for course, lesson in iter_lessons(pool, problem_limit, totals):
+                    if lesson is None:
+                        if not lint_only:
+                            found("structural", course_checks(course, course["lesson_count"]))
+                        continue
+                    if not lint_only:
+                        found("structural", lesson_checks(course["title"], lesson))
+                    lesson_lint, review = lint_lesson(course["title"], lesson)
+                    found("lint", lesson_lint)
+                    review_problems += len(review)
+                    progress.lessons_read += 1
+                    if auditor is not None:
+                        await auditor.add_lesson(course["title"], lesson["title"], review)
+            except BaseException:
+                if auditor is not None:
+                    await auditor.aclose()
+                raise
+
             logger.info(
-                f"[ 🤖 run_content_audit ] Found "
-                f"{len(llm_issues)} content issues"
+                f"[ 📊 run_content_audit ] Read {totals['courses']} courses, "
+                f"{totals['lessons']} lessons, {totals['problems']} problems — "
+                f"{progress.structural_issues} structural issues, "
+                f"{progress.lint_issues} lint issues, "
+                f"{review_problems} problems need an LLM look"
             )
-        else:
-            logger.info("[ ⏭️ run_content_audit ] Skipping LLM review (skip_llm=True)")
+
+            if auditor is not None:
+                logger.info("[ 🤖 run_content_audit ] Waiting for the LLM review...")
+                progress.phase = "llm"
+                issues = await auditor.finish()
+                llm_count = len(issues)
+                if on_issues is None:
+                    llm_issues = issues
+                llm_stats = auditor.stats()
+                logger.info(
+                    f"[ 🤖 run_content_audit ] Found "
+                    f"{llm_count} content issues"
+                )
+            else:
+                logger.info("[ ⏭️ run_content_audit ] Skipping LLM review")
 
         # ── Build report ──────────────────────────────────────────────────
-        total_issues = len(structural_issues) + len(llm_issues)
+        content_count = progress.lint_issues + llm_count
+        total_issues = progress.structural_issues + content_count
         report = {
             "generated_at": datetime.now(timezone.utc).isoformat(),
             "summary": {
-                **content["totals"],
-                "structural_issues": len(structural_issues),
-                "content_issues": len(llm_issues),
+                **totals,
+                "structural_issues": progress.structural_issues,
+                "content_issues": content_count,
+                "lint_issues": progress.lint_issues,
+                "llm_issues": llm_count,
+                "llm_review_problems": 0 if skip_llm else review_problems,
                 "total_issues": total_issues,
+                **llm_stats,
             },
-            "structural_issues": structural_issues,
-            "content_issues": llm_issues,
         }
+        if on_issues is None:
+            report["structural_issues"] = structural_issues
+            report["content_issues"] = lint_issues + llm_issues
+        progress.phase = "done"
 
         total_elapsed = time.time() - run_start
         logger.info(
@@ -518,5 +1452,7 @@ async def run_content_audit(
         return report
 
     finally:
-        await pool.close()
-
+        if store is not None:
+            store.close()
+        if owns_pool:
+            await pool.close()
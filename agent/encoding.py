@@ -0,0 +1,189 @@
+"""
+agent/encoding.py — Text encodings for query results and schema sent to the LLM.
+
+"json" is the original ``json.dumps(indent=2)`` layout, which repeats every
+column name on every row. The other formats print column names once:
+
+  compact   — a JSON array of column names, then one JSON array per row
+  csv / tsv — a header row, then one delimited line per row
+  markdown  — a markdown table
+
+For the schema, "compact" is unindented JSON and csv / tsv / markdown use
+one line per table: ``name(column type, …)``.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+import textwrap
+
+RESULT_FORMATS = ("json", "compact", "csv", "tsv", "markdown")
+
+
+def check_format(fmt: str) -> str:
+    if fmt not in RESULT_FORMATS:
+        raise ValueError(
+            f"Unknown result format {fmt!r} — expected one of {', '.join(RESULT_FORMATS)}"
+        )
+    return fmt
+
+
+def estimate_tokens(text: str | int) -> int:
+    """Rough token count (~4 characters per token) for a string or a length."""
+    length = text if isinstance(text, int) else len(text)
+    return (length + 3) // 4
+
+
+# ── Rows ──────────────────────────────────────────────────────────────────────
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str, separators=(",", ":"))
+    return str(value)
+
+
+def legacy_row(row: dict) -> str:
+    """One row as it appears inside an ``indent=2`` JSON array."""
+    return textwrap.indent(json.dumps(dict(row), indent=2, default=str), "  ")
+
+
+class RowEncoder:
+    """
+    Incremental row encoder, so results can be encoded while they stream in.
+
+    The full text is ``begin() + separator.join(rows) + end()``.
+    """
+
+    def __init__(self, fmt: str, columns: list[str]):
+        self.fmt = check_format(fmt)
+        self.columns = columns
+        self.separator = ",\n" if fmt == "json" else "\n"
+
+    def begin(self) -> str:
+        if self.fmt == "json":
+            return "[\n"
+        if self.fmt == "compact":
+            return json.dumps(self.columns, separators=(",", ":")) + "\n"
+        if self.fmt == "markdown":
+            header = "| " + " | ".join(self._md(c) for c in self.columns) + " |"
+            return header + "\n|" + "---|" * len(self.columns) + "\n"
+        return self._delimited(self.columns) + "\n"
+
+    def row(self, values) -> str:
+        values = list(values)
+        if self.fmt == "json":
+            return legacy_row(dict(zip(self.columns, values)))
+        if self.fmt == "compact":
+            return json.dumps(values, default=str, separators=(",", ":"))
+        if self.fmt == "markdown":
+            return "| " + " | ".join(self._md(_cell(v)) for v in values) + " |"
+        return self._delimited(_cell(v) for v in values)
+
+    def end(self) -> str:
+        return "\n]" if self.fmt == "json" else ""
+
+    def _delimited(self, cells) -> str:
+        if self.fmt == "tsv":
+            return "\t".join(
+                c.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+                for c in cells
+            )
+        buf = io.StringIO()
+        csv.writer(buf, lineterminator="").writerow(list(cells))
+        return buf.getvalue()
+
+    @staticmethod
+    def _md(text: str) -> str:
+        return text.replace("|", "\\|").replace("\n", " ")
+
+
+def empty_result(fmt: str) -> str:
+    return "[]" if fmt == "json" else "(0 rows)"
+
+
+# ── Schema ────────────────────────────────────────────────────────────────────
+
+def _table_line(table: dict) -> str:
+    cols = ", ".join(
+        f"{c['column']} {c.get('type', '')}".rstrip()
+        + (f" /* {c['comment']} */" if c.get("comment") else "")
+        for c in table.get("columns", [])
+    )
+    line = f"{table['table_name']}({cols})"
+    if table.get("references"):
+        line += f" → {', '.join(table['references'])}"
+    if table.get("comment"):
+        line += f"  -- {table['comment']}"
+    return line
+
+
+def encode_tables(tables: list[dict], fmt: str) -> str:
+    """Render schema tables in ``fmt``."""
+    check_format(fmt)
+    if fmt == "json":
+        return json.dumps(tables, indent=2)
+    if fmt == "compact":
+        return json.dumps(tables, separators=(",", ":"))
+    return "\n".join(_table_line(t) for t in tables)
+
+
+# ── Stats ─────────────────────────────────────────────────────────────────────
+
+class RowBaseline:
+    """
+    Size a result's rows would have as indent=2 JSON, for EncodingStats.
+
+    Only the first SAMPLE_ROWS rows are rendered that way; later rows count
+    as their encoded size plus the average difference seen in the sample
+    (mostly the repeated column names and indentation), so the stats cost
+    nothing per row on large results.
+    """
+
+    SAMPLE_ROWS = 20
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self.chars = len("[\n\n]")
+        self._sampled = 0
+        self._extra = 0  # indent=2 JSON chars over encoded chars, in the sample
+
+    def add(self, row, encoded: str):
+        if self.fmt == "json":
+            # Already the baseline layout
+            self.chars += len(encoded) + 2  # ",\n"
+        elif self._sampled < self.SAMPLE_ROWS:
+            legacy = len(legacy_row(row)) + 2
+            self._sampled += 1
+            self._extra += legacy - len(encoded)
+            self.chars += legacy
+        else:
+            self.chars += len(encoded) + round(self._extra / self._sampled)
+
+
+class EncodingStats:
+    """Per-run tally of characters sent vs. the indent=2 JSON baseline."""
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self.chars = 0
+        self.baseline_chars = 0
+
+    def add(self, chars: int, baseline_chars: int):
+        self.chars += chars
+        self.baseline_chars += baseline_chars
+
+    @property
+    def chars_saved(self) -> int:
+        return self.baseline_chars - self.chars
+
+    def summary(self) -> dict:
+        return {
+            "format": self.fmt,
+            "chars": self.chars,
+            "baseline_chars": self.baseline_chars,
+            "chars_saved": self.chars_saved,
+            "tokens_saved_est": estimate_tokens(max(self.chars_saved, 0)),
+        }
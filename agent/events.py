@@ -0,0 +1,172 @@
+"""
+agent/events.py — Progress events of an agent run.
+
+run_agent reports what it is doing as typed events instead of printing
+them, so that each front end can show progress its own way:
+
+  - the CLI prints them (ConsoleSink, the default)
+  - ``POST /run/stream`` sends them to the client as Server-Sent Events
+  - the Slack bot reads that stream and updates its reply in place
+
+Every event is a dict with a ``type`` and the fields below:
+
+  schema        tables, chars, text       the (pruned) schema sent to the LLM
+  step          step, max_steps
+  prompt        messages, chars, tokens, compacted, tokens_saved, over_budget
+  action        action, reason (+ query / queries / tables … as chosen)
+  sql           query, profile, early     a query was started
+  result        action, chars, seconds    an action's result went to the LLM
+                (+ index, label for one query of a sql_batch)
+  error         message, index?, label?   a failed action or unreadable reply
+  notice        kind, message             retries, fallbacks, early queries
+  answer_delta  text                      more of the answer, while it streams
+  answer        text                      the final answer
+  encoding      the EncodingStats summary
+  done          success, steps, result?, error?   always the last event
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import Callable
+
+EventSink = Callable[[dict], None]
+
+
+class RunEvents:
+    """Passes the events of one run to every subscribed sink."""
+
+    def __init__(self, *sinks: EventSink):
+        self._sinks = list(sinks)
+
+    def subscribe(self, sink: EventSink):
+        self._sinks.append(sink)
+
+    def emit(self, type: str, **data):
+        event = {"type": type, **data}
+        for sink in self._sinks:
+            sink(event)
+
+
+class EventQueue:
+    """
+    A sink that queues events for an async consumer (e.g. an HTTP stream);
+    :meth:`get` returns None once it is closed.
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue[dict | None] = asyncio.Queue()
+
+    def __call__(self, event: dict):
+        self._queue.put_nowait(event)
+
+    def close(self):
+        self._queue.put_nowait(None)
+
+    async def get(self, timeout: float | None = None) -> dict | None:
+        """The next event; None once closed. Raises TimeoutError after ``timeout`` seconds."""
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+
+# ── Console ───────────────────────────────────────────────────────────────────
+
+_NOTICE_ICONS = {
+    "rate_limited": "⏳",
+    "fallback": "↩️",
+    "reask": "🔁",
+    "early_query": "⚡",
+    "early_dropped": "↪️",
+    "unknown_action": "⚠️",
+}
+
+
+class ConsoleSink:
+    """Prints events as the CLI always has (also the API's log output)."""
+
+    def __init__(self):
+        self._answering = False  # printing a streamed answer right now
+        self._streamed = False  # this step's answer was already printed
+
+    def __call__(self, event: dict):
+        kind = event["type"]
+        handler = getattr(self, f"_{kind}", None)
+        if handler:
+            handler(event)
+
+    def _schema(self, e: dict):
+        print(f"\n{'═'*60}")
+        print("  Available Schema")
+        print(f"{'═'*60}\n")
+        print(e["text"])
+        print(f"\n{'═'*60}\n")
+
+    def _step(self, e: dict):
+        self._streamed = False
+        print(f"\n{'─'*60}")
+        print(f"  Step {e['step']}/{e['max_steps']}")
+
+    def _prompt(self, e: dict):
+        print(
+            f"  📨  Prompt: {e['messages']} messages, {e['chars']:,} chars "
+            f"(~{e['tokens']:,} tokens)"
+            + (
+                f", {e['compacted']} older results compacted "
+                f"(~{e['tokens_saved']:,} tokens saved)"
+                if e["compacted"] else ""
+            )
+            + (" — over budget" if e["over_budget"] else "")
+        )
+
+    def _action(self, e: dict):
+        self._end_answer()
+        print(f"  Action: {e['action']}  —  {e['reason']}")
+
+    def _result(self, e: dict):
+        if e.get("index") is not None:
+            print(f"  📊  [{e['index']}] {e['label']} returned {e['chars']} chars of data")
+        elif e["action"] == "sql_batch":
+            print(f"  ⏱️  {e['queries']} queries ran concurrently in {e['seconds']:.1f}s")
+        elif e["action"] == "sql":
+            print(f"  📊  Query returned {e['chars']} chars of data")
+        else:
+            print(f"  🗂️  {e['action']} returned {e['chars']} chars")
+
+    def _error(self, e: dict):
+        self._end_answer()
+        if e.get("index") is not None:
+            print(f"  ❌  [{e['index']}] {e['label']} failed: {e['message']}")
+        else:
+            print(f"  ❌  {e['message']}")
+
+    def _notice(self, e: dict):
+        print(f"  {_NOTICE_ICONS.get(e['kind'], 'ℹ️')}  {e['message']}")
+
+    def _answer_delta(self, e: dict):
+        if not self._answering:
+            self._answering = self._streamed = True
+            print(f"\n{'═'*60}")
+            print("  ✅  AGENT ANSWER:\n")
+        print(e["text"], end="", flush=True)
+
+    def _answer(self, e: dict):
+        self._end_answer()
+        if not self._streamed:
+            print(f"\n{'═'*60}")
+            print(f"  ✅  AGENT ANSWER:\n\n{e['text']}")
+            print(f"{'═'*60}\n")
+
+    def _end_answer(self):
+        # The streamed answer ends when the reply has been parsed
+        if self._answering:
+            self._answering = False
+            print(f"\n{'═'*60}\n")
+
+    def _encoding(self, e: dict):
+        print(
+            f"  📦  Encoding ({e['format']}): {e['chars']} chars sent, "
+            f"{e['chars_saved']} saved vs indented JSON "
+            f"(~{e['tokens_saved_est']} tokens, ~{e['tokens_sent_est']} tokens sent)"
+        )
+
+    def _done(self, e: dict):
+        if not e["success"] and e.get("error"):
+            print(f"\n⚠️  {e['error']}")
@@ -0,0 +1,226 @@
+"""
+agent/history.py — Conversation history kept under a token budget.
+
+Every step resends the system prompt plus the whole history, so raw query
+results would make each request grow with the number of steps. History
+keeps the messages verbatim while they fit in the budget; past it, older
+tool results are replaced — oldest first — by compact summaries:
+
+  Query result (compacted, 48,012 chars): 200 rows shown (truncated), 4 columns
+  (id, email, plan, created_at). Rows whose values were cited since:
+  id,email,plan,created_at
+  17,ada@example.com,pro,2024-03-01
+
+"Cited" values are cells that reappear in a later assistant message (a
+follow-up query's WHERE clause, the reason, …). A sql_batch result is
+compacted query by query. Pinned messages (the GOAL and schema) and the
+latest tool result are never compacted.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+import re
+
+from agent.config import HISTORY_TOKEN_BUDGET
+from agent.encoding import estimate_tokens
+
+# Rows kept in a compacted result because later messages cite their values
+_CITED_ROWS = 10
+
+_RESULT_PREFIX = "Query result:\n"
+_BATCH_PREFIX = "Query results ("
+_TRUNCATED_NOTE = "\n…[truncated:"
+# Heading of one query's section in a sql_batch result
+_BATCH_SECTION = re.compile(r"^── \[(\d+)\] (.*) ──$", re.MULTILINE)
+
+
+def batch_section(n: int, label: str, body: str) -> str:
+    """One query's part of a sql_batch result message."""
+    label = " ".join(label.split())
+    return f"── [{n}] {label} ──\n{body}"
+
+
+# ── Result summaries ──────────────────────────────────────────────────────────
+
+def _parse_rows(body: str, fmt: str) -> tuple[str, list[str], list[tuple[str, list[str]]]]:
+    """
+    Split an encoded result into (header text, column names, [(row text, cells)]).
+    Raises ValueError when ``body`` isn't a table in ``fmt``.
+    """
+    if fmt == "json":
+        rows = json.loads(body)
+        if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+            raise ValueError("not a list of rows")
+        columns = list(rows[0]) if rows else []
+        return "", columns, [
+            (json.dumps(r, default=str, separators=(",", ":")), [str(v) for v in r.values()])
+            for r in rows
+        ]
+
+    lines = body.split("\n")
+    if fmt == "compact":
+        columns = json.loads(lines[0])
+        return lines[0], columns, [
+            (line, [str(v) for v in json.loads(line)]) for line in lines[1:] if line
+        ]
+    if fmt == "markdown":
+        def cells(line: str) -> list[str]:
+            return [c.strip() for c in line.strip().strip("|").split(" | ")]
+        return "\n".join(lines[:2]), cells(lines[0]), [
+            (line, cells(line)) for line in lines[2:] if line
+        ]
+    if fmt == "tsv":
+        return lines[0], lines[0].split("\t"), [
+            (line, line.split("\t")) for line in lines[1:] if line
+        ]
+    # csv — quoted cells may span lines, so re-read with the csv module
+    records = list(csv.reader(io.StringIO(body)))
+    if not records:
+        raise ValueError("empty")
+
+    def text(record: list[str]) -> str:
+        buf = io.StringIO()
+        csv.writer(buf, lineterminator="").writerow(record)
+        return buf.getvalue()
+
+    return lines[0], records[0], [(text(r), r) for r in records[1:]]
+
+
+def _is_cited(cell: str, later: str) -> bool:
+    cell = cell.strip()
+    # Short values ("1", "ok", "t") would match almost any text
+    if len(cell) < 3 and not (cell.isdigit() and len(cell) == 2):
+        return False
+    return re.search(rf"(?<!\w){re.escape(cell)}(?!\w)", later) is not None
+
+
+def summarize_result(content: str, fmt: str, later: str) -> str:
+    """
+    Compact form of a tool result message: size, shape and the rows whose
+    values appear in ``later`` (the assistant messages that followed it).
+    """
+    size = f"{len(content):,} chars"
+    if content.startswith(_BATCH_PREFIX):
+        # A sql_batch result — compact each query's section on its own
+        heads = list(_BATCH_SECTION.finditer(content))
+        parts = [content[: heads[0].start()].rstrip("\n")] if heads else [content]
+        for head, nxt in zip(heads, heads[1:] + [None]):
+            body = content[head.end() + 1 : nxt.start() if nxt else len(content)].rstrip("\n")
+            if body.startswith(_RESULT_PREFIX):
+                summary = summarize_result(body, fmt, later)
+                body = summary if len(summary) < len(body) else body
+            parts.append(f"{head.group()}\n{body}")
+        return "\n\n".join(parts)
+
+    if not content.startswith(_RESULT_PREFIX):
+        # Schema browsing output — keep its first line ("Tables (page 1/3 …")
+        first = content.split("\n", 1)[0][:200]
+        return f"{first}\n…[compacted, {size} — repeat the action to see it again]"
+
+    body = content[len(_RESULT_PREFIX):]
+    if body.startswith("Result profile:"):
+        lines = body.split("\n")
+        names = [l[2:].split(" (", 1)[0] for l in lines[1:] if l.startswith("- ")]
+        return (
+            f"Query result (compacted, {size}): {lines[0][len('Result profile: '):]}"
+            f" — columns {', '.join(names)}"
+        )
+
+    truncated = _TRUNCATED_NOTE in body
+    body = body.split(_TRUNCATED_NOTE, 1)[0]
+    if body.strip() in ("[]", "(0 rows)"):
+        return "Query result (compacted): 0 rows"
+    try:
+        header, columns, rows = _parse_rows(body, fmt)
+    except (ValueError, IndexError):
+        first = body.split("\n", 1)[0][:200]
+        return f"Query result (compacted, {size}), starting: {first}"
+
+    shown = f"{len(rows)} rows{' shown (truncated)' if truncated else ''}"
+    summary = (
+        f"Query result (compacted, {size}): {shown}, {len(columns)} columns "
+        f"({', '.join(columns)})."
+    )
+    cited = [text for text, cells in rows if any(_is_cited(c, later) for c in cells)]
+    if cited:
+        summary += " Rows whose values were cited since:\n"
+        summary += "\n".join(([header] if header else []) + cited[:_CITED_ROWS])
+        if len(cited) > _CITED_ROWS:
+            summary += f"\n… {len(cited) - _CITED_ROWS} more cited rows"
+    return summary
+
+
+# ── History ───────────────────────────────────────────────────────────────────
+
+class History:
+    """
+    A chat history that renders within ``budget`` estimated tokens.
+
+    Messages are appended as one of three kinds:
+
+      "message" — kept verbatim (assistant replies, step prompts, errors)
+      "pinned"  — kept verbatim, never compacted (the GOAL and schema)
+      "result"  — a tool result: verbatim while it's the latest or while
+                  everything fits, otherwise compacted oldest first
+    """
+
+    def __init__(self, budget: int = HISTORY_TOKEN_BUDGET):
+        self.budget = budget
+        # (message, kind, result format)
+        self._entries: list[tuple[dict, str, str | None]] = []
+        # Size of the last rendered prompt, for logging
+        self.last: dict = {}
+
+    def append(self, message: dict, kind: str = "message", fmt: str | None = None):
+        self._entries.append((message, kind, fmt))
+
+    def replace_last(self, content: str):
+        """Swap the content of the last message (e.g. for a re-asked reply)."""
+        message, kind, fmt = self._entries[-1]
+        self._entries[-1] = ({**message, "content": content}, kind, fmt)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self):
+        return (message for message, _, _ in self._entries)
+
+    def __getitem__(self, i):
+        return self._entries[i][0]
+
+    def messages(self, system: str) -> list[dict]:
+        """The system prompt plus the history, compacted to fit the budget."""
+        contents = [m["content"] for m, _, _ in self._entries]
+        sizes = [estimate_tokens(c) for c in contents]
+        full = estimate_tokens(system) + sum(sizes)
+        total = full
+
+        results = [i for i, (_, kind, _) in enumerate(self._entries) if kind == "result"]
+        compacted = 0
+        for i in results[:-1]:
+            if total <= self.budget:
+                break
+            _, _, fmt = self._entries[i]
+            later = "\n".join(
+                m["content"] for m, _, _ in self._entries[i + 1:] if m["role"] == "assistant"
+            )
+            summary = summarize_result(contents[i], fmt or "json", later)
+            if len(summary) < len(contents[i]):
+                total += estimate_tokens(summary) - sizes[i]
+                contents[i] = summary
+                compacted += 1
+
+        chars = len(system) + sum(map(len, contents))
+        self.last = {
+            "messages": len(contents) + 1,
+            "chars": chars,
+            "tokens": total,
+            "compacted": compacted,
+            "tokens_saved": full - total,
+            "over_budget": total > self.budget,
+        }
+        return [{"role": "system", "content": system}] + [
+            {**m, "content": c} for (m, _, _), c in zip(self._entries, contents)
+        ]
@@ -0,0 +1,386 @@
+"""
+agent/parsing.py — Tolerant parsing of the agent's JSON action replies.
+
+Models asked for "a single JSON object" still wrap it in ```json fences,
+add a sentence before or after it, use Python-style single quotes or
+True/False/None, or leave a trailing comma. parse_action scans for the
+first balanced {...} (skipping braces inside strings), and when that isn't
+valid JSON normalizes it in one pass:
+
+  - single-quoted strings become double-quoted
+  - True / False / None become true / false / null
+  - trailing commas before } or ] are dropped
+
+An object cut off mid-reply (an unterminated string, bracket or brace — the
+usual sign of hitting max_tokens) is not repaired: closing it would turn a
+truncated answer or query into a valid-looking action. Raw newlines inside
+strings (multi-line SQL) are accepted as they are. Anything unreadable
+raises ActionParseError with a message meant to be shown to the model when
+re-asking.
+
+ActionStream reads a reply while it is still being streamed, reporting each
+top-level field as soon as its value is complete (so a "query" can start
+running while the model writes the "reason") and the text of string values
+as it grows. It only follows strict JSON; the complete reply still goes
+through parse_action.
+"""
+from __future__ import annotations
+
+import json
+
+ACTIONS = (
+    "sql",
+    "sql_batch",
+    "list_tables",
+    "describe_table",
+    "search_columns",
+    "full_schema",
+    "answer",
+)
+
+# JSON schema of an action reply, for endpoints with structured output.
+# One flat object — "action" picks which of the other keys matter.
+ACTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "action": {"type": "string", "enum": list(ACTIONS)},
+        "reason": {"type": "string"},
+        "query": {"type": "string"},
+        "profile": {"type": "boolean"},
+        "queries": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "label": {"type": "string"},
+                    "query": {"type": "string"},
+                    "profile": {"type": "boolean"},
+                },
+                "required": ["query"],
+            },
+        },
+        "schema": {"type": "string"},
+        "page": {"type": "integer"},
+        "tables": {"type": "array", "items": {"type": "string"}},
+        "pattern": {"type": "string"},
+        "text": {"type": "string"},
+        "method": {"type": "string"},
+    },
+    "required": ["action", "reason"],
+}
+
+
+class ActionParseError(ValueError):
+    """The reply holds no usable action."""
+
+
+# ── Scanning ──────────────────────────────────────────────────────────────────
+
+_CLOSERS = {"{": "}", "[": "]"}
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def extract_object(text: str) -> str | None:
+    """
+    The first top-level {...} in ``text``, braces inside (single- or
+    double-quoted) strings ignored. An object still open when the text ends
+    is returned as is (and rejected by :func:`normalize`).
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+    depth = 0
+    quote = None
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if quote:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == quote:
+                quote = None
+        elif ch in "\"'":
+            quote = ch
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start : i + 1]
+    return text[start:]
+
+
+def normalize(candidate: str) -> str:
+    """
+    Rewrite near-JSON (see the module docstring) into JSON, in one pass.
+    Raises ActionParseError if ``candidate`` was cut off.
+    """
+    out: list[str] = []
+    stack: list[str] = []
+    quote = None
+    i = 0
+    n = len(candidate)
+    while i < n:
+        ch = candidate[i]
+        if quote:
+            if ch == "\\" and i + 1 < n:
+                nxt = candidate[i + 1]
+                # \' is not a JSON escape; inside a converted string it's just '
+                out.append("'" if nxt == "'" else ch + nxt)
+                i += 2
+                continue
+            if ch == quote:
+                out.append('"')
+                quote = None
+            elif ch == '"':
+                out.append('\\"')  # a double quote inside a single-quoted string
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        if ch in "\"'":
+            quote = ch
+            out.append('"')
+        elif ch in "{[":
+            stack.append(_CLOSERS[ch])
+            out.append(ch)
+        elif ch in "}]":
+            _drop_trailing_comma(out)
+            if stack:
+                stack.pop()
+            out.append(ch)
+        else:
+            for word, literal in _LITERALS.items():
+                if (
+                    candidate.startswith(word, i)
+                    and not (i and (candidate[i - 1].isalnum() or candidate[i - 1] == "_"))
+                    and not candidate[i + len(word) : i + len(word) + 1].isalnum()
+                ):
+                    out.append(literal)
+                    i += len(word)
+                    break
+            else:
+                out.append(ch)
+                i += 1
+            continue
+        i += 1
+
+    # Cut off mid-reply — whatever it says is incomplete, so ask again
+    if quote:
+        raise ActionParseError("the reply was cut off inside a string")
+    if stack:
+        raise ActionParseError(
+            f"the reply was cut off before its closing {''.join(reversed(stack))}"
+        )
+    return "".join(out)
+
+
+def _drop_trailing_comma(out: list[str]):
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    if j >= 0 and out[j] == ",":
+        del out[j]
+
+
+# ── Actions ───────────────────────────────────────────────────────────────────
+
+def _loads(text: str):
+    # strict=False lets raw newlines through inside strings (multi-line SQL)
+    return json.loads(text, strict=False)
+
+
+def parse_action(text: str) -> tuple[dict, bool]:
+    """
+    The action object in an LLM reply, and whether it needed repairing.
+    Raises ActionParseError saying what was wrong.
+    """
+    text = text.strip()
+    try:
+        action, repaired = _loads(text), False
+    except json.JSONDecodeError:
+        candidate = extract_object(text)
+        if candidate is None:
+            raise ActionParseError("no JSON object found in the reply") from None
+        repaired = True
+        try:
+            action = _loads(candidate)
+        except json.JSONDecodeError:
+            try:
+                action = _loads(normalize(candidate))
+            except json.JSONDecodeError as e:
+                raise ActionParseError(
+                    f"invalid JSON ({e.msg} at line {e.lineno} column {e.colno})"
+                ) from None
+
+    if not isinstance(action, dict):
+        raise ActionParseError(f"expected a JSON object, got {type(action).__name__}")
+    act = action.get("action")
+    if act is None:
+        raise ActionParseError('the object has no "action" key')
+    if act not in ACTIONS:
+        raise ActionParseError(
+            f"unknown action {act!r} — expected one of {', '.join(ACTIONS)}"
+        )
+    return action, repaired
+
+
+# ── Streaming ─────────────────────────────────────────────────────────────────
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class ActionStream:
+    """
+    Incremental reader of a streamed action reply — :meth:`feed` it each
+    delta as it arrives.
+
+      on_field(key, value, fields) — a top-level field's value is complete
+      on_text(key, delta, fields)  — more of a top-level string value arrived
+
+    ``fields`` holds the fields completed so far (in the order written).
+    Text before the object (a ```json fence) is skipped; anything that isn't
+    strict JSON stops the reader, leaving the rest to parse_action.
+    """
+
+    def __init__(self, on_field=None, on_text=None):
+        self.on_field = on_field
+        self.on_text = on_text
+        self.fields: dict = {}
+        self._state = "seek"
+        self._key = ""
+        self._buf: list[str] = []  # the key, string value or raw value being read
+        self._sent = 0  # characters of a string value already passed to on_text
+        self._escape: str | None = None  # escape sequence after a backslash
+        self._high: str | None = None  # high surrogate waiting for its pair
+        self._depth = 0  # nesting inside an object / array value
+        self._quoted = False  # inside a string within such a value
+
+    @property
+    def done(self) -> bool:
+        return self._state in ("done", "broken")
+
+    def feed(self, delta: str):
+        if self.done:
+            return
+        for ch in delta:
+            self._step(ch)
+            if self.done:
+                return
+        # One on_text call per delta, not per character
+        if self._state == "string":
+            self._text()
+
+    def _step(self, ch: str):
+        state = self._state
+        if state == "seek":
+            if ch == "{":
+                self._state = "key"
+        elif state == "key":
+            if ch == '"':
+                self._state, self._buf = "key_string", []
+            elif ch == "}":
+                self._state = "done"
+            elif not (ch.isspace() or ch == ","):
+                self._state = "broken"
+        elif state == "key_string":
+            if self._read_char(ch):
+                self._key = "".join(self._buf)
+                self._state = "colon"
+        elif state == "colon":
+            if ch == ":":
+                self._state = "value"
+            elif not ch.isspace():
+                self._state = "broken"
+        elif state == "value":
+            if ch == '"':
+                self._state, self._buf, self._sent = "string", [], 0
+            elif ch in "{[":
+                self._state, self._buf, self._depth = "nested", [ch], 1
+            elif not ch.isspace():
+                self._state, self._buf = "scalar", [ch]
+        elif state == "string":
+            if self._read_char(ch):
+                self._text()
+                self._field("".join(self._buf))
+        elif state == "nested":
+            self._buf.append(ch)
+            if self._quoted:
+                if self._escape is not None:
+                    self._escape = None
+                elif ch == "\\":
+                    self._escape = ""
+                elif ch == '"':
+                    self._quoted = False
+            elif ch == '"':
+                self._quoted = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._field_json("".join(self._buf))
+        elif state == "scalar":
+            if ch in ",}" or ch.isspace():
+                self._field_json("".join(self._buf).strip())
+                if ch == "}" and not self.done:
+                    self._state = "done"
+            else:
+                self._buf.append(ch)
+
+    def _read_char(self, ch: str) -> bool:
+        """Add one character of a JSON string to the buffer; True at its closing quote."""
+        if self._escape is not None:
+            self._escape += ch
+            if self._escape[0] != "u":
+                if self._escape not in _ESCAPES:
+                    self._state = "broken"
+                    return False
+                self._buf.append(_ESCAPES[self._escape])
+                self._escape = None
+            elif len(self._escape) == 5:
+                try:
+                    char = chr(int(self._escape[1:], 16))
+                except ValueError:
+                    self._state = "broken"
+                    return False
+                self._escape = None
+                if "\ud800" <= char <= "\udbff":
+                    self._high = char
+                elif "\udc00" <= char <= "\udfff" and self._high:
+                    pair = (self._high + char).encode("utf-16", "surrogatepass")
+                    self._buf.append(pair.decode("utf-16"))
+                    self._high = None
+                else:
+                    self._buf.append(char)
+            return False
+        if ch == "\\":
+            self._escape = ""
+            return False
+        if ch == '"':
+            return True
+        self._buf.append(ch)
+        return False
+
+    def _text(self):
+        """Report the part of the string value read since the last call."""
+        if self.on_text and len(self._buf) > self._sent:
+            self.on_text(self._key, "".join(self._buf[self._sent:]), self.fields)
+        self._sent = len(self._buf)
+
+    def _field_json(self, raw: str):
+        try:
+            value = _loads(raw)
+        except json.JSONDecodeError:
+            self._state = "broken"
+            return
+        self._field(value)
+
+    def _field(self, value):
+        self.fields[self._key] = value
+        self._state = "key"
+        if self.on_field:
+            self.on_field(self._key, value, self.fields)
@@ -5,13 +5,49 @@ Connects directly to any PostgreSQL instance via asyncpg.
 """
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
 import re
+import time
 
 import asyncpg
 
-from agent.config import DATABASE_URL, MAX_RESULT_CHARS
+from agent.cache import LRUCache
+from agent.config import (
+    DATABASE_URL,
+    DB_SCHEMAS,
+    EXPLAIN_CACHE_SIZE,
+    EXPLAIN_CACHE_TTL,
+    EXPLAIN_GUARD,
+    EXPLAIN_MAX_COST,
+    EXPLAIN_MAX_ROWS,
+    EXPLAIN_SEQSCAN_MIN_COST,
+    LOCK_TIMEOUT_MS,
+    MAX_RESULT_CHARS,
+    MAX_RESULT_ROWS,
+    PG_POOL_HEALTH_CHECK,
+    PG_POOL_MAX_INACTIVE_LIFETIME,
+    PG_POOL_MAX_SIZE,
+    PG_POOL_MIN_SIZE,
+    QUERY_WORK_MEM,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_SKIP_TABLES,
+    RESULT_CACHE_TTL,
+    RESULT_FETCH_ROWS,
+    RESULT_FORMAT,
+    RESULT_PROFILE,
+    RESULT_PROFILE_FETCH_ROWS,
+    RESULT_PROFILE_MAX_ROWS,
+    RESULT_PROFILE_MAX_SECONDS,
+    RESULT_PROFILE_SAMPLE_ROWS,
+    SCHEMA_CACHE_TTL,
+    SQL_BATCH_MAX_QUERIES,
+    STATEMENT_TIMEOUT_MS,
+)
+from agent.encoding import EncodingStats, RowBaseline, RowEncoder, check_format, empty_result
+from agent.profiling import ResultProfiler
+from agent.schema import SchemaIndex, render_tables
 
 logger = logging.getLogger(__name__)
 
@@ -32,61 +68,646 @@ def _validate_readonly(query: str):
         raise ValueError(f"Query rejected — must start with SELECT or WITH (CTE).")
 
 
+_SQL_TOKEN = re.compile(
+    r"""
+      (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<string>[EeBbXxNn]?'(?:[^']|'')*')
+    | (?P<dollar>\$(?P<tag>[A-Za-z_]*)\$.*?\$(?P=tag)\$)
+    | (?P<ident>"(?:[^"]|"")*")
+    | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<word>[A-Za-z_][A-Za-z_0-9$]*)
+    | (?P<space>\s+)
+    | (?P<op>::|<=|>=|<>|!=|\|\||.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def normalize_sql(query: str) -> str:
+    """
+    Canonical form of a query, used as a cache key.
+
+    Drops comments and trailing semicolons, collapses whitespace, lowercases
+    keywords and unquoted identifiers, and writes integer literals without
+    leading zeros. String literals and quoted identifiers are kept verbatim.
+    """
+    tokens = []
+    for m in _SQL_TOKEN.finditer(query):
+        kind = m.lastgroup
+        text = m.group()
+        if kind in ("comment", "space"):
+            continue
+        if kind == "word":
+            text = text.lower()
+        elif kind == "number" and text.isdigit():
+            text = str(int(text))
+        elif kind == "string" and text[0] != "'":
+            text = text[0].upper() + text[1:]
+        tokens.append(text)
+    while tokens and tokens[-1] == ";":
+        tokens.pop()
+    return " ".join(tokens)
+
+
+# Runs on normalize_sql() output, so tokens are space-separated and lowercase
+_TABLE_REF = re.compile(r'\b(?:from|join) ((?:"[^"]*"|\w+)(?: \. (?:"[^"]*"|\w+))?)')
+
+
+def referenced_tables(normalized: str) -> frozenset[str]:
+    """
+    Best-effort set of tables a normalized query reads (FROM / JOIN targets),
+    without quotes and without a "public." prefix. CTE names may show up too.
+    """
+    tables = set()
+    for ref in _TABLE_REF.findall(normalized):
+        name = ref.replace(" . ", ".").replace('"', "").lower()
+        tables.add(name.removeprefix("public."))
+    return frozenset(tables)
+
+
+# Calls whose result depends on when (or how often) the query runs — checked
+# on normalize_sql() output. A column with one of these names only costs a
+# cache miss
+_VOLATILE = re.compile(
+    r"\b(?:now|current_date|current_time|current_timestamp|localtime|localtimestamp"
+    r"|clock_timestamp|statement_timestamp|transaction_timestamp|timeofday"
+    r"|random|setseed|gen_random_uuid|uuid_generate_v[14]"
+    r"|nextval|currval|lastval|txid_current)\b"
+    r"|\bage \( [^,()]* \)"  # age(x) counts from current_date
+    r"|'(?:now|today|tomorrow|yesterday)'",
+)
+
+
+def is_volatile(normalized: str) -> bool:
+    """Whether a normalized query reads the clock, a sequence or a random source."""
+    return _VOLATILE.search(normalized) is not None
+
+
 # ── Connection ────────────────────────────────────────────────────────────────
 
-async def get_pool() -> asyncpg.Pool:
-    """Create and return a connection pool."""
+async def _ping(conn: asyncpg.Connection):
+    """
+    Pool setup hook — fail fast on a dead connection. asyncpg closes it and
+    raises the error from acquire(); it does not retry with another one.
+    """
+    await conn.execute("SELECT 1")
+
+
+async def get_pool(
+    min_size: int = PG_POOL_MIN_SIZE,
+    max_size: int = PG_POOL_MAX_SIZE,
+) -> asyncpg.Pool:
+    """
+    Create and return a connection pool.
+
+    The API creates one pool at startup and shares it across requests;
+    the CLI calls this once per run.
+    """
     if not DATABASE_URL:
         raise RuntimeError("DATABASE_URL must be set in .env")
-    return await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=5)
+    logger.info(
+        f"[ 🔌 get_pool ] Creating pool (min={min_size}, max={max_size}, "
+        f"idle={PG_POOL_MAX_INACTIVE_LIFETIME}s, health_check={PG_POOL_HEALTH_CHECK})"
+    )
+    return await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=min_size,
+        max_size=max_size,
+        max_inactive_connection_lifetime=PG_POOL_MAX_INACTIVE_LIFETIME,
+        setup=_ping if PG_POOL_HEALTH_CHECK else None,
+    )
 
 
 # ── Schema discovery ─────────────────────────────────────────────────────────
 
-async def list_tables(pool: asyncpg.Pool) -> str:
-    """Fetch available tables and their columns from information_schema."""
-    query = """
-        SELECT
-            table_name,
-            json_agg(json_build_object(
-                'column', column_name,
-                'type', data_type
-            )) AS columns
-        FROM information_schema.columns
-        WHERE table_schema = 'public'
-        GROUP BY table_name
-        ORDER BY table_name;
+# Restricts catalog queries to the DB_SCHEMAS namespaces, passed as $1
+# (NULL = every non-system schema)
+_NAMESPACE_FILTER = """
+    CASE WHEN $1::text[] IS NULL
+         THEN n.nspname NOT IN ('pg_catalog', 'information_schema')
+              AND n.nspname NOT LIKE 'pg\\_%'
+         ELSE n.nspname = ANY($1::text[])
+    END
+"""
+
+# Tables in "public" keep their bare name, everything else is schema-qualified
+_QUALIFIED_NAME = (
+    "CASE WHEN {ns}.nspname = 'public' THEN {rel}.relname "
+    "ELSE {ns}.nspname || '.' || {rel}.relname END"
+)
+
+_SCHEMA_QUERY = f"""
+    SELECT
+        {_QUALIFIED_NAME.format(ns="n", rel="c")} AS table_name,
+        obj_description(c.oid, 'pg_class') AS comment,
+        json_agg(json_build_object(
+            'column', a.attname,
+            'type', format_type(a.atttypid, a.atttypmod),
+            'comment', col_description(c.oid, a.attnum)
+        ) ORDER BY a.attnum) AS columns
+    FROM pg_catalog.pg_class c
+    JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid
+    WHERE {_NAMESPACE_FILTER}
+      AND c.relkind IN ('r', 'v', 'm', 'p', 'f')
+      AND a.attnum > 0
+      AND NOT a.attisdropped
+      AND has_table_privilege(c.oid, 'SELECT')
+    GROUP BY c.oid, n.nspname, c.relname
+    ORDER BY 1;
+"""
+
+_FOREIGN_KEY_QUERY = f"""
+    SELECT DISTINCT
+        {_QUALIFIED_NAME.format(ns="n", rel="src")} AS table_name,
+        {_QUALIFIED_NAME.format(ns="dn", rel="dst")} AS references
+    FROM pg_catalog.pg_constraint k
+    JOIN pg_catalog.pg_class src ON src.oid = k.conrelid
+    JOIN pg_catalog.pg_class dst ON dst.oid = k.confrelid
+    JOIN pg_catalog.pg_namespace n ON n.oid = src.relnamespace
+    JOIN pg_catalog.pg_namespace dn ON dn.oid = dst.relnamespace
+    WHERE k.contype = 'f'
+      AND {_NAMESPACE_FILTER};
+"""
+
+# Hashes the raw catalog rows behind the schema (columns and foreign keys).
+# Much cheaper than loading the schema, and changes whenever a table or
+# column is added, dropped, renamed or retyped, or a foreign key changes.
+_FINGERPRINT_QUERY = f"""
+    SELECT md5(
+        coalesce((
+            SELECT string_agg(
+                c.oid::text || ':' || c.relname || ':' || a.attnum || ':'
+                    || a.attname || ':' || a.atttypid::text,
+                ',' ORDER BY c.oid, a.attnum
+            )
+            FROM pg_catalog.pg_attribute a
+            JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            WHERE {_NAMESPACE_FILTER}
+              AND c.relkind IN ('r', 'v', 'm', 'p', 'f')
+              AND a.attnum > 0
+              AND NOT a.attisdropped
+        ), '') || '|' || coalesce((
+            SELECT string_agg(k.oid::text, ',' ORDER BY k.oid)
+            FROM pg_catalog.pg_constraint k
+            JOIN pg_catalog.pg_namespace n ON n.oid = k.connamespace
+            WHERE k.contype = 'f'
+              AND {_NAMESPACE_FILTER}
+        ), '')
+    ) AS fingerprint;
+"""
+
+
+def _parse_tables(rows, fk_rows) -> list[dict]:
+    """Build ``[{table_name, comment?, columns, references?}]`` from catalog rows."""
+    references: dict[str, list[str]] = {}
+    for row in fk_rows:
+        references.setdefault(row["table_name"], []).append(row["references"])
+
+    tables = []
+    for row in rows:
+        table = {"table_name": row["table_name"]}
+        if row["comment"]:
+            table["comment"] = row["comment"]
+        table["columns"] = [
+            {k: v for k, v in col.items() if v is not None}
+            for col in json.loads(row["columns"])
+        ]
+        if row["table_name"] in references:
+            table["references"] = sorted(references[row["table_name"]])
+        tables.append(table)
+    return tables
+
+
+class SchemaCache:
+    """
+    In-process cache of the discovered schema.
+
+    Keeps the parsed tables, the rendered prompt text and a BM25 index for
+    relevance ranking. Every lookup runs the cheap catalog fingerprint query;
+    the full schema is reloaded only when the fingerprint changes or the
+    entry is older than ``ttl``.
+    """
+
+    def __init__(self, ttl: float = SCHEMA_CACHE_TTL):
+        self.ttl = ttl
+        self.tables: list[dict] | None = None
+        self.text: str | None = None
+        self.index: SchemaIndex | None = None
+        self._rendered: dict[str, str] = {}
+        self.fingerprint: str | None = None
+        self.loaded_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        """Drop the cached schema so the next lookup reloads it."""
+        self.tables = None
+        self.text = None
+        self.index = None
+        self._rendered = {}
+        self.fingerprint = None
+
+    def render(self, fmt: str) -> str:
+        """The full schema rendered in ``fmt``, memoized until the next reload."""
+        if fmt not in self._rendered:
+            self._rendered[fmt] = render_tables(self.tables, fmt)
+        return self._rendered[fmt]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "tables": len(self.tables) if self.tables is not None else 0,
+            "age_seconds": (
+                round(time.monotonic() - self.loaded_at, 1)
+                if self.tables is not None else None
+            ),
+        }
+
+    async def get(self, pool: asyncpg.Pool) -> SchemaCache:
+        """Return this cache, refreshed from the database if it is stale."""
+        async with self._lock:
+            fingerprint = await pool.fetchval(_FINGERPRINT_QUERY, DB_SCHEMAS)
+            fresh = (
+                self.tables is not None
+                and self.ttl > 0
+                and time.monotonic() - self.loaded_at < self.ttl
+                and fingerprint == self.fingerprint
+            )
+            if fresh:
+                self.hits += 1
+                return self
+
+            self.misses += 1
+            rows = await pool.fetch(_SCHEMA_QUERY, DB_SCHEMAS)
+            fk_rows = await pool.fetch(_FOREIGN_KEY_QUERY, DB_SCHEMAS)
+            self.tables = _parse_tables(rows, fk_rows)
+            self.text = render_tables(self.tables)
+            self.index = SchemaIndex(self.tables)
+            self._rendered = {"json": self.text}
+            self.fingerprint = fingerprint
+            self.loaded_at = time.monotonic()
+            logger.info(
+                f"[ 🗂️ schema_cache ] Loaded {len(self.tables)} tables "
+                f"(fingerprint {fingerprint})"
+            )
+            return self
+
+
+_schema_cache = SchemaCache()
+
+
+async def get_schema(pool: asyncpg.Pool) -> SchemaCache | None:
+    """
+    Return the schema cache, refreshed if stale.
+
+    If the database can't be reached the last good schema is served;
+    ``None`` when there is none.
     """
     try:
-        rows = await pool.fetch(query)
-        result = [
-            {"table_name": row["table_name"], "columns": json.loads(row["columns"])}
-            for row in rows
-        ]
-        return json.dumps(result, indent=2)
+        return await _schema_cache.get(pool)
     except Exception as e:
-        logger.warning(f"[ ⚠️ list_tables ] Schema query failed: {e}")
-        return "(Could not fetch schema info)"
+        logger.warning(f"[ ⚠️ get_schema ] Schema query failed: {e}")
+        return _schema_cache if _schema_cache.tables is not None else None
+
+
+async def load_schema(pool: asyncpg.Pool) -> list[dict]:
+    """Return the parsed schema (``[{table_name, columns, …}]``), served from cache."""
+    schema = await get_schema(pool)
+    return schema.tables if schema else []
+
+
+async def list_tables(pool: asyncpg.Pool) -> str:
+    """Return the full schema as prompt text, served from cache when unchanged."""
+    schema = await get_schema(pool)
+    return schema.text if schema else "(Could not fetch schema info)"
+
+
+def cache_stats() -> dict:
+    """Counters for every in-process cache."""
+    return {
+        "schema_cache": _schema_cache.stats(),
+        "plan_cache": _plan_cache.stats(),
+        "result_cache": _result_cache.stats(),
+    }
+
+
+# ── Cost guard ────────────────────────────────────────────────────────────────
+
+_plan_cache = LRUCache(EXPLAIN_CACHE_SIZE, ttl=EXPLAIN_CACHE_TTL)
+
+
+def _summarize_plan(plan: dict) -> dict:
+    """Pull the estimates the cost guard cares about out of an EXPLAIN plan."""
+    root = plan["Plan"]
+    seq_scans = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.get("Node Type") == "Seq Scan" and node.get("Total Cost", 0) >= EXPLAIN_SEQSCAN_MIN_COST:
+            seq_scans.append({
+                "table": node.get("Relation Name"),
+                "rows": node.get("Plan Rows", 0),
+                "cost": node.get("Total Cost", 0),
+            })
+        stack.extend(node.get("Plans", []))
+    return {
+        "cost": root.get("Total Cost", 0),
+        "rows": root.get("Plan Rows", 0),
+        "seq_scans": seq_scans,
+    }
+
+
+def _format_plan(summary: dict) -> str:
+    text = f"estimated cost {summary['cost']:,.0f}, ~{summary['rows']:,.0f} rows"
+    if summary["seq_scans"]:
+        scans = ", ".join(
+            f"{s['table']} (~{s['rows']:,.0f} rows, cost {s['cost']:,.0f})"
+            for s in summary["seq_scans"]
+        )
+        text += f"; sequential scans on {scans}"
+    return text
+
+
+async def _explain(conn: asyncpg.Connection, query: str) -> dict:
+    """Plan summary for ``query``, cached by normalized query text."""
+    key = normalize_sql(query)
+    summary = _plan_cache.get(key)
+    if summary is None:
+        raw = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}")
+        plan = json.loads(raw) if isinstance(raw, str) else raw
+        summary = _summarize_plan(plan[0])
+        _plan_cache.put(key, summary)
+    return summary
+
+
+def _check_plan(summary: dict):
+    """Raise if the plan's estimates exceed the configured limits."""
+    over = []
+    if summary["cost"] > EXPLAIN_MAX_COST:
+        over.append(f"cost limit of {EXPLAIN_MAX_COST:,.0f}")
+    if summary["rows"] > EXPLAIN_MAX_ROWS:
+        over.append(f"row limit of {EXPLAIN_MAX_ROWS:,.0f}")
+    if over:
+        raise ValueError(
+            f"Query rejected by the cost guard — it exceeds the "
+            f"{' and the '.join(over)}. Plan: {_format_plan(summary)}. "
+            f"Write a cheaper query (filter on indexed columns, aggregate, "
+            f"or add a LIMIT)"
+        )
+
+
+# ── Result cache ──────────────────────────────────────────────────────────────
+
+_result_cache = LRUCache(ttl=RESULT_CACHE_TTL, max_bytes=RESULT_CACHE_MAX_BYTES)
+
+
+def invalidate_result_cache(tables: list[str] | None = None) -> int:
+    """
+    Drop cached results that read any of ``tables`` (bare or schema-qualified
+    names), or everything when ``tables`` is None. Returns the entries dropped.
+    """
+    if tables is None:
+        return _result_cache.invalidate()
+    names = {t.strip().lower().removeprefix("public.") for t in tables}
+    dropped = _result_cache.invalidate(names)
+    logger.info(f"[ 🧹 invalidate_result_cache ] {sorted(names)} → {dropped} entries dropped")
+    return dropped
 
 
 # ── Query execution ──────────────────────────────────────────────────────────
 
-async def execute_sql(pool: asyncpg.Pool, action: dict) -> str:
-    """Execute a readonly SQL query and return JSON results."""
+# set_config(..., true) is SET LOCAL — the limits end with the transaction
+_SET_QUERY_LIMITS = """
+    SELECT set_config('statement_timeout', $1, true),
+           set_config('lock_timeout', $2, true),
+           set_config('work_mem', $3, true);
+"""
+
+
+async def _apply_query_limits(conn: asyncpg.Connection):
+    """Apply the configured per-query limits to the current transaction."""
+    await conn.execute(
+        _SET_QUERY_LIMITS,
+        str(STATEMENT_TIMEOUT_MS),
+        str(LOCK_TIMEOUT_MS),
+        QUERY_WORK_MEM,
+    )
+
+
+async def _fetch_bounded(
+    conn: asyncpg.Connection,
+    query: str,
+    fmt: str,
+    estimated_rows: float | None = None,
+    profile: str = "off",
+    max_chars: int = MAX_RESULT_CHARS,
+) -> tuple[str, int, bool, int]:
+    """
+    Stream ``query`` through a server-side cursor, encoding rows in ``fmt``
+    as they arrive and stopping once ``max_chars`` / MAX_RESULT_ROWS is
+    spent.
+
+    With ``profile`` "auto", a result that doesn't fit is read on (up to
+    RESULT_PROFILE_MAX_ROWS rows / RESULT_PROFILE_MAX_SECONDS) and returned
+    as a column profile plus a sample of the first rows instead; "always"
+    does that for any result.
+
+    Must run inside a transaction. Returns (text, rows_shown, truncated,
+    baseline_chars), the last being the size the shown rows would have had
+    as indent=2 JSON (estimated, see RowBaseline).
+    """
+    cursor = await conn.cursor(query)
+    encoder: RowEncoder | None = None
+    profiler: ResultProfiler | None = None
+    parts: list[str] = []
+    size = 0
+    baseline = RowBaseline(fmt)
+    read = 0  # rows fetched from the cursor, shown or not
+    truncated = False
+    exhausted = False
+
+    while not truncated:
+        chunk = await cursor.fetch(RESULT_FETCH_ROWS)
+        exhausted = len(chunk) < RESULT_FETCH_ROWS
+        read += len(chunk)
+        if chunk and encoder is None:
+            columns = list(chunk[0].keys())
+            encoder = RowEncoder(fmt, columns)
+            size = len(encoder.begin()) + len(encoder.end())
+            if profile != "off":
+                profiler = ResultProfiler(columns)
+        if profiler is not None:
+            profiler.add(chunk)
+        for row in chunk:
+            encoded = encoder.row(row.values())
+            if len(parts) >= MAX_RESULT_ROWS or size + len(encoded) > max_chars:
+                if not parts:
+                    # A single row bigger than the budget — show what fits
+                    parts.append(encoded[: max_chars - size])
+                truncated = True
+                break
+            parts.append(encoded)
+            size += len(encoded) + len(encoder.separator)
+            baseline.add(row, encoded)
+        if exhausted:
+            break
+
+    if encoder is None:
+        text = empty_result(fmt)
+        return text, 0, False, len("[]")
+
+    if profiler is not None and (truncated or profile == "always"):
+        # Read the rest of the result for the profile, in bigger chunks
+        deadline = time.monotonic() + RESULT_PROFILE_MAX_SECONDS
+        while (
+            not exhausted
+            and profiler.rows < RESULT_PROFILE_MAX_ROWS
+            and time.monotonic() < deadline
+        ):
+            want = min(RESULT_PROFILE_FETCH_ROWS, RESULT_PROFILE_MAX_ROWS - profiler.rows)
+            chunk = await cursor.fetch(want)
+            profiler.add(chunk)
+            exhausted = len(chunk) < want
+        if not exhausted:
+            exhausted = not await cursor.fetch(1)
+        sample = parts[:RESULT_PROFILE_SAMPLE_ROWS]
+        text = (
+            f"{profiler.render(complete=exhausted)}\n\n"
+            f"Sample (first {len(sample)} rows):\n"
+            f"{encoder.begin()}{encoder.separator.join(sample)}{encoder.end()}"
+        )
+        return text, len(sample), truncated, baseline.chars
+
+    text = encoder.begin() + encoder.separator.join(parts) + encoder.end()
+    if truncated:
+        # Reading stopped with the last chunk — its rows are all we know of
+        total = f"{read:,} rows" if exhausted else f"at least {read:,} rows"
+        if estimated_rows:
+            total += f", planner estimate ~{estimated_rows:,.0f}"
+        text += (
+            f"\n…[truncated: showing the first {len(parts)} rows, the query "
+            f"returned {total} — add a LIMIT, filter or aggregate]"
+        )
+    return text, len(parts), truncated, baseline.chars
+
+
+async def execute_sql(
+    pool: asyncpg.Pool,
+    action: dict,
+    fmt: str = RESULT_FORMAT,
+    stats: EncodingStats | None = None,
+    max_chars: int = MAX_RESULT_CHARS,
+) -> str:
+    """
+    Execute a readonly SQL query and return the results encoded in ``fmt``
+    (see agent/encoding.py), in at most about ``max_chars`` characters.
+    ``stats`` tallies the characters saved against indent=2 JSON.
+
+    The query runs in a READ ONLY transaction under the configured
+    statement_timeout / lock_timeout / work_mem, after an optional EXPLAIN
+    cost check (EXPLAIN_GUARD). Rows are read in chunks
+    from a server-side cursor and the cursor is abandoned as soon as the
+    result budget is spent, so a query without a LIMIT never pulls the
+    whole table into memory. Cancelling the calling task cancels the
+    query on the server.
+
+    ``"profile": true`` in the action returns per-column profiles instead
+    of rows (``false`` never does); otherwise RESULT_PROFILE decides.
+
+    Results are cached by normalized SQL (see RESULT_CACHE_*), so re-running
+    the same query — in a retry, a later step or another request — is free.
+    Queries calling now(), random(), nextval() and the like never are.
+    """
     query = action.get("query", "")
+    profile = RESULT_PROFILE
+    if "profile" in action:
+        profile = "always" if action["profile"] else "off"
 
     logger.info(f"[ 🔍 execute_sql ] {query[:200]}")
 
     _validate_readonly(query)
 
-    rows = await pool.fetch(query)
+    check_format(fmt)
+    normalized = normalize_sql(query)
+    key = f"{fmt}:{profile}:{max_chars}:{normalized}"
+    cached = _result_cache.get(key)
+    if cached is not None:
+        text, baseline = cached
+        logger.info(f"[ ⚡ execute_sql ] Result cache hit ({len(text)} chars)")
+        if stats is not None:
+            stats.add(len(text), baseline)
+        return text
 
-    # Convert asyncpg Records to dicts
-    result = [dict(row) for row in rows]
-    text = json.dumps(result, indent=2, default=str)
+    try:
+        async with pool.acquire() as conn:
+            # Cursors only live inside a transaction; leaving it closes the portal
+            async with conn.transaction(readonly=True):
+                await _apply_query_limits(conn)
+                sql = query.strip().rstrip(";")
+                estimated_rows = None
+                if EXPLAIN_GUARD:
+                    plan = await _explain(conn, sql)
+                    _check_plan(plan)
+                    estimated_rows = plan["rows"]
+                text, rows, truncated, baseline = await _fetch_bounded(
+                    conn, sql, fmt, estimated_rows, profile, max_chars,
+                )
+    except asyncpg.exceptions.QueryCanceledError:
+        raise RuntimeError(
+            f"Query cancelled — it ran longer than the {STATEMENT_TIMEOUT_MS} ms "
+            f"statement_timeout. Write a cheaper query (filter on indexed "
+            f"columns, aggregate, or add a LIMIT)"
+        ) from None
+    except asyncpg.exceptions.LockNotAvailableError:
+        raise RuntimeError(
+            f"Query cancelled — waited longer than the {LOCK_TIMEOUT_MS} ms "
+            f"lock_timeout for a table lock. Try again or query another table"
+        ) from None
+
+    logger.info(
+        f"[ 📊 execute_sql ] {rows} rows, {len(text)} chars"
+        f"{' (truncated)' if truncated else ''}"
+    )
 
-    if len(text) > MAX_RESULT_CHARS:
-        text = text[:MAX_RESULT_CHARS] + "\n…[truncated]"
+    if stats is not None:
+        stats.add(len(text), baseline)
 
+    tables = referenced_tables(normalized)
+    if not tables & RESULT_CACHE_SKIP_TABLES and not is_volatile(normalized):
+        _result_cache.put(key, (text, baseline), size=len(text.encode()), tags=tables)
     return text
 
+
+async def execute_sql_batch(
+    pool: asyncpg.Pool,
+    actions: list[dict],
+    fmt: str = RESULT_FORMAT,
+    stats: EncodingStats | None = None,
+) -> list[str | Exception]:
+    """
+    Run independent queries concurrently, each on its own pool connection
+    (see :func:`execute_sql`), and return their results in order.
+
+    The MAX_RESULT_CHARS budget is split evenly between the queries, so a
+    batch costs no more prompt than one query. A query that fails returns
+    its exception instead of failing the others.
+    """
+    if not actions:
+        raise ValueError("sql_batch needs a non-empty \"queries\" list")
+    if len(actions) > SQL_BATCH_MAX_QUERIES:
+        raise ValueError(
+            f"sql_batch takes at most {SQL_BATCH_MAX_QUERIES} queries "
+            f"(got {len(actions)}) — split them over several steps"
+        )
+    max_chars = MAX_RESULT_CHARS // len(actions)
+    logger.info(f"[ 🔍 execute_sql_batch ] {len(actions)} queries, {max_chars} chars each")
+    return await asyncio.gather(
+        *(execute_sql(pool, a, fmt=fmt, stats=stats, max_chars=max_chars) for a in actions),
+        return_exceptions=True,
+    )
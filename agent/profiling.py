@@ -0,0 +1,198 @@
+"""
+agent/profiling.py — Column-wise profiles of query results, computed in-process.
+
+When a result is too large to show, the LLM gets a profile of every column
+(count, nulls, min/max, distinct estimate, top values, numeric quantiles)
+plus a small sample instead of the first few KB of raw rows.
+
+Rows are consumed chunk by chunk and column by column, leaning on C-level
+builtins (min/max/set/Counter/slicing) so hundreds of thousands of rows
+profile quickly, and memory stays bounded:
+
+  - distinct counts are exact up to _EXACT_DISTINCT values, then switch to a
+    K-minimum-values sketch
+  - top values are tracked in a Counter that is pruned when it grows large
+  - quantiles come from a systematic sample of at most _QUANTILE_SAMPLE values
+"""
+from __future__ import annotations
+
+import heapq
+import json
+from collections import Counter
+from itertools import repeat
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+_EXACT_DISTINCT = 20_000
+_KMV_K = 1024
+_TOP_TRACKED = 5_000
+_QUANTILE_SAMPLE = 10_000
+_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Hashing (value, salt) tuples runs the tuple hash's xxHash-style mixing, so
+# even sequential ints (whose own hash is the int) spread evenly over the
+# signed 64-bit range — and map(hash, …) keeps it in C
+_SALT = 0x5BD1E995
+_HASH_SPAN = 2.0 ** 64
+_HASH_MIN = -(2 ** 63)
+
+
+def _hashes(values) -> set[int]:
+    return set(map(hash, zip(values, repeat(_SALT))))
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def _fmt(value) -> str:
+    if isinstance(value, float):
+        if abs(value) >= 1e15:
+            return f"{value:.3e}"
+        if abs(value) >= 1000:
+            return f"{value:,.0f}"
+        return f"{value:,.2f}" if abs(value) >= 1 else f"{value:.4g}"
+    if isinstance(value, (int, Decimal)) and not isinstance(value, bool):
+        return f"{value:,}"
+    text = str(value)
+    return text if len(text) <= 40 else text[:37] + "…"
+
+
+class ColumnProfile:
+    """Streaming statistics for one column."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.kind: str | None = None  # "number", "temporal", "other" or "json"
+        self.count = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.total = 0.0
+        self._distinct: set | None = set()
+        self._kmv: list[int] = []  # K smallest hashes, once past _EXACT_DISTINCT
+        self._top: Counter = Counter()
+        self._sample: list = []
+        self._stride = 1
+        self._numbers_seen = 0
+
+    def add(self, column: tuple):
+        values = [v for v in column if v is not None]
+        self.nulls += len(column) - len(values)
+        if not values:
+            return
+        if self.kind is None:
+            first = values[0]
+            if _is_number(first):
+                self.kind = "number"
+            elif isinstance(first, (date, datetime, time, timedelta)):
+                self.kind = "temporal"
+            elif isinstance(first, (list, dict)):
+                self.kind = "json"
+            else:
+                self.kind = "other"
+        if self.kind == "json":
+            values = [json.dumps(v, default=str, sort_keys=True) for v in values]
+
+        self.count += len(values)
+        self._add_range(values)
+        self._add_distinct(values)
+        self._add_top(values)
+        if self.kind == "number":
+            self._add_numbers(values)
+
+    def _add_range(self, values: list):
+        try:
+            lo, hi = min(values), max(values)
+            self.min = lo if self.min is None else min(self.min, lo)
+            self.max = hi if self.max is None else max(self.max, hi)
+        except TypeError:
+            pass  # mixed, unorderable values
+
+    def _add_distinct(self, values: list):
+        if self._distinct is not None:
+            self._distinct.update(values)
+            if len(self._distinct) <= _EXACT_DISTINCT:
+                return
+            values, self._distinct = list(self._distinct), None
+        hashes = _hashes(values)
+        if len(self._kmv) == _KMV_K:
+            threshold = self._kmv[-1]
+            hashes = [h for h in hashes if h < threshold]
+            if not hashes:
+                return
+        self._kmv = heapq.nsmallest(_KMV_K, set(self._kmv).union(hashes))
+
+    def _add_top(self, values: list):
+        self._top.update(values)
+        if len(self._top) > _TOP_TRACKED * 10:
+            self._top = Counter(dict(self._top.most_common(_TOP_TRACKED)))
+
+    def _add_numbers(self, values: list):
+        self.total += float(sum(values))
+        # Keep every stride-th value (by global position); halve the sample
+        # and double the stride whenever it outgrows _QUANTILE_SAMPLE
+        start = (-self._numbers_seen) % self._stride
+        self._sample.extend(values[start::self._stride])
+        self._numbers_seen += len(values)
+        while len(self._sample) > _QUANTILE_SAMPLE:
+            self._sample = self._sample[::2]
+            self._stride *= 2
+
+    @property
+    def distinct(self) -> tuple[int, bool]:
+        """(distinct count, exact?)"""
+        if self._distinct is not None:
+            return len(self._distinct), True
+        if len(self._kmv) < _KMV_K:
+            return len(self._kmv), False
+        kth = (self._kmv[-1] - _HASH_MIN) / _HASH_SPAN
+        return int((_KMV_K - 1) / kth), False
+
+    def quantiles(self) -> list[tuple[float, float]]:
+        if not self._sample:
+            return []
+        ordered = sorted(float(v) for v in self._sample)
+        last = len(ordered) - 1
+        return [(q, ordered[round(q * last)]) for q in _QUANTILES]
+
+    def render(self) -> str:
+        parts = [f"nulls {self.nulls:,}"]
+        if self.count:
+            distinct, exact = self.distinct
+            parts.append(f"distinct {'' if exact else '~'}{distinct:,}")
+            if self.min is not None:
+                parts.append(f"min {_fmt(self.min)}")
+                parts.append(f"max {_fmt(self.max)}")
+            if self.kind == "number":
+                parts.append(f"mean {_fmt(self.total / self.count)}")
+                parts += [f"p{round(q * 100)} {_fmt(v)}" for q, v in self.quantiles()]
+            top = [(v, n) for v, n in self._top.most_common(5) if n > 1]
+            if top and (self.kind != "number" or distinct <= 20):
+                parts.append(
+                    "top: " + ", ".join(f"{_fmt(v)} ({n:,})" for v, n in top)
+                )
+        kind = self.kind or "all null"
+        return f"- {self.name} ({kind}): " + " · ".join(parts)
+
+
+class ResultProfiler:
+    """Profiles a result set chunk by chunk."""
+
+    def __init__(self, columns: list[str]):
+        self.columns = [ColumnProfile(c) for c in columns]
+        self.rows = 0
+
+    def add(self, rows: list):
+        """Feed a chunk of rows (tuples or asyncpg Records)."""
+        if not rows:
+            return
+        self.rows += len(rows)
+        for profile, column in zip(self.columns, zip(*rows)):
+            profile.add(column)
+
+    def render(self, complete: bool) -> str:
+        scope = "all rows" if complete else "first rows only — profile row / time limit reached"
+        lines = [f"Result profile: {self.rows:,} rows ({scope}), {len(self.columns)} columns"]
+        lines += [c.render() for c in self.columns]
+        return "\n".join(lines)
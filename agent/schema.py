@@ -0,0 +1,266 @@
+"""
+agent/schema.py — Schema selection and browsing for the agent prompt.
+
+Ranks the cached tables against the user GOAL with BM25 over tokenized
+table names, column names and comments, so the first prompt only carries
+the tables that matter (plus their foreign-key neighbours). The browsing
+helpers back the list_tables / describe_table / search_columns actions,
+all served from the cached catalog.
+"""
+from __future__ import annotations
+
+import difflib
+import math
+import re
+from collections import Counter
+
+from agent.encoding import EncodingStats, encode_tables
+
+# ── Tokenization ──────────────────────────────────────────────────────────────
+
+# Splits snake_case, camelCase and digits: "orderItemsV2" → order, items, v, 2
+_TOKEN_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by did do does for from has have how i in is it "
+    "many me much of on or our show the their them there this to was we what "
+    "when where which who why with".split()
+)
+
+# Table names are what the GOAL usually mentions, so they count extra
+_TABLE_NAME_WEIGHT = 3
+
+
+def _stem(token: str) -> str:
+    """Crude plural folding so "users" matches "user" and "categories" "category"."""
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str | None) -> list[str]:
+    """Split identifiers / prose into lowercase, plural-folded terms."""
+    if not text:
+        return []
+    return [
+        _stem(tok.lower())
+        for tok in _TOKEN_RE.findall(text)
+        if tok.lower() not in _STOPWORDS
+    ]
+
+
+def _table_terms(table: dict) -> list[str]:
+    terms = tokenize(table["table_name"]) * _TABLE_NAME_WEIGHT
+    terms += tokenize(table.get("comment"))
+    for col in table.get("columns", []):
+        terms += tokenize(col.get("column"))
+        terms += tokenize(col.get("comment"))
+    return terms
+
+
+# ── BM25 index ────────────────────────────────────────────────────────────────
+
+class SchemaIndex:
+    """BM25 index over the tables of a schema, with a foreign-key graph."""
+
+    def __init__(self, tables: list[dict], k1: float = 1.5, b: float = 0.75):
+        self.tables = tables
+        self.k1 = k1
+        self.b = b
+
+        self.docs = [Counter(_table_terms(t)) for t in tables]
+        self.lengths = [sum(d.values()) for d in self.docs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if tables else 1.0
+
+        n = len(tables)
+        df = Counter(term for doc in self.docs for term in doc)
+        self.idf = {
+            term: math.log(1 + (n - freq + 0.5) / (freq + 0.5))
+            for term, freq in df.items()
+        }
+
+        # Undirected FK graph: a table is a neighbour of the tables it
+        # references and of the tables that reference it
+        by_name = {t["table_name"]: i for i, t in enumerate(tables)}
+        self.neighbours: list[set[int]] = [set() for _ in tables]
+        for i, table in enumerate(tables):
+            for ref in table.get("references", []):
+                j = by_name.get(ref)
+                if j is not None and j != i:
+                    self.neighbours[i].add(j)
+                    self.neighbours[j].add(i)
+
+    def scores(self, query: str) -> list[float]:
+        """BM25 score of every table for ``query``."""
+        terms = set(tokenize(query))
+        scores = []
+        for doc, length in zip(self.docs, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / self.avg_length)
+            score = 0.0
+            for term in terms:
+                tf = doc.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+    def select(self, query: str, top_k: int) -> list[dict]:
+        """
+        Return the ``top_k`` best-matching tables followed by their FK
+        neighbours (at most ``top_k`` of those, best-scoring first).
+        Empty when nothing in the schema matches the query.
+        """
+        scores = self.scores(query)
+        ranked = sorted(
+            (i for i, s in enumerate(scores) if s > 0),
+            key=lambda i: scores[i],
+            reverse=True,
+        )
+        chosen = ranked[:top_k]
+        if not chosen:
+            return []
+
+        picked = set(chosen)
+        neighbours = sorted(
+            {j for i in chosen for j in self.neighbours[i]} - picked,
+            key=lambda j: scores[j],
+            reverse=True,
+        )
+        return [self.tables[i] for i in chosen + neighbours[:top_k]]
+
+
+# ── Prompt selection ──────────────────────────────────────────────────────────
+
+def render_tables(tables: list[dict], fmt: str = "json") -> str:
+    """Render tables the way they are shown to the LLM."""
+    return encode_tables(tables, fmt)
+
+
+def select_schema(
+    tables: list[dict],
+    index: SchemaIndex,
+    full_text: str,
+    goal: str,
+    top_k: int,
+    min_tables: int,
+    max_chars: int,
+    page_size: int = 200,
+    fmt: str = "json",
+    stats: EncodingStats | None = None,
+    json_chars: int | None = None,
+) -> str:
+    """
+    Pick the schema text for the first prompt.
+
+    Small schemas (``min_tables`` or fewer) are sent in full; otherwise only
+    the top-K tables and their FK neighbours. When nothing matches the GOAL
+    the full schema is sent if it fits in ``max_chars``, else just the
+    first page of table names for the agent to browse from.
+
+    ``full_text`` must already be rendered in ``fmt``; ``stats`` records the
+    characters sent against the indent=2 JSON baseline, given as the length
+    of the full schema in that layout (``json_chars``, e.g. the cached
+    SchemaCache.text) and scaled down for a subset.
+    """
+    # Baseline chars per char of ``fmt`` — no re-rendering just for the stats
+    ratio = (json_chars or len(full_text)) / max(len(full_text), 1)
+
+    def sent(text: str) -> str:
+        if stats is not None:
+            stats.add(len(text), round(len(text) * ratio))
+        return text
+
+    if len(tables) <= min_tables and len(full_text) <= max_chars:
+        return sent(full_text)
+
+    selected = index.select(goal, top_k)
+    if selected:
+        return sent(
+            f"(Showing {len(selected)} of {len(tables)} tables ranked by relevance "
+            f"to the GOAL — use list_tables, search_columns or describe_table "
+            f"to find others.)\n"
+            f"{render_tables(selected, fmt)}"
+        )
+
+    if len(full_text) <= max_chars:
+        return sent(full_text)
+    return (
+        "(No table obviously matches the GOAL — use describe_table on the "
+        "tables you need, or search_columns.)\n"
+        f"{list_table_names(tables, page_size=page_size)}"
+    )
+
+
+# ── Browsing ──────────────────────────────────────────────────────────────────
+
+def _schema_of(table_name: str) -> str:
+    return table_name.split(".", 1)[0] if "." in table_name else "public"
+
+
+def list_table_names(
+    tables: list[dict],
+    page: int = 1,
+    page_size: int = 200,
+    schema: str | None = None,
+) -> str:
+    """One page of table names (with column counts), optionally for one schema."""
+    if schema:
+        tables = [t for t in tables if _schema_of(t["table_name"]) == schema]
+    pages = max(1, math.ceil(len(tables) / page_size))
+    page = min(max(1, page), pages)
+    chunk = tables[(page - 1) * page_size : page * page_size]
+
+    lines = [f"{t['table_name']} ({len(t.get('columns', []))} columns)" for t in chunk]
+    header = f"Tables (page {page}/{pages}, {len(tables)} total"
+    header += f" in schema {schema!r})" if schema else ")"
+    if page < pages:
+        lines.append(f"… use \"page\": {page + 1} for more")
+    return "\n".join([header + ":"] + lines)
+
+
+def _find_table(tables: list[dict], name: str) -> dict:
+    by_name = {t["table_name"].lower(): t for t in tables}
+    key = name.strip().strip('"').lower()
+    if key in by_name:
+        return by_name[key]
+    # Allow "public.users" for "users" and a bare name for a qualified table
+    bare = key.split(".", 1)[1] if key.startswith("public.") else key
+    if bare in by_name:
+        return by_name[bare]
+    matches = [t for k, t in by_name.items() if k.rsplit(".", 1)[-1] == bare]
+    if len(matches) == 1:
+        return matches[0]
+
+    close = difflib.get_close_matches(key, by_name, n=5)
+    candidates = [m["table_name"] for m in matches] or close
+    hint = f" Did you mean: {', '.join(candidates)}?" if candidates else ""
+    raise ValueError(f"Unknown table {name!r}.{hint}")
+
+
+def describe_tables(tables: list[dict], names: list[str], fmt: str = "json") -> str:
+    """Full column detail for the named tables."""
+    if not names:
+        raise ValueError("describe_table needs a \"tables\" list of table names")
+    return render_tables([_find_table(tables, n) for n in names], fmt)
+
+
+def search_columns(tables: list[dict], pattern: str, limit: int = 50) -> str:
+    """Find columns whose name or comment contains ``pattern`` (case-insensitive)."""
+    needle = pattern.strip().lower()
+    if not needle:
+        raise ValueError("search_columns needs a non-empty \"pattern\"")
+
+    hits = []
+    for table in tables:
+        for col in table.get("columns", []):
+            if needle in col["column"].lower() or needle in (col.get("comment") or "").lower():
+                hits.append(f"{table['table_name']}.{col['column']}  {col.get('type', '')}".rstrip())
+
+    if not hits:
+        return f"No columns match {pattern!r}."
+    lines = hits[:limit]
+    if len(hits) > limit:
+        lines.append(f"… {len(hits) - limit} more matches — use a more specific pattern")
+    return "\n".join([f"Columns matching {pattern!r} ({len(hits)}):"] + lines)
@@ -10,10 +10,207 @@ from __future__ import annotations
 import argparse
 import asyncio
 import sys
+import time
 
-from agent.config import DEFAULT_ENDPOINT, DEFAULT_MODEL, DEFAULT_API_KEY
+import asyncpg
+
+from agent.config import (
+    DEFAULT_ENDPOINT,
+    DEFAULT_MODEL,
+    DEFAULT_API_KEY,
+    MAX_RESULT_CHARS,
+    RESULT_FORMAT,
+    SCHEMA_PAGE_SIZE,
+    SCHEMA_PRUNE_MIN_TABLES,
+    SCHEMA_SEARCH_LIMIT,
+    SCHEMA_TOP_K,
+)
 from agent.agent import DataAgent
-from agent.postgres_client import get_pool, list_tables, execute_sql
+from agent.encoding import RESULT_FORMATS, EncodingStats, check_format, estimate_tokens
+from agent.events import ConsoleSink, RunEvents
+from agent.history import batch_section
+from agent.parsing import ActionParseError
+from agent.postgres_client import (
+    SchemaCache,
+    execute_sql,
+    execute_sql_batch,
+    get_pool,
+    get_schema,
+)
+from agent.schema import describe_tables, list_table_names, search_columns, select_schema
+
+
+# ── Schema actions ───────────────────────────────────────────────────────────
+
+_SCHEMA_ACTIONS = ("list_tables", "describe_table", "search_columns", "full_schema")
+
+
+def _schema_action(schema: SchemaCache | None, action: dict, fmt: str) -> str:
+    """Answer a schema browsing action from the cached catalog."""
+    if schema is None:
+        raise RuntimeError("Schema info is unavailable")
+
+    act = action.get("action")
+    if act == "list_tables":
+        return list_table_names(
+            schema.tables,
+            page=int(action.get("page") or 1),
+            page_size=SCHEMA_PAGE_SIZE,
+            schema=action.get("schema"),
+        )
+
+    if act == "describe_table":
+        names = action.get("tables") or action.get("table") or []
+        if isinstance(names, str):
+            names = [names]
+        return describe_tables(schema.tables, names, fmt)
+
+    if act == "search_columns":
+        return search_columns(
+            schema.tables, action.get("pattern", ""), limit=SCHEMA_SEARCH_LIMIT,
+        )
+
+    # full_schema
+    full = schema.render(fmt)
+    if len(full) > MAX_RESULT_CHARS:
+        raise ValueError(
+            f"The full schema has {len(schema.tables)} tables and is too large "
+            f"to send — use list_tables, search_columns or describe_table instead"
+        )
+    return f"Full schema:\n{full}"
+
+
+# ── Query batches ────────────────────────────────────────────────────────────
+
+async def _sql_batch(
+    pool: asyncpg.Pool,
+    action: dict,
+    fmt: str,
+    stats: EncodingStats,
+    events: RunEvents,
+    early: bool = False,
+) -> str:
+    """Run a sql_batch action's queries concurrently; one labelled section per query."""
+    queries = action.get("queries") or []
+    if not isinstance(queries, list):
+        raise ValueError("sql_batch needs a \"queries\" list")
+    # Accept bare query strings as well as {"query", "label", "profile"} objects
+    actions = [{"query": q} if isinstance(q, str) else q for q in queries]
+
+    labels = [a.get("label") or f"query {i}" for i, a in enumerate(actions, 1)]
+    for i, (a, label) in enumerate(zip(actions, labels), 1):
+        events.emit(
+            "sql", query=a.get("query"), profile=bool(a.get("profile")), early=early,
+            index=i, label=label,
+        )
+
+    start = time.time()
+    results = await execute_sql_batch(pool, actions, fmt=fmt, stats=stats)
+    seconds = round(time.time() - start, 3)
+    sections = []
+    for i, (label, result) in enumerate(zip(labels, results), 1):
+        if isinstance(result, Exception):
+            events.emit("error", message=str(result), index=i, label=label)
+            body = f"ERROR: {result}"
+        else:
+            events.emit(
+                "result", action="sql", chars=len(result), seconds=seconds, index=i, label=label,
+            )
+            body = f"Query result:\n{result}"
+        sections.append(batch_section(i, label, body))
+    events.emit("result", action="sql_batch", queries=len(actions), seconds=seconds, chars=None)
+    return f"Query results ({len(actions)} queries):\n\n" + "\n\n".join(sections)
+
+
+# ── Early dispatch ───────────────────────────────────────────────────────────
+
+# Fields an early-dispatched action must share with the final one
+_DISPATCH_KEYS = {"sql": ("query", "profile"), "sql_batch": ("queries",)}
+
+
+class _EarlyQuery:
+    """
+    Starts a sql / sql_batch action's queries on the pool as soon as they
+    are complete in the streamed reply, while the model is still writing the
+    rest of it (usually the reason). :meth:`take` hands the result over once
+    the whole reply is parsed, or drops it if the final action differs.
+
+    The early run is tallied in its own EncodingStats, added to the run's
+    ``stats`` only when its result is taken — a dropped one is never sent.
+    """
+
+    def __init__(self, pool: asyncpg.Pool, fmt: str, stats: EncodingStats, events: RunEvents):
+        self.pool = pool
+        self.fmt = fmt
+        self.stats = stats
+        self.events = events
+        self._stats = EncodingStats(fmt)
+        self.action: dict | None = None
+        self.task: asyncio.Task | None = None
+
+    def on_field(self, key: str, value, fields: dict):
+        if self.task is not None:
+            return
+        act = fields.get("action")
+        if key == "query" and act in (None, "sql") and isinstance(value, str):
+            self.action = {"action": "sql", "query": value, "profile": fields.get("profile")}
+            run = _timed_sql(self.pool, self.action, self.fmt, self._stats, self.events, early=True)
+        elif key == "queries" and act in (None, "sql_batch") and isinstance(value, list):
+            self.action = {"action": "sql_batch", "queries": value}
+            run = _sql_batch(self.pool, self.action, self.fmt, self._stats, self.events, early=True)
+        else:
+            return
+        self.events.emit(
+            "notice", kind="early_query",
+            message=f"{self.action['action']} started while the reply is still streaming",
+        )
+        self.task = asyncio.create_task(run)
+
+    async def take(self, action: dict) -> str | None:
+        """The early result if it ran exactly ``action``; None (and cancelled) otherwise."""
+        if self.task is None:
+            return None
+        act = action.get("action")
+        if act == self.action["action"] and all(
+            (action.get(k) or None) == (self.action.get(k) or None) for k in _DISPATCH_KEYS[act]
+        ):
+            result = await self.task
+            self.stats.add(self._stats.chars, self._stats.baseline_chars)
+            return result
+        self.events.emit(
+            "notice", kind="early_dropped",
+            message="Final action differs from the streamed one — early query dropped",
+        )
+        self.cancel()
+        return None
+
+    def cancel(self):
+        if self.task is None:
+            return
+        if not self.task.done():
+            self.task.cancel()
+        elif not self.task.cancelled():
+            self.task.exception()  # retrieved, so asyncio doesn't warn about it
+
+
+async def _timed_sql(
+    pool: asyncpg.Pool,
+    action: dict,
+    fmt: str,
+    stats: EncodingStats,
+    events: RunEvents,
+    early: bool = False,
+) -> tuple[str, float]:
+    """execute_sql, reporting the query; returns the result and the seconds it took."""
+    events.emit("sql", query=action.get("query"), profile=bool(action.get("profile")), early=early)
+    start = time.time()
+    data = await execute_sql(pool, action, fmt=fmt, stats=stats)
+    return data, round(time.time() - start, 3)
+
+
+def _emit_encoding_stats(events: RunEvents, stats: EncodingStats):
+    summary = stats.summary()
+    events.emit("encoding", **summary, tokens_sent_est=estimate_tokens(summary["chars"]))
 
 
 # ── Main loop ────────────────────────────────────────────────────────────────
@@ -24,19 +221,50 @@ async def run_agent(
     model: str,
     api_key: str = "no-key",
     max_steps: int = 10,
+    pool: asyncpg.Pool | None = None,
+    result_format: str = RESULT_FORMAT,
+    events: RunEvents | None = None,
 ):
-    agent = DataAgent(endpoint, model, api_key)
-    pool = await get_pool()
+    """
+    Run the agent loop until it answers or runs out of steps.
+
+    Pass a shared ``pool`` (as the API does) to reuse its connections;
+    otherwise a pool is created for this run and closed afterwards.
+    ``result_format`` picks how query results and schema are encoded.
+
+    Progress is reported to ``events`` (see agent/events.py) — printed to
+    stdout when none is given. With STREAM_COMPLETIONS, queries start as
+    soon as they are complete in the streamed reply, and the answer's text
+    is reported as the model writes it.
+    """
+    check_format(result_format)
+    events = events or RunEvents(ConsoleSink())
+    stats = EncodingStats(result_format)
+    agent = DataAgent(endpoint, model, api_key, events=events)
+    owns_pool = pool is None
+    if owns_pool:
+        pool = await get_pool()
 
     try:
-        # Fetch schema info so the agent knows what tables are available
-        schema_info = await list_tables(pool)
+        # Fetch schema info so the agent knows what tables are available,
+        # pruned to the tables relevant to the goal on large databases
+        schema = await get_schema(pool)
+        if schema is None:
+            schema_info = "(Could not fetch schema info)"
+        else:
+            schema_info = select_schema(
+                schema.tables, schema.index, schema.render(result_format), prompt,
+                top_k=SCHEMA_TOP_K, min_tables=SCHEMA_PRUNE_MIN_TABLES,
+                max_chars=MAX_RESULT_CHARS, page_size=SCHEMA_PAGE_SIZE,
+                fmt=result_format, stats=stats, json_chars=len(schema.text),
+            )
 
-        print(f"\n{'═'*60}")
-        print(f"  Available Schema")
-        print(f"{'═'*60}\n")
-        print(schema_info)
-        print(f"\n{'═'*60}\n")
+        events.emit(
+            "schema",
+            tables=len(schema.tables) if schema else 0,
+            chars=len(schema_info),
+            text=schema_info,
+        )
 
         for step in range(1, max_steps + 1):
             user_msg = (
@@ -48,48 +276,86 @@ async def run_agent(
             if step > 1:
                 user_msg = f"GOAL: {prompt}\n\nPrevious query returned data. Decide what to do next."
 
-            print(f"\n{'─'*60}")
-            print(f"  Step {step}/{max_steps}")
+            events.emit("step", step=step, max_steps=max_steps)
 
-            raw = agent.chat(user_msg)
+            early = _EarlyQuery(pool, result_format, stats, events)
 
-            action = agent.parse_action(raw)
-            if action is None:
-                print(f"  ⚠️  Could not parse action:\n{raw[:300]}")
+            def on_text(key: str, delta: str, fields: dict):
+                if key == "text" and fields.get("action") == "answer":
+                    events.emit("answer_delta", text=delta)
+
+            try:
+                # The first message carries the GOAL and schema — never compacted
+                action = await agent.next_action(
+                    user_msg, pinned=step == 1, on_field=early.on_field, on_text=on_text,
+                )
+            except ActionParseError as e:
+                early.cancel()
+                events.emit("error", message=f"Could not parse action: {e}")
+                agent.add_error(f"Your reply was not a valid action: {e}")
                 continue
+            except BaseException:
+                early.cancel()
+                raise
 
             act = action.get("action")
-            reason = action.get("reason", "")
-            print(f"  Action: {act}  —  {reason}")
+            # The answer's text has its own event
+            detail = {k: v for k, v in action.items() if k not in ("type", "text")}
+            events.emit("action", **{**detail, "reason": action.get("reason", "")})
 
             try:
                 if act == "answer":
                     result = action.get("text", "")
-                    print(f"\n{'═'*60}")
-                    print(f"  ✅  AGENT ANSWER:\n\n{result}")
-                    print(f"{'═'*60}\n")
+                    events.emit("answer", text=result)
+                    _emit_encoding_stats(events, stats)
+                    events.emit("done", success=True, steps=step, result=result)
                     return result
 
                 elif act == "sql":
-                    data = await execute_sql(pool, action)
-                    print(f"  📊  Query returned {len(data)} chars of data")
-                    agent.history.append(
-                        {"role": "user", "content": f"Query result:\n{data}"}
+                    early_result = await early.take(action)
+                    data, seconds = early_result or await _timed_sql(
+                        pool, action, result_format, stats, events,
+                    )
+                    events.emit("result", action=act, chars=len(data), seconds=seconds)
+                    agent.add_result(f"Query result:\n{data}", result_format)
+
+                elif act == "sql_batch":
+                    data = await early.take(action)
+                    if data is None:
+                        data = await _sql_batch(pool, action, result_format, stats, events)
+                    agent.add_result(data, result_format)
+
+                elif act in _SCHEMA_ACTIONS:
+                    start = time.time()
+                    info = _schema_action(schema, action, result_format)
+                    events.emit(
+                        "result", action=act, chars=len(info),
+                        seconds=round(time.time() - start, 3),
                     )
+                    agent.add_result(info)
 
                 else:
-                    print(f"  ⚠️  Unknown action: {act}")
+                    events.emit("notice", kind="unknown_action", message=f"Unknown action: {act}")
 
             except Exception as e:
                 err_msg = f"Action '{act}' failed: {e}"
-                print(f"  ❌  {err_msg}")
+                events.emit("error", message=err_msg)
                 agent.add_error(err_msg)
 
-        print(f"\n⚠️  Reached max steps ({max_steps}) without an answer.")
+            finally:
+                early.cancel()
+
+        _emit_encoding_stats(events, stats)
+        events.emit(
+            "done", success=False, steps=max_steps,
+            error=f"Reached max steps ({max_steps}) without an answer.",
+        )
         return None
 
     finally:
-        await pool.close()
+        await agent.close()
+        if owns_pool:
+            await pool.close()
 
 
 # ── CLI ──────────────────────────────────────────────────────────────────────
@@ -109,6 +375,12 @@ def main():
     parser.add_argument(
         "--max-steps", type=int, default=10, help="Max interaction steps (default: 10)"
     )
+    parser.add_argument(
+        "--format",
+        choices=RESULT_FORMATS,
+        default=RESULT_FORMAT,
+        help=f"Encoding for query results and schema (default: {RESULT_FORMAT})",
+    )
 
     args = parser.parse_args()
 
@@ -119,6 +391,7 @@ def main():
             model=args.model,
             api_key=args.api_key,
             max_steps=args.max_steps,
+            result_format=args.format,
         )
     )
 
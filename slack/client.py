@@ -3,7 +3,10 @@ slack/client.py — Async HTTP client that calls the deployed Thufir API.
 """
 from __future__ import annotations
 
+import codecs
+import json
 import logging
+from typing import AsyncIterator
 
 import aiohttp
 
@@ -14,7 +17,8 @@ logger = logging.getLogger(__name__)
 
 async def run_agent(prompt: str, max_steps: int | None = None) -> dict:
     """
-    Call the Thufir /run endpoint and return the JSON response.
+    Call the Thufir /run endpoint and return the JSON response. Used by
+    :func:`stream_agent` against APIs that don't have /run/stream yet.
 
     Returns dict with keys: success (bool), result (str|None), error (str|None)
     Raises on network / HTTP errors.
@@ -52,3 +56,88 @@ async def run_agent(prompt: str, max_steps: int | None = None) -> dict:
         logger.error(f"[ 🌐 run_agent ] Unexpected error: {e}")
         raise
 
+
+async def stream_agent(prompt: str, max_steps: int | None = None) -> AsyncIterator[dict]:
+    """
+    Call the Thufir /run/stream endpoint and yield its Server-Sent Events as
+    dicts (see agent/events.py) while the run goes on.
+
+    The last event is always ``done`` with keys success (bool), result
+    (str|None), error (str|None) — also when the API answers with an error.
+    An API without /run/stream (404) is called through :func:`run_agent`
+    instead, yielding only ``done``. Raises on network errors.
+    """
+    payload = {
+        "prompt": prompt,
+        "max_steps": max_steps or THUFIR_MAX_STEPS,
+    }
+
+    api_url = f"{THUFIR_API_URL}/run/stream"
+    logger.info(f"[ 🌐 stream_agent ] Calling API: {api_url}")
+    logger.info(f"[ 🌐 stream_agent ] Payload: prompt={prompt!r}, max_steps={payload['max_steps']}")
+
+    timeout = aiohttp.ClientTimeout(total=THUFIR_API_TIMEOUT)
+
+    try:
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.post(
+                api_url, json=payload, headers={"Accept": "text/event-stream"},
+            ) as resp:
+                logger.info(f"[ 🌐 stream_agent ] API response status: {resp.status}")
+                if resp.status == 200:
+                    async for event in _read_events(resp):
+                        yield event
+                    return
+                if resp.status != 404:
+                    text = await resp.text()
+                    logger.error(f"[ 🌐 stream_agent ] API error: {resp.status} - {text[:500]}")
+                    yield {
+                        "type": "done",
+                        "success": False,
+                        "result": None,
+                        "error": f"API returned {resp.status}: {text[:500]}",
+                    }
+                    return
+                logger.warning(
+                    "[ 🌐 stream_agent ] No /run/stream on this API — falling back to /run"
+                )
+        # Outside the session, so run_agent doesn't hold two of them
+        result = await run_agent(prompt, max_steps)
+        yield {**result, "type": "done"}
+    except aiohttp.ClientError as e:
+        logger.error(f"[ 🌐 stream_agent ] Connection error: {e}")
+        raise
+    except Exception as e:
+        logger.error(f"[ 🌐 stream_agent ] Unexpected error: {e}")
+        raise
+
+
+async def _read_events(resp: aiohttp.ClientResponse) -> AsyncIterator[dict]:
+    """The Server-Sent Events of a /run/stream response, ending with ``done``."""
+    done = False
+    # Events can be longer than aiohttp's line limit (the schema),
+    # so split the stream into lines here
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    data: list[str] = []
+    async for chunk in resp.content.iter_any():
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            line = line.rstrip("\r")
+            if line.startswith("data:"):
+                data.append(line[5:].lstrip())
+            elif not line and data:
+                # A blank line ends the event; "event:" repeats the type
+                event = json.loads("\n".join(data))
+                data = []
+                done = event.get("type") == "done"
+                yield event
+    if not done:
+        logger.error("[ 🌐 stream_agent ] Stream ended without a result")
+        yield {
+            "type": "done",
+            "success": False,
+            "result": None,
+            "error": "The API closed the stream before the run finished",
+        }
@@ -27,3 +27,6 @@ THUFIR_MAX_STEPS = int(os.environ.get("THUFIR_MAX_STEPS", "10"))
 # Timeout in seconds for waiting on the Thufir API
 THUFIR_API_TIMEOUT = int(os.environ.get("THUFIR_API_TIMEOUT", "120"))
 
+# Min seconds between edits of the bot's progress message while a run streams
+# (Slack rate-limits chat.update to about one call per second per channel)
+THUFIR_UPDATE_INTERVAL = float(os.environ.get("THUFIR_UPDATE_INTERVAL", "1.5"))
@@ -10,11 +10,13 @@ from __future__ import annotations
 
 import logging
 import re
+import time
 import traceback
 
 from slack_bolt.async_app import AsyncApp
 
-from slack.client import run_agent
+from slack.client import stream_agent
+from slack.config import THUFIR_UPDATE_INTERVAL
 
 logger = logging.getLogger(__name__)
 
@@ -24,10 +26,86 @@ def _extract_prompt(text: str) -> str:
     return re.sub(r"<@[A-Z0-9]+>\s*", "", text).strip()
 
 
-async def _process_prompt(prompt: str, say, thread_ts: str | None = None):
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+class _StatusMessage:
+    """
+    The bot's "working on it" reply, edited in place as the run's events
+    arrive: the current step and what it is doing, then the answer while it
+    is being written, and finally the result.
+    """
+
+    def __init__(self, client, say, posted, prompt: str, thread_ts: str | None):
+        self.client = client
+        self.say = say
+        self.channel = posted["channel"] if posted else None
+        self.ts = posted["ts"] if posted else None
+        self.thread_ts = thread_ts
+        self.header = f"I'm working on it...\n> _{prompt}_"
+        self.lines: list[str] = []
+        self.answer = ""
+        self._shown: str | None = None
+        self._last = 0.0
+
+    async def on_event(self, event: dict):
+        kind = event["type"]
+        if kind == "step":
+            self.lines = [f":hourglass_flowing_sand: Step {event['step']}/{event['max_steps']}"]
+            self.answer = ""
+        elif kind == "action" and event["action"] != "answer":
+            self.lines.append(f"*{event['action']}* — {_clip(event.get('reason') or '', 200)}")
+        elif kind == "sql":
+            self.lines.append(f"```{_clip(event['query'], 500)}```")
+        elif kind == "result" and event.get("chars") is not None:
+            label = f"{event['label']}: " if event.get("label") else ""
+            self.lines.append(
+                f":bar_chart: {label}{event['chars']:,} chars in {event['seconds']:.1f}s"
+            )
+        elif kind == "error":
+            self.lines.append(f":warning: {_clip(event['message'], 300)}")
+        elif kind == "answer_delta":
+            self.answer += event["text"]
+        else:
+            return
+        await self._show()
+
+    def _text(self) -> str:
+        if self.answer:
+            return f":writing_hand: *Thufir is answering…*\n\n{self.answer}"
+        return "\n".join([self.header, *self.lines])
+
+    async def _show(self):
+        text = self._text()
+        # chat.update is rate limited — skipped edits are caught up by the next one
+        if text == self._shown or time.monotonic() - self._last < THUFIR_UPDATE_INTERVAL:
+            return
+        await self._update(text)
+
+    async def _update(self, text: str) -> bool:
+        if self.ts is None:
+            return False
+        try:
+            await self.client.chat_update(channel=self.channel, ts=self.ts, text=text)
+        except Exception as e:
+            logger.warning(f"[ ⚠️ _StatusMessage ] chat.update failed: {e}")
+            return False
+        self._shown = text
+        self._last = time.monotonic()
+        return True
+
+    async def finish(self, text: str):
+        """Replace the progress with ``text`` — posted as a new reply if that fails."""
+        if not await self._update(text):
+            await self.say(text, thread_ts=self.thread_ts)
+
+
+async def _process_prompt(prompt: str, say, client, thread_ts: str | None = None):
     """
-    Shared logic: call the Thufir API and post the result back to Slack.
-    All replies are posted in the same thread as the original message.
+    Shared logic: stream a run from the Thufir API and show its progress in
+    Slack, then the result. All replies are posted in the same thread as the
+    original message; the progress message is edited in place.
     """
     if not prompt:
         await say(
@@ -36,22 +114,28 @@ async def _process_prompt(prompt: str, say, thread_ts: str | None = None):
         )
         return
 
-    # Let the user know the agent is working
-    await say(f"I'm working on it...\n> _{prompt}_", thread_ts=thread_ts)
+    # Let the user know the agent is working — this message then shows progress
+    posted = await say(f"I'm working on it...\n> _{prompt}_", thread_ts=thread_ts)
+    status = _StatusMessage(client, say, posted, prompt, thread_ts)
 
     try:
-        result = await run_agent(prompt)
+        result: dict = {}
+        async for event in stream_agent(prompt):
+            if event["type"] == "done":
+                result = event
+            else:
+                await status.on_event(event)
 
         if result.get("success"):
-            answer = result.get("result", "(no result)")
-            await say(f":white_check_mark: *Thufir result:*\n\n{answer}", thread_ts=thread_ts)
+            answer = result.get("result") or "(no result)"
+            await status.finish(f":white_check_mark: *Thufir result:*\n\n{answer}")
         else:
-            error = result.get("error", "Unknown error")
-            await say(f":x: Agent failed: {error}", thread_ts=thread_ts)
+            error = result.get("error") or "Unknown error"
+            await status.finish(f":x: Agent failed: {error}")
 
     except Exception as e:
         logger.error(f"[ 🔥 _process_prompt ] {traceback.format_exc()}")
-        await say(f":x: Something went wrong calling the Thufir API:\n```{e}```", thread_ts=thread_ts)
+        await status.finish(f":x: Something went wrong calling the Thufir API:\n```{e}```")
 
 
 def register_handlers(app: AsyncApp):
@@ -61,29 +145,29 @@ def register_handlers(app: AsyncApp):
 
     # ── Slash command: /thufir ────────────────────────────────────────────────
     @app.command("/thufir")
-    async def handle_thufir_command(ack, body, say):
+    async def handle_thufir_command(ack, body, say, client):
         """Handle /thufir <prompt>."""
         logger.info(f"[ 🎯 handle_thufir_command ] Received command: {body}")
         await ack()
         prompt = (body.get("text") or "").strip()
         logger.info(f"[ 🎯 handle_thufir_command ] prompt={prompt!r}")
         # Slash commands don't have a thread_ts, so replies go to channel
-        await _process_prompt(prompt, say)
+        await _process_prompt(prompt, say, client)
 
     # ── App mention: @thufir <prompt> ─────────────────────────────────────────
     @app.event("app_mention")
-    async def handle_app_mention(event, say):
+    async def handle_app_mention(event, say, client):
         """Handle @thufir mentions in channels."""
         logger.info(f"[ 💬 handle_app_mention ] Received event: {event}")
         raw_text = event.get("text", "")
         prompt = _extract_prompt(raw_text)
         thread_ts = event.get("thread_ts") or event.get("ts")
         logger.info(f"[ 💬 handle_app_mention ] prompt={prompt!r}")
-        await _process_prompt(prompt, say, thread_ts=thread_ts)
+        await _process_prompt(prompt, say, client, thread_ts=thread_ts)
 
     # ── Direct messages ───────────────────────────────────────────────────────
     @app.event("message")
-    async def handle_dm(event, say):
+    async def handle_dm(event, say, client):
         """Handle direct messages sent to the bot."""
         logger.info(f"[ 📩 handle_dm ] Received message event: {event}")
         # Only respond in DMs (channel type 'im')
@@ -98,7 +182,7 @@ def register_handlers(app: AsyncApp):
         prompt = (event.get("text") or "").strip()
         thread_ts = event.get("thread_ts") or event.get("ts")
         logger.info(f"[ 📩 handle_dm ] prompt={prompt!r}")
-        await _process_prompt(prompt, say, thread_ts=thread_ts)
+        await _process_prompt(prompt, say, client, thread_ts=thread_ts)
     
     # ── Debug: Catch-all event handler to see ALL events ────────────────────────
     @app.event({"type": re.compile(".*")})
@@ -0,0 +1,64 @@
+"""
+tests/test_audit_jobs.py — Leasing and resuming of background audit jobs.
+
+Run with ``python -m unittest discover tests`` from the repo root.
+"""
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from agent import audit_jobs
+from agent.audit_store import JobStore
+
+
+async def _slow_audit(**kwargs):
+    await asyncio.sleep(60)
+
+
+class AttemptsTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+        for patch in (
+            mock.patch.object(audit_jobs, "run_content_audit", _slow_audit),
+            mock.patch.object(audit_jobs, "AUDIT_JOB_CHECKPOINT_SECONDS", 0.01),
+            mock.patch.object(audit_jobs, "AUDIT_JOB_LEASE_SECONDS", 0.05),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(os.remove, self.path)
+
+    def attempts(self, job_id: str) -> tuple[int, str]:
+        job = JobStore(self.path).get(job_id)
+        return job["attempts"], job["status"]
+
+    async def test_clean_shutdowns_do_not_count(self):
+        jobs = audit_jobs.AuditJobs(self.path)
+        job_id = jobs.start({}, pool=None)
+        await asyncio.sleep(0.02)
+        for _ in range(2):
+            await jobs.shutdown()
+            jobs = audit_jobs.AuditJobs(self.path)
+            self.assertEqual(jobs.resume(pool=None), 1)
+            await asyncio.sleep(0.02)
+        self.assertEqual(self.attempts(job_id), (1, "running"))
+        await jobs.shutdown()
+
+    async def test_expired_leases_count(self):
+        jobs = audit_jobs.AuditJobs(self.path)
+        job_id = jobs.start({}, pool=None)
+        for resumed in (1, 1, 0):
+            # The instance dies: no more heartbeats and no release
+            jobs._lost.add(job_id)
+            jobs._tasks[job_id].cancel()
+            await asyncio.sleep(0.1)
+            jobs = audit_jobs.AuditJobs(self.path)
+            self.assertEqual(jobs.resume(pool=None), resumed)
+        self.assertEqual(self.attempts(job_id), (audit_jobs._MAX_ATTEMPTS, "failed"))
+        await jobs.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()